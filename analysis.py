@@ -0,0 +1,199 @@
+# Jacqueline Lewis
+# analysis.py
+
+
+# This file measures the colour of the vials in each picture, so the colour
+# change of a reaction can be followed instead of judged by eye. The vials
+# are regions of interest (ROIs) in rois.json, in the picture folder or next
+# to this file. Each picture is decoded at a reduced size straight from the
+# JPEG (draft mode), and the red, green and blue values inside each region
+# are summarised from their histograms with NumPy. Pictures are measured by
+# a pool with a process per core; each process keeps the region masks it
+# has built, since every picture of a run has the same size.
+
+# The results of a folder are saved next to its sensor log, one file per
+# light: analysis.A.csv ... analysis.F.csv, and analysis.dark.csv.
+
+# rois.json:
+#	{"version": 1, "regions": [
+#		{"name": "vial1", "shape": "ellipse", "box": [389, 648, 648, 1296]},
+#		...]}
+# boxes are (left, top, right, bottom) in full resolution pixels; shapes are
+# "ellipse" or "rectangle".
+
+# Usage (measures every picture of a folder):
+#	>>> python analysis.py pictures/run1
+
+
+import concurrent.futures
+import csv
+import json
+import os
+import sys
+import threading
+
+import archive
+import catalog
+import thumbs
+
+ROIS = "rois.json"
+DEFAULT_ROIS = os.path.join(os.path.dirname(os.path.abspath(__file__)), ROIS)
+VERSION = 1
+SCALE = 4 # pictures are decoded at 1/SCALE of their size
+CHANNELS = ["R","G","B"]
+STATS = ["mean","median","std","p10","p90"]
+COLUMNS = (["time","illumination","pressure","oxygen","picture","region"] +
+	[c + "_" + s for c in CHANNELS for s in STATS])
+
+_masks = {} # (rois file, modified time, picture size, decoded size): regions
+
+
+# These functions return the ROI file of a folder and the results file of a
+# light in a folder.
+
+def roiPath(folder):
+	path = os.path.join(folder, ROIS)
+	if os.path.isfile(path): return path
+	if os.path.isfile(DEFAULT_ROIS): return DEFAULT_ROIS
+	return None
+
+def resultPath(folder, light):
+	return os.path.join(folder, "analysis.%s.csv" % (light or "dark"))
+
+
+# This function returns the regions of a picture as (name, rows, columns,
+# mask) at the decoded size; the mask covers only the region's box. Without
+# an ROI file the whole picture is one region.
+
+def regions(path, size, decoded):
+	import numpy as np
+	key = (path, path and os.path.getmtime(path), size, decoded)
+	if key in _masks: return _masks[key]
+	width,height = decoded
+	if path is None:
+		found = [("picture",slice(0,height),slice(0,width),None)]
+	else:
+		with open(path) as f:
+			rois = json.load(f)
+		if rois.get("version") != VERSION:
+			raise ValueError("Unsupported ROI version %r" % rois.get("version"))
+		sx,sy = float(width)/size[0],float(height)/size[1]
+		found = []
+		for region in rois["regions"]:
+			left,top,right,bottom = region["box"]
+			x0,x1 = max(0,int(left*sx)),min(width,int(round(right*sx)))
+			y0,y1 = max(0,int(top*sy)),min(height,int(round(bottom*sy)))
+			mask = None
+			if region.get("shape","rectangle") == "ellipse":
+				y,x = np.ogrid[y0:y1,x0:x1]
+				cx,cy = (left+right)/2.0*sx,(top+bottom)/2.0*sy
+				rx,ry = (right-left)/2.0*sx,(bottom-top)/2.0*sy
+				mask = ((x+0.5-cx)/rx)**2 + ((y+0.5-cy)/ry)**2 <= 1
+			found.append((region["name"],slice(y0,y1),slice(x0,x1),mask))
+	_masks[key] = found
+	return found
+
+
+# This function returns the mean, median, standard deviation and 10th and
+# 90th percentiles of 8 bit values from their histogram.
+
+def histogramStats(values):
+	import numpy as np
+	counts = np.bincount(values, minlength=256)
+	total = counts.sum()
+	if total == 0: return [float("nan")]*len(STATS)
+	levels = np.arange(256)
+	mean = float((counts*levels).sum())/total
+	std = (float((counts*(levels-mean)**2).sum())/total)**0.5
+	cumulative = np.cumsum(counts)
+	percentiles = [int(np.searchsorted(cumulative, total*p)) for p in
+		(0.5,0.1,0.9)]
+	return [round(mean,3),percentiles[0],round(std,3),percentiles[1],
+		percentiles[2]]
+
+
+# This function measures one picture and returns its light and a row of
+# COLUMNS per region. It runs in a pool process.
+
+def measure(path):
+	import numpy as np
+	from PIL import Image
+	entry = catalog.readPicture(path)
+	if entry is None: return None
+	picture,taken,light,illumination,pressure,oxygen = entry[:6]
+	image = Image.open(archive.openImage(path))
+	size = image.size
+	image.draft("RGB", (size[0]//SCALE,size[1]//SCALE))
+	pixels = np.asarray(image.convert("RGB"))
+	rows = []
+	for name,ys,xs,mask in regions(roiPath(os.path.dirname(path)), size,
+			(pixels.shape[1],pixels.shape[0])):
+		box = pixels[ys,xs]
+		values = box.reshape(-1,3) if mask is None else box[mask]
+		row = [taken,illumination,pressure,oxygen,os.path.basename(path),name]
+		for channel in range(3):
+			row += histogramStats(values[:,channel])
+		rows.append(row)
+	return light,rows
+
+
+# This class hands pictures to the pool and appends the results to the
+# files of their folders. The pool's processes are started when it is made,
+# so it should be made before any other thread starts.
+
+class Analyzer(object):
+
+	def __init__(self, workers=None):
+		self.pool = concurrent.futures.ProcessPoolExecutor(
+			workers or os.cpu_count(), initializer=thumbs.lowPriority)
+		self.pool.submit(int).result()
+		self.lock = threading.Lock()
+		self.measured = 0
+		self.errors = 0
+
+	def submit(self, paths):
+		futures = []
+		for path in paths:
+			future = self.pool.submit(measure, path)
+			future.add_done_callback(lambda future, path=path:
+				self.done(path, future))
+			futures.append(future)
+		return futures
+
+	def done(self, path, future):
+		if future.cancelled() or future.exception() is not None:
+			self.errors += 1
+			return
+		if future.result() is None: return
+		light,rows = future.result()
+		self.write(resultPath(os.path.dirname(path), light), rows)
+		self.measured += 1
+
+	def write(self, path, rows):
+		with self.lock:
+			exists = os.path.isfile(path)
+			with open(path, "a") as f:
+				writer = csv.writer(f)
+				if not exists: writer.writerow(COLUMNS)
+				writer.writerows(rows)
+
+	# This function measures every picture of a folder again, replacing its
+	# results. Rows are written as pictures finish, so they may not be in
+	# time order.
+	def analyzeFolder(self, folder):
+		for light in ["A","B","C","D","E","F",""]:
+			if os.path.isfile(resultPath(folder, light)):
+				os.remove(resultPath(folder, light))
+		return self.submit([os.path.join(folder, name) for name in
+			archive.listPictures(folder)])
+
+	def close(self, wait=True):
+		self.pool.shutdown(wait)
+
+
+if __name__ == "__main__":
+	analyzer = Analyzer()
+	futures = analyzer.analyzeFolder(sys.argv[1] if len(sys.argv) > 1 else ".")
+	concurrent.futures.wait(futures)
+	analyzer.close()
+	print("%d measured, %d failed" % (analyzer.measured, analyzer.errors))
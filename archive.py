@@ -0,0 +1,233 @@
+# Jacqueline Lewis
+# archive.py
+
+
+# This file moves the pictures of finished runs, and old pictures of the
+# current run, into zip shards so a multi-day run does not fill the SD
+# card with loose files. The shards of a folder are kept in its .archive
+# folder with an index of where each picture is, so a single picture can be
+# read (or sent by the web server) straight out of its shard without
+# unpacking anything. JPEGs are already compressed, so they are stored as
+# they are; other files are deflated. Thumbnails, previews, logs and results
+# stay where they are.
+
+# The archiver runs on a background thread. It copies at a limited rate and
+# waits while pictures are being taken, so it never competes with the camera
+# for the SD card.
+
+# Usage:
+#	>>> python archive.py pack pictures/run1	(archives a finished run now)
+#	>>> python archive.py list pictures/run1
+#	>>> python archive.py get pictures/run1 run1A:y19m06d18H12M00S00.jpg > a.jpg
+
+
+import io
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zipfile
+
+import catalog
+
+ARCHIVE = ".archive"
+INDEX = "index.jsonl"
+SHARD_SIZE = 256 << 20 # bytes
+LOCAL_HEADER = struct.Struct("<4s5HIIIHH") # zip local file header
+
+_indexes = {} # folder: (index modified time, {name: entry})
+
+
+def archivePath(folder):
+	return os.path.join(folder, ARCHIVE)
+
+def shardPath(folder, shard):
+	return os.path.join(archivePath(folder), "shard-%04d.zip" % shard)
+
+
+# This function returns the index of a folder's archive as {name: entry},
+# where an entry has the shard, offset and size of the picture's data and
+# whether it is compressed.
+
+def readIndex(folder):
+	path = os.path.join(archivePath(folder), INDEX)
+	if not os.path.isfile(path): return {}
+	modified = os.path.getmtime(path)
+	if folder in _indexes and _indexes[folder][0] == modified:
+		return _indexes[folder][1]
+	index = {}
+	with open(path) as f:
+		for line in f:
+			# a line cut short by a power cut is ignored
+			try: entry = json.loads(line)
+			except ValueError: continue
+			index[entry["name"]] = entry
+	_indexes[folder] = (modified,index)
+	return index
+
+
+# This function returns (shard file, offset, size) of an archived picture
+# stored without compression, so it can be sent straight from the shard, or
+# None.
+
+def locate(path):
+	folder,name = os.path.split(path)
+	entry = readIndex(folder).get(name)
+	if entry is None or entry["compressed"]: return None
+	return shardPath(folder, entry["shard"]),entry["offset"],entry["size"]
+
+# This function returns the contents of a picture, whether it is archived
+# or not.
+
+def readImage(path):
+	if os.path.isfile(path):
+		with open(path, "rb") as f: return f.read()
+	folder,name = os.path.split(path)
+	entry = readIndex(folder).get(name)
+	if entry is None: raise IOError("No such picture: " + path)
+	if entry["compressed"]:
+		with zipfile.ZipFile(shardPath(folder, entry["shard"])) as shard:
+			return shard.read(name)
+	with open(shardPath(folder, entry["shard"]), "rb") as f:
+		f.seek(entry["offset"])
+		return f.read(entry["size"])
+
+
+# This function returns a picture opened for reading, whether it is
+# archived or not.
+
+def openImage(path):
+	if os.path.isfile(path): return open(path, "rb")
+	return io.BytesIO(readImage(path))
+
+# This function returns the names of the pictures of a folder, archived or
+# not, in order.
+
+def listPictures(folder):
+	names = set(readIndex(folder))
+	if os.path.isdir(folder): names.update(os.listdir(folder))
+	return sorted(n for n in names if catalog.PICTURE.search(n))
+
+
+# This class archives the picture folders of the runs under a root folder.
+# Only the folders of known runs are archived, so nothing else under the
+# root is touched.
+
+class Archiver(threading.Thread):
+
+	# root: folder holding the picture folders
+	# runs: function returning the folders of the known runs
+	# active: function returning the folder of the current run
+	# busy: function returning whether pictures are being taken
+	# maxAge: hours after which pictures of the current run are archived
+	# rate: bytes per second copied
+	# period: seconds between looks for pictures to archive
+	def __init__(self, root=".", runs=lambda: (), active=lambda: None,
+			busy=lambda: False, maxAge=24, rate=2 << 20, period=600):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.root = root
+		self.runs = runs
+		self.active = active
+		self.busy = busy
+		self.maxAge = maxAge
+		self.rate = rate
+		self.period = period
+		self.stopping = threading.Event()
+		self.archived = 0
+		self.errors = 0
+
+	def run(self):
+		while not self.stopping.wait(self.period):
+			try: self.archiveAll()
+			except Exception as e:
+				self.errors += 1
+				print("Archiving failed: %s" % e)
+
+	def stop(self):
+		self.stopping.set()
+
+	def archiveAll(self):
+		active = self.active()
+		if active is not None:
+			active = os.path.normpath(os.path.join(self.root, active))
+		folders = set(os.path.normpath(os.path.join(self.root, folder))
+			for folder in self.runs())
+		if active is not None: folders.add(active)
+		for folder in sorted(folders):
+			if not os.path.isdir(folder): continue
+			names = sorted(n for n in os.listdir(folder) if
+				catalog.PICTURE.search(n))
+			if not names: continue
+			if folder == active:
+				oldest = time.time() - self.maxAge*3600
+				names = [n for n in names if
+					os.path.getmtime(os.path.join(folder, n)) < oldest]
+			self.pack(folder, names)
+			if self.stopping.is_set(): return
+
+	# This function moves files of a folder into its shards. Each file is
+	# saved in its shard and indexed before it is removed.
+	def pack(self, folder, names, throttle=True):
+		if not names: return
+		if not os.path.isdir(archivePath(folder)): os.makedirs(archivePath(folder))
+		index = readIndex(folder)
+		shard = max([e["shard"] for e in index.values()] or [1])
+		for name in names:
+			if self.stopping.is_set() and throttle: return
+			while throttle and self.busy() and not self.stopping.wait(1.0): pass
+			path = os.path.join(folder, name)
+			if name in index: # archived before a power cut removed it
+				os.remove(path)
+				continue
+			if (os.path.isfile(shardPath(folder, shard)) and
+					os.path.getsize(shardPath(folder, shard)) >= SHARD_SIZE):
+				shard += 1
+			started = time.time()
+			entry = self.add(folder, shard, name)
+			os.remove(path)
+			index[name] = entry
+			self.archived += 1
+			if throttle:
+				self.stopping.wait(max(0.0, float(entry["size"])/self.rate -
+					(time.time()-started)))
+
+	def add(self, folder, shard, name):
+		path = os.path.join(folder, name)
+		compress = zipfile.ZIP_STORED
+		if not name.lower().endswith(".jpg"): compress = zipfile.ZIP_DEFLATED
+		with zipfile.ZipFile(shardPath(folder, shard), "a", compress) as zipped:
+			zipped.write(path, name)
+			info = zipped.getinfo(name)
+		# the data follows the local header, whose extra field may differ
+		# from the central directory's
+		with open(shardPath(folder, shard), "rb") as f:
+			f.seek(info.header_offset)
+			header = LOCAL_HEADER.unpack(f.read(LOCAL_HEADER.size))
+			os.fsync(f.fileno())
+		entry = {"name":name, "shard":shard, "offset":info.header_offset +
+			LOCAL_HEADER.size + header[-2] + header[-1], "size":info.compress_size,
+			"compressed":compress != zipfile.ZIP_STORED, "crc":info.CRC,
+			"time":os.path.getmtime(path)}
+		with open(os.path.join(archivePath(folder), INDEX), "a") as f:
+			f.write(json.dumps(entry) + "\n")
+			f.flush()
+			os.fsync(f.fileno())
+		return entry
+
+
+if __name__ == "__main__":
+	command,folder = sys.argv[1],sys.argv[2]
+	if command == "pack":
+		archiver = Archiver()
+		archiver.pack(folder, sorted(n for n in os.listdir(folder) if
+			catalog.PICTURE.search(n)), False)
+		print("%d pictures archived" % archiver.archived)
+	elif command == "list":
+		for name,entry in sorted(readIndex(folder).items()):
+			print("%s\tshard %d\t%d bytes" % (name, entry["shard"], entry["size"]))
+	elif command == "get":
+		data = readImage(os.path.join(folder, sys.argv[3]))
+		getattr(sys.stdout, "buffer", sys.stdout).write(data)
@@ -1,54 +1,230 @@
-
 # calibrate_adc.py
 # Jacqueline Lewis
 
 # This file calibrates an adc for use with a photoreactor following the run.py
-# protocol. The values returned from these functions, when operated properly,
-# can be added to the initADC function in run.py in order to get accurate
+# protocol. The calibration is saved as a profile for the pi and adc it was
+# made on, which initADC in run.py loads at startup in order to get accurate
 # oxygen and pressure readings. These functions should be run each time a new
 # pi, adc, pressure sensor, or oxygen sensor is added to the system.
 
+# Each calibration point samples the adc as fast as it converts and stops as
+# soon as the 95% confidence interval of the mean is narrow enough, instead
+# of taking a fixed number of slow samples.
+
+# Usage:
+#	>>> python calibrate_adc.py		(oxygen and pressure in one session)
+#	>>> python calibrate_adc.py O2	(oxygen only)
+#	>>> python calibrate_adc.py P		(pressure only)
+#	>>> python calibrate_adc.py --kind ADS1015 --address 0x49
+#							(the profile of another adc)
+
+import argparse
+import json
+import math
+import os
+import sys
 import time
-import adafruit_ads1x15.differential as ads1x15
+
+import devices
+from devices import clock
+
+VERSION = 1
+PROFILES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+	"calibration")
+PRESSURE = 3 # adc channels
+OXYGEN = 0
+ATMOSPHERE = 1300 # pressure reading at atmosphere
+SPAN = 600 # pressure reading change from atmosphere to pressured
+AIR = 20.9 # oxygen percentage of air
+MINSPAN = 0.1 # least volts change from atmosphere to pressured
+GAIN = 1 # adc gain of the calibration readings
+
+# the fastest data rate of each adc
+MAXRATE = {"ADS1115":860, "ADS1015":3300}
+# raw counts of each adc at the 4.096 V full scale of gain 1
+FULLSCALE = {"ADS1115":32768, "ADS1015":2048}
+
+# This function returns the least raw change from atmosphere to pressured
+# that a calibration accepts, as the ADS1015 reads 16 times fewer counts.
+def minSpan(kind="ADS1115", gain=GAIN):
+	return MINSPAN*FULLSCALE[kind]*gain/4.096
 
 # This function gets a reading from the ADC
 def getreading(adc,channel):
 	return adc.read_adc_difference(channel)
 
-# This function builds an ADC. When using this function, make sure to update 
+# This function builds an ADC. When using this function, make sure to update
 # the ADS1x15 declaration to match the type of ADC being used. Failure to do so
 # will result in erroneous data.
-def buildADC():
-	return ads1x15.ADS1115()
+def buildADC(kind="ADS1115", address=0x48):
+	return devices.buildADC(kind, address=address)
+
+# This function returns the identity of this pi and adc, which names its
+# calibration profile.
+def identity(kind="ADS1115", address=0x48):
+	serial = "unknown"
+	if devices.BACKEND == "sim": serial = "sim"
+	elif os.path.isfile("/proc/cpuinfo"):
+		for line in open("/proc/cpuinfo"):
+			if line.startswith("Serial"): serial = line.split(":")[1].strip()
+	return "%s-%s-%02x" % (serial, kind, address)
+
+def profilePath(kind="ADS1115", address=0x48):
+	return os.path.join(PROFILES, identity(kind, address) + ".json")
+
+
+# This class keeps the running mean and variance of a channel (Welford's
+# method) and says when the mean is known well enough.
+
+class Estimate(object):
+
+	def __init__(self):
+		self.n = 0
+		self.mean = 0.0
+		self.m2 = 0.0
+		self.min = None
+		self.max = None
+
+	def add(self, x):
+		self.n += 1
+		diff = x-self.mean
+		self.mean += diff/self.n
+		self.m2 += diff*(x-self.mean)
+		if self.min == None or x < self.min: self.min = x
+		if self.max == None or x > self.max: self.max = x
+
+	# half width of the 95% confidence interval of the mean
+	def interval(self):
+		if self.n < 2: return float("inf")
+		return 1.96*math.sqrt(self.m2/(self.n-1)/self.n)
 
-# This function provides the oxygen calibration value. The oxygen sensor must 
+	def converged(self, tolerance, minSamples):
+		return self.n >= minSamples and self.interval() <= tolerance
+
+
+# This function samples the channels round-robin at the adc's fastest rate
+# until the mean of every channel is known to within tolerance (raw counts),
+# or maxSamples have been taken. Returns an Estimate per channel.
+
+def sample(adc, channels, kind="ADS1115", tolerance=2.0, minSamples=50,
+		maxSamples=20000):
+	rate = MAXRATE[kind]
+	scanner = devices.ContinuousScanner(adc, [(c,GAIN,rate) for c in channels],
+		burst=1)
+	estimates = [Estimate() for c in channels]
+	start = clock.time()
+	try:
+		while True:
+			for estimate,value in zip(estimates, scanner.read()):
+				estimate.add(value)
+			done = all(e.converged(tolerance, minSamples) for e in estimates)
+			if done or estimates[0].n >= maxSamples: break
+	finally: scanner.stop()
+	for channel,estimate in zip(channels, estimates):
+		print("channel %d: %.2f +/- %.2f from %d samples in %.1f s" % (channel,
+			estimate.mean, estimate.interval(), estimate.n, clock.time()-start))
+	return estimates
+
+# This function provides the oxygen calibration value. The oxygen sensor must
 # be open to atmosphere for this calibration.
-def O2calibrate():
-	adc = buildADC()
-	sumVals = 0
-	for i in range(100):
-		time.sleep(0.15)
-		val = getreading(adc, 0)
-		sumVals += val
-		print(val)
-	print("O2 calibration value: %f" % (20.9/(sumVals/100.0)))
-
-# This function provides the pressure calibration values. During the 
-# calibration, the photoreactor should go from atmospheric to pressured to 
-# give the full range of operation.
-def Pcalibrate():
-	adc = buildADC()
-	maxP = None
-	minP = None
-	for i in range(1000):
-		time.sleep(0.15)
-		val = getreading(adc, 0)
-		print(val)
-		if maxP == None or val > maxP: maxP = val
-		if minP == None or val < minP: minP = val
-	print("Pressure calibration value: %f" % (600/(maxP-minP)))
-	print("Pressure zeropoint: %f" % (minP))
-
-
-# O2calibrate()
-# Pcalibrate()
\ No newline at end of file
+def O2calibrate(kind="ADS1115", address=0x48):
+	adc = buildADC(kind, address)
+	O2 = sample(adc, [OXYGEN], kind)[0]
+	print("O2 calibration value: %f" % (AIR/O2.mean))
+	return saveProfile({"O2cal":AIR/O2.mean}, kind, address)
+
+# This function provides the pressure calibration values. The photoreactor
+# starts at atmosphere, and is pressured when asked to give the full range
+# of operation.
+def Pcalibrate(kind="ADS1115", address=0x48):
+	adc = buildADC(kind, address)
+	low = sample(adc, [PRESSURE], kind)[0]
+	return savePressure(adc, low, kind, address)
+
+# This function samples the pressured photoreactor and saves the pressure
+# calibration with values. A pressure change too small to have come from
+# pressuring the photoreactor raises ValueError, and nothing is saved.
+def savePressure(adc, low, kind, address, values=None):
+	waitFor("Pressure the photoreactor, then press enter", address)
+	high = sample(adc, [PRESSURE], kind)[0]
+	span = high.mean-low.mean
+	if span < max(minSpan(kind), 10*(high.interval()+low.interval())):
+		raise ValueError("The pressure only changed by %.1f; check the "
+			"photoreactor was pressured" % span)
+	print("Pressure calibration value: %f" % (SPAN/span))
+	print("Pressure zeropoint: %f" % (low.mean))
+	values = dict(values or {})
+	values.update({"Pcal":SPAN/span, "zero":[low.mean,ATMOSPHERE]})
+	return saveProfile(values, kind, address)
+
+# This function calibrates oxygen and pressure in one session. The
+# photoreactor starts open to atmosphere.
+def calibrate(kind="ADS1115", address=0x48):
+	adc = buildADC(kind, address)
+	O2,low = sample(adc, [OXYGEN,PRESSURE], kind)
+	print("O2 calibration value: %f" % (AIR/O2.mean))
+	return savePressure(adc, low, kind, address, {"O2cal":AIR/O2.mean})
+
+# This function waits for the user. The simulated photoreactor is pressured
+# to full range instead.
+def waitFor(prompt, address=0x48):
+	if devices.BACKEND == "sim":
+		print(prompt)
+		reactor = devices.simReactor(address)
+		reactor.update()
+		reactor.pressure = ATMOSPHERE+SPAN
+	else: input(prompt)
+
+
+####################################
+# profiles
+####################################
+
+# This function saves calibration values into the profile of this pi and
+# adc, keeping the values that were not recalibrated.
+def saveProfile(values, kind="ADS1115", address=0x48):
+	path = profilePath(kind, address)
+	profile = loadProfile(kind, address) or {}
+	profile.update(values)
+	profile.update({"version":VERSION, "identity":identity(kind, address),
+		"adc":kind, "address":address, "created":time.time()})
+	if not os.path.isdir(PROFILES): os.makedirs(PROFILES)
+	with open(path + ".tmp", "wt") as f:
+		json.dump(profile, f, indent=1, sort_keys=True)
+	os.rename(path + ".tmp", path)
+	print("Saved " + path)
+	return profile
+
+# This function returns the saved profile of this pi and adc, or None.
+def loadProfile(kind="ADS1115", address=0x48):
+	path = profilePath(kind, address)
+	if not os.path.isfile(path): return None
+	with open(path, "rt") as f:
+		profile = json.load(f)
+	if profile.get("version") != VERSION: return None
+	return profile
+
+# This function returns the (cal, zero) tuples used by run.py from the
+# profile of this pi and adc, or default if a value is not calibrated.
+def calibration(default, kind="ADS1115", address=0x48):
+	cal,zero = default
+	profile = loadProfile(kind, address)
+	if profile is None: return cal,zero
+	cal = (profile.get("Pcal",cal[0]), profile.get("O2cal",cal[1]))
+	zero = tuple(profile.get("zero",zero))
+	return cal,zero
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Calibrates an adc.")
+	parser.add_argument("what", nargs="?", choices=["O2","P"],
+		help="calibrate only the oxygen or the pressure")
+	parser.add_argument("--kind", default="ADS1115", choices=sorted(MAXRATE))
+	parser.add_argument("--address", default=0x48, type=lambda a: int(a,0),
+		help="I2C address of the adc, e.g. 0x49")
+	args = parser.parse_args()
+	try:
+		if args.what == "O2": O2calibrate(args.kind, args.address)
+		elif args.what == "P": Pcalibrate(args.kind, args.address)
+		else: calibrate(args.kind, args.address)
+	except ValueError as e: sys.exit(str(e))
@@ -0,0 +1,89 @@
+# Jacqueline Lewis
+# capture.py
+
+
+# This file takes pictures on a worker thread, so that the user interface,
+# the sensors and the degas control keep running while the camera works.
+# A job is a list of steps (functions taking no arguments) that the worker
+# runs in order, e.g. light on, capture, light off. When a job is finished
+# its callback is handed back to the user interface thread through finish().
+# The names and captions of pictures, shared by run.py and multireactor.py,
+# are made here too.
+
+
+import queue
+import threading
+import time
+
+
+# This function returns the name of the picture of a folder taken at time t
+# under light letter ("" for none).
+
+def pictureName(folder, letter, t):
+	return (folder + "/" + folder.split("/")[-1] + letter +
+		time.strftime(":y%ym%md%dH%HM%MS%S.jpg", time.localtime(t)))
+
+# This function returns the title, pressure and oxygen lines written on a
+# picture and into its comment. Illumination is in seconds.
+
+def captions(illumination, pressure, O2):
+	return ("Total Illumination: " + str(round(illumination/60.0,2)) +
+		" minutes", "Pressure: " + str(int(pressure)), "Oxygen: " + str(O2))
+
+
+# This class runs capture jobs one at a time. The job queue is bounded: if
+# the camera falls behind, submit() refuses new jobs instead of letting them
+# pile up.
+
+class CaptureWorker(threading.Thread):
+
+	def __init__(self, maxJobs=2):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.jobs = queue.Queue(maxJobs)
+		self.done = queue.Queue()
+		self.pending = 0 # jobs submitted but not yet finished
+
+	# This function queues a job. cleanup steps are run even if a step fails,
+	# so lights are never left on. callback(results, error) is called by
+	# finish() with the values returned by the steps. Returns False if the
+	# queue is full.
+	def submit(self, steps, callback=None, cleanup=()):
+		try: self.jobs.put_nowait((steps,callback,cleanup))
+		except queue.Full: return False
+		self.pending += 1
+		return True
+
+	# This function reports whether any submitted job is unfinished.
+	def busy(self):
+		return self.pending > 0
+
+	def run(self):
+		while True:
+			steps,callback,cleanup = self.jobs.get()
+			if steps is None: return
+			results = []
+			error = None
+			try:
+				for step in steps:
+					result = step()
+					if result is not None: results.append(result)
+			except Exception as e:
+				error = e
+			finally:
+				for step in cleanup:
+					try: step()
+					except Exception as e: error = error or e
+			self.done.put((callback,results,error))
+
+	# This function runs the callbacks of finished jobs. It must be called
+	# from the user interface thread.
+	def finish(self):
+		while True:
+			try: callback,results,error = self.done.get_nowait()
+			except queue.Empty: return
+			self.pending -= 1
+			if callback is not None: callback(results,error)
+
+	def stop(self):
+		self.jobs.put((None,None,None))
@@ -0,0 +1,195 @@
+# Jacqueline Lewis
+# catalog.py
+
+
+# This file keeps a catalog of every picture in a SQLite database, so that
+# pictures can be found by time, light, illumination or sensor readings
+# without opening each one. A picture is added in its own transaction as it
+# is saved. Pictures taken before the catalog existed are added by
+# rebuilding it from their folders, which reads the file names and EXIF
+# comments in parallel.
+
+# Usage:
+#	>>> python catalog.py rebuild pictures test	(adds every picture in them)
+#	>>> python catalog.py A 10 20 5	(light A pictures taken between hours
+#								10 and 20 of illumination at under 5% oxygen)
+
+
+import concurrent.futures
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+import archive
+import exif
+
+CATALOG = "catalog.db"
+VERSION = 1
+# picture names end in <letter>:y<year>m<month>d<day>H<hour>M<minute>S<second>
+PICTURE = re.compile(r"([A-F]?):(y\d\dm\d\dd\d\dH\d\dM\d\dS\d\d)\.jpg$")
+
+SCHEMA = """
+create table if not exists images (
+	id integer primary key,
+	path text unique not null,
+	folder text not null,
+	time real not null,
+	light text not null,
+	illumination real,
+	pressure real,
+	oxygen real,
+	comment text
+);
+create index if not exists imagesTime on images (time);
+create index if not exists imagesLight on images (light, illumination);
+create index if not exists imagesFolder on images (folder, time);
+create table if not exists fields (
+	image integer not null references images (id) on delete cascade,
+	key text not null,
+	value text not null,
+	primary key (image, key)
+);
+"""
+
+
+# This function splits a picture comment into its "key: value" lines. The
+# illumination (minutes in the comment), pressure and oxygen are also
+# returned as numbers, or None.
+
+def parseComment(comment):
+	fields = {}
+	for line in (comment or "").split("\n"):
+		if ":" not in line: continue
+		key,value = line.split(":",1)
+		if value.strip() != "": fields[key.strip()] = value.strip()
+	numbers = []
+	for key in ["Total Illumination","Pressure","Oxygen"]:
+		try: numbers.append(float(fields.get(key,"").split(" ")[0]))
+		except ValueError: numbers.append(None)
+	if numbers[0] is not None: numbers[0] *= 60
+	return fields,numbers
+
+
+# This function reads the catalog entry of a saved picture from its name
+# and EXIF comment, or returns None if it is not a picture. It runs in the
+# rebuild's pool processes.
+
+def readPicture(path):
+	match = PICTURE.search(path)
+	if match is None: return None
+	taken = time.mktime(time.strptime(match.group(2), "y%ym%md%dH%HM%MS%S"))
+	try: comment = exif.readComment(archive.openImage(path))
+	except (OSError, ValueError, UnicodeDecodeError): comment = None
+	fields,(illumination,pressure,oxygen) = parseComment(comment)
+	return (path, taken, match.group(1), illumination, pressure, oxygen,
+		comment, fields)
+
+
+class Catalog(object):
+
+	def __init__(self, path=CATALOG):
+		self.path = path
+		self.lock = threading.Lock()
+		self.db = sqlite3.connect(path, check_same_thread=False)
+		self.db.execute("pragma foreign_keys = on")
+		self.db.execute("pragma journal_mode = wal")
+		self.db.execute("pragma synchronous = normal")
+		version = self.db.execute("pragma user_version").fetchone()[0]
+		if version not in (0, VERSION):
+			raise ValueError("Unsupported catalog version %d" % version)
+		self.db.executescript(SCHEMA)
+		self.db.execute("pragma user_version = %d" % VERSION)
+
+	def insert(self, path, taken, light, illumination, pressure, oxygen,
+			comment, fields):
+		self.db.execute("delete from images where path = ?", (path,))
+		cursor = self.db.execute("insert into images (path, folder, "
+			"time, light, illumination, pressure, oxygen, comment) values "
+			"(?,?,?,?,?,?,?,?)", (path, os.path.dirname(path), taken, light,
+				illumination, pressure, oxygen, comment))
+		self.db.executemany("insert into fields (image, key, value) values "
+			"(?,?,?)", [(cursor.lastrowid,k,v) for k,v in fields.items()])
+
+	# This function adds a picture as it is saved. It can be called from
+	# any thread.
+	def add(self, path, taken, light, illumination, pressure, oxygen, comment):
+		fields = parseComment(comment)[0]
+		with self.lock, self.db:
+			self.insert(path, taken, light, illumination, pressure, oxygen,
+				comment, fields)
+
+	# This function adds every picture in the folders (and their subfolders),
+	# archived or not, that is not in the catalog yet, or all of them if
+	# replace is set. Returns the number added.
+	def rebuild(self, folders, replace=False, workers=None):
+		with self.lock:
+			known = set(row[0] for row in
+				self.db.execute("select path from images"))
+		paths = []
+		for folder in folders:
+			for root,dirs,files in os.walk(folder):
+				dirs[:] = [d for d in dirs if not d.startswith(".")]
+				for name in archive.listPictures(root):
+					path = os.path.join(root, name)
+					if replace or path not in known: paths.append(path)
+		added = 0
+		with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+			entries = pool.map(readPicture, paths, chunksize=64)
+			with self.lock, self.db:
+				for entry in entries:
+					if entry is None: continue
+					self.insert(*entry)
+					added += 1
+		return added
+
+	# This function returns the folders holding pictures.
+	def folders(self):
+		with self.lock:
+			return [row[0] for row in
+				self.db.execute("select distinct folder from images")]
+
+	# This function returns the pictures (path, time, light, illumination,
+	# pressure, oxygen) that match, in time order. Illumination is in
+	# seconds.
+	def select(self, light=None, start=None, end=None, minIllumination=None,
+			maxIllumination=None, maxO2=None, folder=None):
+		where,values = [],[]
+		for test,value in [("light = ?",light), ("time >= ?",start),
+				("time < ?",end), ("illumination >= ?",minIllumination),
+				("illumination < ?",maxIllumination), ("oxygen < ?",maxO2),
+				("folder = ?",folder)]:
+			if value is not None:
+				where.append(test)
+				values.append(value)
+		sql = ("select path, time, light, illumination, pressure, oxygen from "
+			"images")
+		if where: sql += " where " + " and ".join(where)
+		with self.lock:
+			return self.db.execute(sql + " order by time", values).fetchall()
+
+	# This function returns the "key: value" fields of a picture's comment.
+	def fields(self, path):
+		with self.lock:
+			return dict(self.db.execute("select key, value from fields join "
+				"images on images.id = fields.image where path = ?", (path,)))
+
+	def close(self):
+		with self.lock: self.db.close()
+
+
+if __name__ == "__main__":
+	catalog = Catalog()
+	if len(sys.argv) > 1 and sys.argv[1] == "rebuild":
+		print("%d pictures added" % catalog.rebuild(sys.argv[2:] or ["."]))
+	else:
+		args = sys.argv[1:] + [None]*4
+		light = args[0]
+		low,high,O2 = [None if a is None else float(a) for a in args[1:4]]
+		for row in catalog.select(light, minIllumination=None if low is None
+				else low*3600, maxIllumination=None if high is None else high*3600,
+				maxO2=O2):
+			print(row[0])
+	catalog.close()
@@ -0,0 +1,214 @@
+# Jacqueline Lewis
+# control.py
+
+
+# This file lets a photoreactor run without a screen. run.py --headless runs
+# the reactor and serves this control socket; the user interface, started
+# with run.py --attach, or any other program drives it through the socket,
+# and can come and go without stopping the run. Requests are HTTP over a
+# Unix socket, with JSON bodies:
+#	GET /state		the state of the reactor
+#	POST /command	runs a command, e.g. {"command": "press", "index": 3},
+#					and returns the state after it; a command that can't be
+#					carried out is answered 400 with {"error": reason}, and
+#					one that fails is answered 500 the same way
+# The commands are listed in COMMANDS in run.py.
+
+# The server runs asyncio on its own thread, but every request is carried
+# out on the thread running the reactor, between its timed events, so the
+# reactor only ever changes on one thread, as it does under the interface.
+
+# Usage:
+#	>>> curl --unix-socket pie.sock http://pie/state
+#	>>> curl --unix-socket pie.sock -d '{"command":"press","index":3}' \
+#		http://pie/command
+
+
+import asyncio
+import concurrent.futures
+import http.client
+import json
+import os
+import queue
+import socket
+import threading
+
+SOCKET = os.environ.get("PIE_CONTROL", "pie.sock")
+MAX_BODY = 1 << 20 # bytes
+
+
+# This class serves the control socket. state() returns the state of the
+# reactor as a dict and command(request) carries out a request; both are
+# called on the reactor's thread from serve().
+
+class ControlServer(threading.Thread):
+
+	def __init__(self, state, command, path=SOCKET, idle=60.0):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.state = state
+		self.command = command
+		self.path = path
+		self.idle = idle
+		self.requests = queue.Queue() # (function, future)
+		self.loop = None
+		self.stopping = None
+		self.ready = threading.Event()
+		self.served = 0
+		self.error = None
+
+	def run(self):
+		try: asyncio.run(self.listen())
+		except Exception as e:
+			self.error = e
+			self.ready.set()
+
+	async def listen(self):
+		self.loop = asyncio.get_running_loop()
+		self.stopping = asyncio.Event()
+		# a socket left behind by a crash is replaced
+		if os.path.exists(self.path): os.remove(self.path)
+		server = await asyncio.start_unix_server(self.connection, self.path)
+		self.ready.set()
+		async with server:
+			await self.stopping.wait()
+		if os.path.exists(self.path): os.remove(self.path)
+
+	def stop(self):
+		if self.loop is not None and self.stopping is not None:
+			self.loop.call_soon_threadsafe(self.stopping.set)
+
+	# This function carries out the requests that arrive within timeout
+	# seconds. It is called by the reactor's thread while it waits for its
+	# next timed event, and returns once it has carried out any, so the
+	# reactor can run the events they scheduled.
+	def serve(self, timeout):
+		try: function,future = self.requests.get(timeout=max(0, timeout))
+		except queue.Empty: return False
+		while True:
+			if future.set_running_or_notify_cancel():
+				try: future.set_result(function())
+				except Exception as e: future.set_exception(e)
+			try: function,future = self.requests.get_nowait()
+			except queue.Empty: return True
+
+	# This function has function() run on the reactor's thread.
+	async def call(self, function):
+		future = concurrent.futures.Future()
+		self.requests.put((function,future))
+		return await asyncio.wrap_future(future)
+
+	async def connection(self, reader, writer):
+		try:
+			while True:
+				try: head = await asyncio.wait_for(
+					reader.readuntil(b"\r\n\r\n"), self.idle)
+				except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+						asyncio.LimitOverrunError, ConnectionError):
+					return
+				lines = head.decode("latin-1").split("\r\n")
+				parts = lines[0].split(" ")
+				headers = {}
+				for line in lines[1:]:
+					if ":" in line:
+						key,value = line.split(":",1)
+						headers[key.strip().lower()] = value.strip()
+				keepAlive = (len(parts) == 3 and parts[2] == "HTTP/1.1" and
+					headers.get("connection","").lower() != "close")
+				length = int(headers.get("content-length","0"))
+				if length > MAX_BODY:
+					await self.respond(writer, 413, {"error":"Request too large"},
+						False)
+					return
+				body = await reader.readexactly(length) if length else b""
+				try: status,answer = await self.request(parts, body)
+				except Exception as e:
+					# the client is told, rather than losing the connection
+					status,answer = 500,{"error":"%s: %s" % (type(e).__name__, e)}
+				await self.respond(writer, status, answer, keepAlive)
+				self.served += 1
+				if not keepAlive: return
+		except (ConnectionError, asyncio.IncompleteReadError):
+			pass
+		finally:
+			writer.close()
+
+	async def request(self, parts, body):
+		if len(parts) != 3: return 400,{"error":"Bad request"}
+		method,path = parts[0],parts[1].split("?")[0]
+		if path == "/state":
+			if method != "GET": return 405,{"error":"Use GET"}
+			return 200,await self.call(self.state)
+		if path == "/command":
+			if method != "POST": return 405,{"error":"Use POST"}
+			try: request = json.loads(body.decode("utf-8"))
+			except ValueError: return 400,{"error":"The body must be JSON"}
+			if not isinstance(request, dict):
+				return 400,{"error":"The body must be a JSON object"}
+			def carryOut():
+				self.command(request)
+				return self.state()
+			try: return 200,await self.call(carryOut)
+			except (ValueError, KeyError, TypeError) as e:
+				return 400,{"error":str(e)}
+		return 404,{"error":"Not found"}
+
+	async def respond(self, writer, status, answer, keepAlive):
+		body = json.dumps(answer).encode()
+		lines = ["HTTP/1.1 %d %s" % (status, http.client.responses[status]),
+			"Content-Type: application/json",
+			"Content-Length: %d" % len(body),
+			"Connection: " + ("keep-alive" if keepAlive else "close")]
+		writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+		await writer.drain()
+
+
+# This class is an HTTP connection over a Unix socket.
+
+class UnixConnection(http.client.HTTPConnection):
+
+	def __init__(self, path, timeout):
+		http.client.HTTPConnection.__init__(self, "pie", timeout=timeout)
+		self.socketPath = path
+
+	def connect(self):
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.settimeout(self.timeout)
+		self.sock.connect(self.socketPath)
+
+
+# This class talks to a headless reactor. A request that can't reach it
+# raises IOError; a command it refuses raises ValueError.
+
+class ControlClient(object):
+
+	def __init__(self, path=SOCKET, timeout=5.0):
+		self.path = path
+		self.timeout = timeout
+		self.connection = None
+
+	def request(self, method, target, request=None):
+		body = None if request is None else json.dumps(request)
+		try:
+			if self.connection is None:
+				self.connection = UnixConnection(self.path, self.timeout)
+			self.connection.request(method, target, body,
+				{"Content-Type":"application/json"})
+			response = self.connection.getresponse()
+			answer = json.loads(response.read().decode("utf-8"))
+		except (OSError, http.client.HTTPException) as e:
+			# the connection is made again by the next request
+			self.close()
+			raise IOError(str(e) or type(e).__name__)
+		if response.status != 200: raise ValueError(answer["error"])
+		return answer
+
+	def state(self):
+		return self.request("GET", "/state")
+
+	def command(self, request):
+		return self.request("POST", "/command", request)
+
+	def close(self):
+		if self.connection is not None: self.connection.close()
+		self.connection = None
@@ -0,0 +1,84 @@
+# Jacqueline Lewis
+# degas.py
+
+
+# This file controls the degas valve. The controller listens to the sensor
+# sampler, so it reacts to every pressure sample as it is read, independent
+# of the user interface and of the camera. The valve opens when the pressure
+# falls below the setpoint minus the lower band and closes when it rises
+# above the setpoint plus the upper band; between the two it stays as it
+# is. A valve change must wait for the minimum dwell time, except closing
+# the valve when degassing is turned off or held, which is immediate.
+
+
+from devices import clock
+import sensors
+from stats import StreamStats
+
+
+class DegasController(object):
+
+	# openValve, closeValve: functions that switch the gas valve
+	# enabled: function that returns whether the reactor should be degassed
+	# setpoint: the pressure to hold
+	# band: (lower, upper) hysteresis around the setpoint
+	# dwell: seconds the valve stays in a state before it may change again
+	# maxLatency: samples older than this when they arrive are counted late
+	def __init__(self, openValve, closeValve, enabled, setpoint,
+			band=(5.0,5.0), dwell=2.0, maxLatency=0.25):
+		self.openValve = openValve
+		self.closeValve = closeValve
+		self.enabled = enabled
+		self.setpoint = setpoint
+		self.band = band
+		self.dwell = dwell
+		self.maxLatency = maxLatency
+		self.pressure = StreamStats(window=5,alpha=0.5)
+		self.isOpen = False
+		now = clock.monotonic()
+		self.lastChange = now - dwell
+		self.lastUpdate = now
+		# duty cycle statistics
+		self.openTime = 0.0
+		self.totalTime = 0.0
+		self.switches = 0
+		self.late = 0
+		self.worstLatency = 0.0
+
+	# This function reacts to a (time, pressure, oxygen) sample.
+	def sample(self, sample):
+		now = clock.monotonic()
+		latency = clock.time()-sample[0]
+		self.worstLatency = max(self.worstLatency, latency)
+		if latency > self.maxLatency: self.late += 1
+		# keeps the duty cycle
+		if self.isOpen: self.openTime += now-self.lastUpdate
+		self.totalTime += now-self.lastUpdate
+		self.lastUpdate = now
+		# ignores out-of-bounds readings
+		if sensors.pressureValid(sample[1]): self.pressure.update(sample[1])
+		pressure = self.pressure.ewma()
+		if not self.enabled() or pressure is None:
+			self.set(False, now)
+		elif pressure < self.setpoint-self.band[0]:
+			if now-self.lastChange >= self.dwell: self.set(True, now)
+		elif pressure >= self.setpoint+self.band[1]:
+			if now-self.lastChange >= self.dwell: self.set(False, now)
+
+	def set(self, isOpen, now):
+		if isOpen == self.isOpen: return
+		if isOpen: self.openValve()
+		else: self.closeValve()
+		self.isOpen = isOpen
+		self.lastChange = now
+		self.switches += 1
+
+	# This function returns the fraction of the time the valve was open.
+	def duty(self):
+		if self.totalTime == 0: return 0.0
+		return self.openTime/self.totalTime
+
+	def stats(self):
+		return ("valve open %.1f%% of %.0f s, %d switches, worst latency "
+			"%.0f ms, %d late samples" % (self.duty()*100,self.totalTime,
+				self.switches,self.worstLatency*1000,self.late))
@@ -0,0 +1,560 @@
+# Jacqueline Lewis
+# devices.py
+
+
+# This file defines the hardware used by a photoreactor: the ADC that reads
+# the pressure and oxygen sensors, the relay board that switches the lights
+# and gas valve, and the camera. Each device has a Raspberry Pi backend and
+# a simulated backend, so that run.py and remote.py can be run and profiled
+# on an ordinary computer.
+
+# The backend is chosen with environment variables:
+#	PIE_BACKEND=pi	uses RPi.GPIO, Adafruit_ADS1x15 and fswebcam (default)
+#	PIE_BACKEND=sim	uses the simulated devices below
+#	PIE_SPEED=10	runs a simulated reactor ten times faster than real time
+#	PIE_CAMERA=v4l2	keeps the camera open between pictures (default)
+#	PIE_CAMERA=fswebcam	starts fswebcam for every picture
+
+# Example:
+#	>>> PIE_BACKEND=sim PIE_SPEED=20 python run.py
+
+
+import io
+import math
+import os
+import random
+import subprocess
+import threading
+import time
+
+import exif
+
+BACKEND = os.environ.get("PIE_BACKEND", "pi")
+SPEED = float(os.environ.get("PIE_SPEED", "1"))
+CAMERA = os.environ.get("PIE_CAMERA", "v4l2")
+
+
+####################################
+# clock
+####################################
+
+# This class keeps the time for the whole photoreactor. On the pi it is the
+# real clock, but a simulated run can go faster than real time, in which
+# case every timestamp, deadline and sleep is scaled by the same speed.
+
+class Clock(object):
+
+	def __init__(self, speed=1.0):
+		self.speed = float(speed)
+		self.wallStart = time.time()
+		self.monoStart = time.monotonic()
+
+	# seconds since the epoch, like time.time()
+	def time(self):
+		if self.speed == 1.0: return time.time()
+		return self.wallStart + (time.time()-self.wallStart)*self.speed
+
+	# seconds from an arbitrary start that never goes backwards
+	def monotonic(self):
+		if self.speed == 1.0: return time.monotonic()
+		return self.monoStart + (time.monotonic()-self.monoStart)*self.speed
+
+	def sleep(self, seconds):
+		if seconds > 0: time.sleep(seconds/self.speed)
+
+if BACKEND == "sim": clock = Clock(SPEED)
+else: clock = Clock()
+
+
+####################################
+# simulated reactor
+####################################
+
+# This class models the physical reactor behind the simulated sensors. The
+# gas valve raises the pressure and purges oxygen while it is open, and the
+# reactor slowly leaks back towards atmosphere while it is closed.
+
+class SimReactor(object):
+
+	atmosphere = 1300.0 # pressure reading at atmosphere
+	maxPressure = 1800.0
+	airO2 = 20.9
+
+	def __init__(self, gpio, gasPin=25):
+		self.gpio = gpio
+		self.gasPin = gasPin
+		self.pressure = self.atmosphere
+		self.O2 = self.airO2
+		self.last = clock.monotonic()
+		self.lock = threading.Lock()
+
+	def gasFlowing(self):
+		# the relay board is active low
+		return self.gpio.state.get(self.gasPin) == self.gpio.LOW
+
+	# This function advances the model to the current time.
+	def update(self):
+		with self.lock:
+			now = clock.monotonic()
+			dt = now-self.last
+			self.last = now
+			if self.gasFlowing():
+				self.pressure += (self.maxPressure-self.pressure)*(1-math.exp(-dt/20.0))
+				self.O2 -= self.O2*(1-math.exp(-dt/600.0))
+			else:
+				self.pressure -= (self.pressure-self.atmosphere)*(1-math.exp(-dt/900.0))
+				self.O2 += (self.airO2-self.O2)*(1-math.exp(-dt/36000.0))
+			return self.pressure,self.O2
+
+
+####################################
+# relay board
+####################################
+
+# This class stands in for the RPi.GPIO module. Instead of driving pins it
+# records every transition as (time, pin, value) in self.transitions.
+
+class SimGPIO(object):
+
+	BCM = "BCM"
+	BOARD = "BOARD"
+	OUT = "out"
+	IN = "in"
+	HIGH = 1
+	LOW = 0
+
+	PUD_UP = "up"
+	PUD_DOWN = "down"
+	PUD_OFF = "off"
+	RISING = "rising"
+	FALLING = "falling"
+	BOTH = "both"
+
+	def __init__(self):
+		self.mode = None
+		self.state = {}
+		self.transitions = []
+		self.lock = threading.Lock()
+		self.edges = {} # pin -> function giving seconds until its next edge
+
+	def setmode(self, mode):
+		self.mode = mode
+
+	def setwarnings(self, flag):
+		pass
+
+	def setup(self, pins, direction, initial=None, pull_up_down=None):
+		if isinstance(pins, int): pins = [pins]
+		for pin in pins:
+			if initial is not None: self.output(pin, initial)
+
+	def output(self, pins, value):
+		if isinstance(pins, int): pins = [pins]
+		with self.lock:
+			for pin in pins:
+				if self.state.get(pin) != value:
+					self.state[pin] = value
+					self.transitions.append((clock.time(),pin,value))
+
+	def input(self, pin):
+		return self.state.get(pin, self.LOW)
+
+	# timeout is in milliseconds, as in RPi.GPIO; returns None on a timeout
+	def wait_for_edge(self, pin, edge, timeout=None):
+		wait = None
+		if pin in self.edges: wait = self.edges[pin]()
+		if wait is None or (timeout is not None and wait > timeout/1000.0):
+			if timeout is not None: clock.sleep(timeout/1000.0)
+			return None
+		clock.sleep(wait)
+		return pin
+
+	def cleanup(self):
+		with self.lock:
+			self.state = {}
+
+
+# This class passes every output of a GPIO module on to its listeners as
+# listener(pins, value), so the relay states can be logged.
+
+class ObservedGPIO(object):
+
+	def __init__(self, gpio):
+		self.gpio = gpio
+		self.listeners = []
+
+	def output(self, pins, value):
+		self.gpio.output(pins, value)
+		if isinstance(pins, int): pins = [pins]
+		for listener in self.listeners: listener(pins, value)
+
+	def __getattr__(self, name):
+		return getattr(self.gpio, name)
+
+
+####################################
+# ADC
+####################################
+
+# This class stands in for the Adafruit ADS1x15 driver. Channel 3 reads the
+# pressure sensor and channel 0 reads the oxygen sensor; the raw values are
+# the inverse of the calibration in run.py so the readings come out in the
+# same units as on the pi. Each read takes one conversion time. In
+# continuous mode a conversion finishes every 1/data_rate seconds, and if
+# rdyPin is set the simulated relay board pulses that pin when it does.
+
+class SimADS1x15(object):
+
+	def __init__(self, reactor, dataRate=128, cal=(0.07777,0.001289),
+			zero=(21500,1300), noise=(4.0,20.0), gpio=None):
+		self.reactor = reactor
+		self.dataRate = dataRate
+		self.cal = cal
+		self.zero = zero
+		self.noise = noise
+		self.gpio = gpio
+		self.continuous = None # (channel, data rate, start) while converting
+		self.last = 0
+
+	def rawValue(self, channel):
+		pressure,O2 = self.reactor.update()
+		if channel == 3:
+			raw = (pressure-self.zero[1])/self.cal[0]+self.zero[0]
+			raw += random.gauss(0,self.noise[0]/self.cal[0])
+		elif channel == 0:
+			raw = O2/self.cal[1]+random.gauss(0,self.noise[1])
+		else: raw = random.gauss(0,self.noise[1])
+		return int(max(-32768,min(32767,raw)))
+
+	def read_adc_difference(self, differential, gain=1, data_rate=None):
+		self.continuous = None
+		clock.sleep(1.0/(data_rate or self.dataRate))
+		self.last = self.rawValue(differential)
+		return self.last
+
+	def start_adc_difference(self, differential, gain=1, data_rate=None):
+		rate = data_rate or self.dataRate
+		self.continuous = (differential,rate,clock.monotonic())
+		clock.sleep(1.0/rate)
+		return self.get_last_result()
+
+	# only the conversion ready use of the comparator is simulated
+	def start_adc_difference_comparator(self, differential, high_threshold,
+			low_threshold, gain=1, data_rate=None, active_low=True,
+			traditional=True, latching=False, num_readings=1):
+		return self.start_adc_difference(differential, gain, data_rate)
+
+	def conversions(self):
+		channel,rate,start = self.continuous
+		return int((clock.monotonic()-start)*rate)
+
+	def get_last_result(self):
+		if self.continuous is not None and self.conversions() > 0:
+			self.last = self.rawValue(self.continuous[0])
+		return self.last
+
+	def stop_adc(self):
+		self.continuous = None
+
+	# This function connects the ALERT/RDY output to a simulated GPIO pin.
+	def wireReady(self, gpio, pin):
+		gpio.edges[pin] = self.untilReady
+
+	def untilReady(self):
+		if self.continuous is None: return None
+		channel,rate,start = self.continuous
+		return (self.conversions()+1)/float(rate)-(clock.monotonic()-start)
+
+
+# This class reads the ADC channels one after the other with single-shot
+# conversions. channels is a list of (channel, gain, data rate).
+
+class SingleShotScanner(object):
+
+	def __init__(self, adc, channels):
+		self.adc = adc
+		self.channels = channels
+
+	def read(self):
+		return [self.adc.read_adc_difference(channel, gain, rate)
+			for channel,gain,rate in self.channels]
+
+	def stop(self):
+		pass
+
+
+# This class reads the ADC channels round-robin in continuous-conversion
+# mode. Each channel is visited once per read: the mux, gain and data rate
+# are written once, then burst conversions are read back and averaged, so
+# the cost of switching channels is shared by the whole burst. Conversions
+# are paced by the ALERT/RDY pin if it is wired to rdyPin (BCM numbering),
+# otherwise by the data rate.
+
+class ContinuousScanner(object):
+
+	def __init__(self, adc, channels, burst=4, gpio=None, rdyPin=None):
+		self.adc = adc
+		self.channels = channels
+		self.burst = burst
+		self.gpio = gpio
+		self.rdyPin = rdyPin
+		if rdyPin is not None:
+			gpio.setup(rdyPin, gpio.IN, pull_up_down=gpio.PUD_UP)
+
+	def start(self, channel, gain, rate):
+		if self.rdyPin is None:
+			return self.adc.start_adc_difference(channel, gain, rate)
+		# thresholds with the high MSB set and the low MSB clear turn
+		# ALERT/RDY into a conversion ready signal
+		return self.adc.start_adc_difference_comparator(channel, 0x8000,
+			0x0000, gain, rate, active_low=True, traditional=True,
+			latching=False, num_readings=1)
+
+	def waitReady(self, rate):
+		if self.rdyPin is None: clock.sleep(1.0/rate)
+		# a missed pulse only costs a couple of conversion times
+		else: self.gpio.wait_for_edge(self.rdyPin, self.gpio.FALLING,
+			timeout=int(2000.0/rate)+1)
+
+	def read(self):
+		values = []
+		for channel,gain,rate in self.channels:
+			total = self.start(channel, gain, rate)
+			for i in range(self.burst-1):
+				self.waitReady(rate)
+				total += self.adc.get_last_result()
+			values.append(total/float(self.burst))
+		return values
+
+	def stop(self):
+		self.adc.stop_adc()
+
+
+####################################
+# camera
+####################################
+
+# This function writes the title, subtitle and info onto the bottom of a
+# picture in a banner, the way fswebcam does.
+
+def drawBanner(image, title, subtitle, info, fontSize=60):
+	from PIL import ImageDraw, ImageFont
+	try: font = ImageFont.truetype("DejaVuSans.ttf", fontSize)
+	except IOError: font = ImageFont.load_default()
+	width,height = image.size
+	top = height-fontSize*5//2
+	draw = ImageDraw.Draw(image)
+	draw.rectangle((0,top,width,height),fill=(0,0,0))
+	draw.text((10,top+fontSize//4),title,font=font,fill=(255,255,255))
+	draw.text((10,top+fontSize*5//4),subtitle,font=font,fill=(255,255,255))
+	infoWidth = draw.textlength(info,font=font)
+	draw.text((width-10-infoWidth,top+fontSize*5//4),info,font=font,
+		fill=(255,255,255))
+
+
+# This class takes pictures with fswebcam. The picture is read from
+# fswebcam's output and written to disk once, with the metadata in the
+# EXIF comment.
+
+class FswebcamCamera(object):
+
+	def capture(self, name, title, subtitle, info, comment):
+		jpeg = subprocess.check_output(["fswebcam","--title",title,
+			"--subtitle",subtitle,"--info",info,"--font",'"sans:60"',
+			"-r 2592x1944","-"])
+		exif.saveJpeg(name, jpeg, comment)
+
+	def close(self):
+		pass
+
+
+# This class keeps the camera open for the whole run instead of starting
+# fswebcam for every picture, so the device is only opened, set to full
+# resolution and warmed up once. A thread keeps grabbing frames between
+# pictures so the camera stays streaming and never hands back a stale
+# frame from its queue.
+
+class V4L2Camera(object):
+
+	def __init__(self, device=0, resolution=(2592,1944), skip=2):
+		import cv2
+		from PIL import Image
+		self.cv2 = cv2
+		self.Image = Image
+		self.skip = skip # frames to let the exposure settle after a light change
+		self.stream = cv2.VideoCapture(device, cv2.CAP_V4L2)
+		if not self.stream.isOpened():
+			raise IOError("Could not open camera %s" % device)
+		self.stream.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+		self.stream.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
+		self.stream.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
+		self.stream.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+		self.lock = threading.Lock() # one frame() at a time
+		self.condition = threading.Condition()
+		self.grabbed = 0 # frames grabbed
+		self.wanted = None # the frame to retrieve for frame()
+		self.latest = None # (ok, frame) retrieved for frame()
+		self.streaming = True
+		self.grabber = threading.Thread(target=self.keepStreaming)
+		self.grabber.daemon = True
+		self.grabber.start()
+
+	# This function keeps the camera's buffer fresh. Only this thread uses
+	# the camera; grab() waits for the next frame, and a frame is only
+	# decoded when frame() has asked for it.
+	def keepStreaming(self):
+		while self.streaming:
+			ok = self.stream.grab()
+			with self.condition:
+				if ok: self.grabbed += 1
+				if self.wanted is not None and (not ok or
+						self.grabbed >= self.wanted):
+					self.latest = self.stream.retrieve() if ok else (False,None)
+					self.wanted = None
+					self.condition.notify_all()
+			if not ok: clock.sleep(0.1)
+
+	# This function returns the next full frame as a picture, skipping the
+	# frames exposed before the call.
+	def frame(self, timeout=5.0):
+		with self.lock, self.condition:
+			self.latest = None
+			self.wanted = self.grabbed+self.skip+1
+			self.condition.wait_for(lambda: self.latest is not None or
+				not self.streaming, timeout)
+			ok,frame = self.latest or (False,None)
+			self.wanted = None
+		if not ok: raise IOError("Could not read from camera")
+		# OpenCV frames are BGR
+		return self.Image.fromarray(frame[:,:,::-1])
+
+	def capture(self, name, title, subtitle, info, comment):
+		image = self.frame()
+		drawBanner(image, title, subtitle, info)
+		jpeg = io.BytesIO()
+		image.save(jpeg,"JPEG",quality=90)
+		exif.saveJpeg(name, jpeg.getvalue(), comment)
+
+	def close(self):
+		with self.condition:
+			self.streaming = False
+			self.condition.notify_all()
+		self.grabber.join()
+		self.stream.release()
+
+
+# This class writes synthetic pictures of a row of vials whose colour
+# changes over the run. The latency is split between the sensor warm up
+# and the transfer of the image; a simulated camera session only pays the
+# transfer.
+
+class SimCamera(object):
+
+	colors = {"A":(235,235,225),"B":(60,90,230),"C":(70,200,80),
+		"D":(230,210,60),"E":(220,60,50),"F":(120,60,200),"":(25,25,25)}
+
+	def __init__(self, resolution=(2592,1944), warmup=1.5, transfer=0.5):
+		from PIL import Image, ImageDraw
+		self.Image = Image
+		self.ImageDraw = ImageDraw
+		self.resolution = resolution
+		self.warmup = warmup
+		self.transfer = transfer
+		self.start = clock.time()
+
+	# the letter of the light is the last letter of the folder-letter prefix
+	def lightOf(self, name):
+		base = os.path.basename(name).split(":")[0]
+		if base and base[-1] in self.colors and base[-1].isupper():
+			return base[-1]
+		return ""
+
+	def render(self, name, title, subtitle, info):
+		width,height = self.resolution
+		color = self.colors[self.lightOf(name)]
+		image = self.Image.new("RGB",self.resolution,color)
+		draw = self.ImageDraw.Draw(image)
+		# the vials slowly darken as the reaction goes on
+		fade = math.exp(-(clock.time()-self.start)/86400.0)
+		for i in range(4):
+			shade = tuple(int(c*(0.4+0.6*fade)*(1-0.15*i)) for c in color)
+			x = width*(i+1)//5
+			draw.ellipse((x-width//20,height//3,x+width//20,height*2//3),
+				fill=shade)
+		drawBanner(image, title, subtitle, info, max(10,height//32))
+		return image
+
+	def capture(self, name, title, subtitle, info, comment):
+		clock.sleep(self.warmup)
+		image = self.render(name, title, subtitle, info)
+		jpeg = io.BytesIO()
+		image.save(jpeg,"JPEG",quality=85)
+		exif.saveJpeg(name, jpeg.getvalue(), comment)
+		clock.sleep(self.transfer)
+
+	def close(self):
+		pass
+
+
+####################################
+# builders
+####################################
+
+# The simulated devices share one relay board so the simulated ADC can see
+# the gas valve. Each ADC address is a reactor of its own, with its own gas
+# valve, so one process can simulate several reactors.
+
+_simGPIO = None
+_simReactors = {} # ADC address: reactor
+
+def simGPIO():
+	global _simGPIO
+	if _simGPIO is None: _simGPIO = SimGPIO()
+	return _simGPIO
+
+def simReactor(address=0x48, gasPin=25):
+	if address not in _simReactors:
+		_simReactors[address] = SimReactor(simGPIO(), gasPin)
+	return _simReactors[address]
+
+# This function returns the GPIO module for the relay board.
+
+def buildGPIO(backend=None):
+	if (backend or BACKEND) == "sim": return simGPIO()
+	import RPi.GPIO as GPIO
+	return GPIO
+
+# This function builds an ADC. kind must match the ADC in the photoreactor
+# (ADS1115 or ADS1015); failure to do so will result in erroneous data.
+# gasPin is only used by a simulated ADC, as the valve of its reactor.
+
+def buildADC(kind="ADS1115", backend=None, address=0x48, gasPin=25):
+	if (backend or BACKEND) == "sim":
+		reactor = simReactor(address, gasPin)
+		if kind == "ADS1015": return SimADS1x15(reactor,dataRate=1600)
+		return SimADS1x15(reactor)
+	import Adafruit_ADS1x15 as ads1x15
+	return getattr(ads1x15,kind)(address=address)
+
+# This function builds the scanner that reads the ADC channels, either
+# "single" shot or "continuous" conversion (see the classes above).
+
+def buildScanner(adc, channels, mode="continuous", burst=4, gpio=None,
+		rdyPin=None):
+	if mode == "single": return SingleShotScanner(adc, channels)
+	if rdyPin is not None and isinstance(adc, SimADS1x15):
+		adc.wireReady(gpio.gpio if isinstance(gpio, ObservedGPIO) else gpio,
+			rdyPin)
+	return ContinuousScanner(adc, channels, burst, gpio, rdyPin)
+
+# This function builds the camera. A camera session is kept open until
+# close() is called; without OpenCV, fswebcam is used instead.
+
+def buildCamera(backend=None, kind=None, device=0):
+	kind = kind or CAMERA
+	if (backend or BACKEND) == "sim":
+		if kind == "fswebcam": return SimCamera()
+		return SimCamera(warmup=0,transfer=0.3)
+	if kind == "fswebcam": return FswebcamCamera()
+	try: return V4L2Camera(device)
+	except ImportError: return FswebcamCamera()
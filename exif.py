@@ -0,0 +1,98 @@
+# Jacqueline Lewis
+# exif.py
+
+
+# This file adds the metadata of a picture to its JPEG in memory, so each
+# picture is written to the SD card exactly once. The metadata is stored in
+# the EXIF XPComment tag (0x9C9C) as UTF-16, where Windows shows it as the
+# comment of the file.
+
+
+import struct
+
+XPCOMMENT = 0x9C9C
+
+
+# This function builds the APP1 segment holding an EXIF block with a single
+# XPComment tag.
+
+def exifBlock(comment):
+	value = comment.encode("utf-16-le") + b"\x00\x00"
+	# little-endian TIFF header, then IFD0 right after it
+	tiff = b"II*\x00" + struct.pack("<I", 8)
+	entries = struct.pack("<H", 1)
+	entries += struct.pack("<HHI", XPCOMMENT, 1, len(value))
+	if len(value) <= 4:
+		# a value that fits in the entry is stored in it
+		entries += value.ljust(4, b"\x00")
+		value = b""
+	else:
+		# the value is stored after the IFD: 2 + 12 + 4 bytes past offset 8
+		entries += struct.pack("<I", 8+2+12+4)
+	entries += struct.pack("<I", 0) # no next IFD
+	payload = b"Exif\x00\x00" + tiff + entries + value
+	if len(payload)+2 > 0xFFFF: raise ValueError("Comment too long for EXIF")
+	return b"\xff\xe1" + struct.pack(">H", len(payload)+2) + payload
+
+
+# This function returns the JPEG with the APP1 segment placed after the
+# JFIF header, replacing any EXIF block already in the image.
+
+def insertExif(jpeg, app1):
+	if jpeg[:2] != b"\xff\xd8": raise ValueError("Not a JPEG")
+	pos = 2
+	head = b""
+	while jpeg[pos:pos+1] == b"\xff":
+		marker = jpeg[pos+1:pos+2]
+		length = struct.unpack(">H", jpeg[pos+2:pos+4])[0]
+		segment = jpeg[pos:pos+2+length]
+		if marker == b"\xe0": head += segment # keeps the JFIF header first
+		elif not (marker == b"\xe1" and segment[4:10] == b"Exif\x00\x00"):
+			break
+		pos += 2+length
+	return b"\xff\xd8" + head + app1 + jpeg[pos:]
+
+
+# This function writes a finished picture to disk in a single write.
+
+def writeJpeg(name, jpeg):
+	with open(name, "wb") as f:
+		f.write(jpeg)
+
+
+# This function adds the comment to an encoded picture and saves it.
+
+def saveJpeg(name, jpeg, comment):
+	writeJpeg(name, insertExif(jpeg, exifBlock(comment)))
+
+
+# This function returns the XPComment of a saved picture, given its name or
+# the picture opened for reading, or None if it has none. Only the segments
+# before the image data are read.
+
+def readComment(name):
+	with (open(name, "rb") if isinstance(name, str) else name) as f:
+		if f.read(2) != b"\xff\xd8": raise ValueError("Not a JPEG")
+		while True:
+			marker = f.read(2)
+			if len(marker) < 2 or marker[0:1] != b"\xff" or marker == b"\xff\xda":
+				return None
+			length = struct.unpack(">H", f.read(2))[0]
+			segment = f.read(length-2)
+			if marker == b"\xff\xe1" and segment[:6] == b"Exif\x00\x00":
+				return findComment(segment[6:])
+
+def findComment(tiff):
+	order = "<" if tiff[:2] == b"II" else ">"
+	offset = struct.unpack(order + "I", tiff[4:8])[0]
+	count = struct.unpack(order + "H", tiff[offset:offset+2])[0]
+	for i in range(count):
+		entry = tiff[offset+2+12*i:offset+14+12*i]
+		tag,kind,size = struct.unpack(order + "HHI", entry[:8])
+		if tag != XPCOMMENT: continue
+		if size <= 4: value = entry[8:8+size]
+		else:
+			start = struct.unpack(order + "I", entry[8:12])[0]
+			value = tiff[start:start+size]
+		return value.decode("utf-16-le").rstrip("\x00")
+	return None
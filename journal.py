@@ -0,0 +1,78 @@
+# Jacqueline Lewis
+# journal.py
+
+
+# This file keeps the state of a run on disk, so a power cut or a crash in
+# the middle of a multi-day run does not lose the illumination time or the
+# place in the cycle. Each time the state changes, only the values that
+# changed are appended to the journal as a line of JSON. Lines reach the
+# operating system at once, but the SD card is only synced now and then, so
+# the journal costs little wear and never makes the user interface wait.
+
+# When the program starts, the journal is replayed and rewritten as a
+# single line of the last state.
+
+
+import json
+import os
+
+
+class Journal(object):
+
+	def __init__(self, path):
+		self.path = path
+		self.state = {}
+		self.file = None
+		self.dirty = False
+		self.lines = 0
+
+	# This function returns the state saved in the journal. A line cut short
+	# by a power cut is ignored.
+	def load(self):
+		state = {}
+		if not os.path.isfile(self.path): return state
+		with open(self.path) as f:
+			for line in f:
+				try: state.update(json.loads(line))
+				except ValueError: continue
+		return state
+
+	# This function rewrites the journal as one line holding its state,
+	# opens it for appending and returns the state.
+	def compact(self):
+		self.state = self.load()
+		with open(self.path + ".tmp", "w") as f:
+			if self.state: f.write(json.dumps(self.state) + "\n")
+			f.flush()
+			os.fsync(f.fileno())
+		os.rename(self.path + ".tmp", self.path)
+		self.file = open(self.path, "a")
+		self.lines = 1
+		return dict(self.state)
+
+	# This function appends the values of state that have changed. Values
+	# must be JSON types.
+	def record(self, state):
+		delta = {}
+		for key,value in state.items():
+			if key not in self.state or self.state[key] != value:
+				delta[key] = value
+		if not delta: return False
+		self.state.update(delta)
+		self.file.write(json.dumps(delta) + "\n")
+		self.file.flush()
+		self.dirty = True
+		self.lines += 1
+		return True
+
+	# This function makes sure everything recorded is on the SD card.
+	def sync(self):
+		if self.dirty and self.file is not None:
+			os.fsync(self.file.fileno())
+			self.dirty = False
+
+	def close(self):
+		if self.file is None: return
+		self.sync()
+		self.file.close()
+		self.file = None
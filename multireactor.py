@@ -0,0 +1,384 @@
+# Jacqueline Lewis
+# multireactor.py
+
+
+# This file runs several photoreactors from one pi, instead of a pi and a
+# run.py for each. Each reactor has its own ADC address, relay pins, camera,
+# folder and picture interval, and runs independently of the others, as
+# tasks of a single asyncio event loop. The ADCs share the I2C bus: every
+# read runs on the bus's one thread in the order it was asked for, so one
+# reactor's burst of conversions is never interleaved with another's. The
+# cameras share the USB bus and the pi's memory, so the reactors' pictures
+# are spread out: each reactor starts its pictures an equal share of the
+# shortest interval after the one before, and a set of pictures waits for
+# the set before it to finish instead of colliding with it.
+
+# The reactors are described in a JSON file (times in minutes; settings
+# left out are those of run.py):
+#	{"version": 1, "reactors": [
+#		{"name": "bulbasaur", "adc": "ADS1115", "address": "0x48",
+#		 "pins": [4,17,27,22,5,6,13,19], "gasPin": 25, "camera": 0,
+#		 "folder": "pictures/bulbasaur", "interval": 10, "lights": "ABF",
+#		 "light": true, "degas": true},
+#		...]}
+# pins are the two illumination relays then the six picture light relays.
+
+# Usage (Ctrl-C stops the reactors; kill -USR1 prints their status):
+#	>>> python multireactor.py reactors.json
+#	>>> PIE_BACKEND=sim PIE_SPEED=20 python multireactor.py reactors.json
+
+
+import asyncio
+import concurrent.futures
+import json
+import os
+import signal
+import sys
+
+import calibrate_adc
+import devices
+from devices import clock
+from capture import captions, pictureName
+from catalog import Catalog
+from degas import DegasController
+import sensors
+from stats import StreamStats
+import tslog
+from tslog import TimeSeriesLog
+
+VERSION = 1
+LETTERS = "ABCDEF"
+# the bulbasaur calibration, for a reactor without a profile
+DEFAULT_CAL = ((0.07777,0.001289),(21500,1300))
+# (channel, gain, data rate) of pressure and oxygen
+CHANNELS = {"ADS1115":[(3,1,860),(0,1,860)],
+	"ADS1015":[(3,1,3300),(0,1,3300)]}
+DEFAULTS = {"adc":"ADS1115", "address":0x48, "pins":[4,17,27,22,5,6,13,19],
+	"gasPin":25, "camera":0, "interval":1, "lights":LETTERS, "light":True,
+	"degas":False, "pZero":1523, "sampleRate":10}
+
+
+# This function sleeps until the clock reaches t.
+
+async def sleepUntil(t):
+	while True:
+		wait = t - clock.time()
+		if wait <= 0: return
+		await asyncio.sleep(wait/clock.speed)
+
+
+# This function reads and checks a reactors file and returns the settings
+# of each reactor.
+
+def load(path):
+	with open(path) as f:
+		config = json.load(f)
+	if config.get("version") != VERSION:
+		raise ValueError("Unsupported reactors version %r" %
+			config.get("version"))
+	reactors = []
+	used = {"name":set(), "address":set(), "camera":set(), "folder":set()}
+	pins = set()
+	for i,given in enumerate(config["reactors"]):
+		reactor = dict(DEFAULTS)
+		reactor.update(given)
+		reactor.setdefault("name", "reactor%d" % (i+1))
+		reactor.setdefault("folder", reactor["name"])
+		if isinstance(reactor["address"], str):
+			reactor["address"] = int(reactor["address"], 0)
+		if reactor["adc"] not in CHANNELS:
+			raise ValueError(reactor["name"] + ": unknown ADC " + reactor["adc"])
+		if len(reactor["pins"]) != 8:
+			raise ValueError(reactor["name"] + ": needs 8 relay pins")
+		if reactor["interval"] <= 0:
+			raise ValueError(reactor["name"] + ": interval must be > 0")
+		for key in used:
+			if reactor[key] in used[key]:
+				raise ValueError(reactor["name"] + ": %s %s is used twice" %
+					(key, reactor[key]))
+			used[key].add(reactor[key])
+		for pin in reactor["pins"] + [reactor["gasPin"]]:
+			if pin in pins:
+				raise ValueError(reactor["name"] + ": pin %d is used twice" % pin)
+			pins.add(pin)
+		reactors.append(reactor)
+	if not reactors: raise ValueError("No reactors")
+	return reactors
+
+
+# This class is the I2C bus the ADCs share. Reads run one at a time on the
+# bus's thread, first come first served.
+
+class I2CBus(object):
+
+	def __init__(self):
+		self.thread = concurrent.futures.ThreadPoolExecutor(1)
+		self.transfers = 0
+		self.waited = 0.0 # seconds reads waited for the bus
+
+	async def run(self, transfer):
+		asked = clock.monotonic()
+		def locked():
+			self.waited += clock.monotonic() - asked
+			self.transfers += 1
+			return transfer()
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self.thread, locked)
+
+	def close(self):
+		self.thread.shutdown()
+
+
+# This class spreads the reactors' pictures. Sets of pictures run on the
+# capture threads, at most sets at a time; a set that has to wait for
+# another to finish is counted as delayed.
+
+class CaptureScheduler(object):
+
+	def __init__(self, reactors, sets=1):
+		self.slots = asyncio.Semaphore(sets)
+		self.thread = concurrent.futures.ThreadPoolExecutor(sets)
+		shortest = min(reactor.interval for reactor in reactors)
+		self.offsets = dict((reactor.name,i*shortest/len(reactors))
+			for i,reactor in enumerate(reactors))
+		self.sets = 0
+		self.delayed = 0
+		self.delay = 0.0 # total seconds sets waited
+		self.maxDelay = 0.0
+
+	# This function returns how long after the start the reactor's first
+	# pictures are taken.
+	def offset(self, reactor):
+		return self.offsets[reactor.name]
+
+	# This function takes the pictures of a reactor that were due at due
+	# and returns their names.
+	async def capture(self, reactor, due):
+		async with self.slots:
+			delay = max(0.0, clock.time() - due)
+			self.sets += 1
+			self.delay += delay
+			self.maxDelay = max(self.maxDelay, delay)
+			if delay > 1.0: self.delayed += 1
+			loop = asyncio.get_running_loop()
+			return await loop.run_in_executor(self.thread, reactor.takePics)
+
+	def close(self):
+		self.thread.shutdown()
+
+
+# This class is one reactor: its sensors, relays, camera and log.
+
+class Reactor(object):
+
+	def __init__(self, config, gpio, catalog):
+		self.name = config["name"]
+		self.folder = config["folder"]
+		if not os.path.isdir(self.folder): os.makedirs(self.folder)
+		self.gpio = gpio
+		self.catalog = catalog
+		self.interval = config["interval"]*60.0
+		self.selected = [letter in config["lights"] for letter in LETTERS]
+		self.light = config["light"]
+		self.degas = config["degas"]
+		self.sampleRate = config["sampleRate"]
+		# relays are active low
+		self.on,self.off = gpio.LOW,gpio.HIGH
+		self.pins = config["pins"]
+		self.lightPins = self.pins[:2]
+		self.picPins = self.pins[2:]
+		self.gasPin = config["gasPin"]
+		gpio.setup(self.pins, gpio.OUT)
+		gpio.setup(self.gasPin, gpio.OUT)
+		gpio.output(self.pins, self.off)
+		gpio.output(self.gasPin, self.off)
+		# sensors
+		kind,address = config["adc"],config["address"]
+		self.adc = devices.buildADC(kind, address=address, gasPin=self.gasPin)
+		self.cal,self.zero = calibrate_adc.calibration(DEFAULT_CAL, kind,
+			address)
+		self.scanner = devices.buildScanner(self.adc, CHANNELS[kind])
+		self.O2stats = StreamStats(window=15)
+		self.Pstats = StreamStats(window=5)
+		self.lastO2 = 0
+		self.lastPressure = 0
+		self.log = TimeSeriesLog(self.folder + "/sensors.log")
+		self.degasControl = DegasController(lambda: self.gas(True),
+			lambda: self.gas(False), lambda: self.degas and self.running,
+			config["pZero"], band=(5.0,5.0), dwell=2.0)
+		self.camera = devices.buildCamera(device=config["camera"])
+		self.running = False
+		self.illTime = 0
+		self.lightOn = None
+		self.pictures = 0
+		self.skipped = 0
+		self.errors = 0
+		self.readErrors = 0
+
+	def start(self):
+		self.running = True
+		self.log.log(clock.time(), tslog.RUN, value1=1)
+		if self.light: self.lightsOn()
+
+	def stop(self):
+		self.running = False
+		self.lightsOff()
+		self.gas(False)
+		self.gpio.output(self.pins, self.off)
+		self.log.log(clock.time(), tslog.RUN, value1=0)
+		self.scanner.stop()
+		self.camera.close()
+		self.log.close()
+
+	def gas(self, isOpen):
+		self.gpio.output(self.gasPin, self.on if isOpen else self.off)
+		self.log.log(clock.time(), tslog.GAS, value1=int(isOpen))
+
+	def lightsOn(self):
+		self.gpio.output(self.lightPins, self.on)
+		self.lightOn = clock.time()
+
+	def lightsOff(self):
+		self.gpio.output(self.lightPins, self.off)
+		if self.lightOn is not None:
+			self.illTime += clock.time() - self.lightOn
+			self.lightOn = None
+
+	# This function reads the sensors sampleRate times a second through the
+	# shared bus. Each sample is logged and controls the degas valve.
+	async def sampling(self, bus):
+		period = 1.0/self.sampleRate
+		deadline = clock.monotonic()
+		while True:
+			try: raw = await bus.run(self.scanner.read)
+			except IOError: self.readErrors += 1
+			else: self.sample(raw)
+			deadline += period
+			now = clock.monotonic()
+			if deadline < now: deadline = now
+			await asyncio.sleep((deadline-now)/clock.speed)
+
+	def sample(self, raw):
+		pressure = (raw[0]-self.zero[0])*self.cal[0]+self.zero[1]
+		O2 = raw[1]*self.cal[1]
+		sample = (clock.time(),pressure,O2)
+		self.log.log(sample[0], tslog.SAMPLE, value1=pressure, value2=O2)
+		self.degasControl.sample(sample)
+		# does not update to out-of-bounds values
+		if sensors.pressureValid(pressure):
+			self.Pstats.update(pressure)
+			self.lastPressure = self.Pstats.mean()
+		if sensors.oxygenValid(pressure) and self.O2stats.update(O2):
+			self.lastO2 = round(self.O2stats.mean(),2)
+
+	# This function takes the reactor's pictures every interval from first.
+	# Intervals that passed while pictures were being taken are skipped.
+	async def picturing(self, captures, first):
+		due = first
+		while True:
+			await sleepUntil(due)
+			try: names = await captures.capture(self, due)
+			except Exception as e:
+				self.errors += 1
+				print("%s: pictures failed: %s" % (self.name, e))
+			else: self.pictures += len(names)
+			due += self.interval
+			missed = int((clock.time()-due)//self.interval) + 1
+			if missed > 0:
+				self.skipped += missed
+				due += missed*self.interval
+
+	# This function takes a picture under each selected light, with the
+	# illumination off. It runs on a capture thread.
+	def takePics(self):
+		names = []
+		self.lightsOff()
+		try:
+			for i in range(len(self.picPins)):
+				if not self.selected[i]: continue
+				self.gpio.output(self.picPins[i], self.on)
+				try: names.append(self.picture(LETTERS[i]))
+				finally: self.gpio.output(self.picPins[i], self.off)
+		finally:
+			if self.running and self.light: self.lightsOn()
+		return names
+
+	def picture(self, letter):
+		now = clock.time()
+		title,pressure,oxygen = captions(self.illTime, self.lastPressure,
+			self.lastO2)
+		name = pictureName(self.folder, letter, now)
+		comment = "\n".join([title, pressure, oxygen, "Reactor: " + self.name])
+		self.camera.capture(name, title, pressure, oxygen, comment)
+		self.catalog.add(name, now, letter, self.illTime, self.lastPressure,
+			self.lastO2, comment)
+		self.log.log(clock.time(), tslog.CAPTURE, code=ord(letter),
+			value1=self.illTime)
+		return name
+
+	def status(self):
+		return ("%s: pressure %d, oxygen %s, %.2f h illuminated, %d pictures, "
+			"%d intervals skipped, %d failed, degas duty %.2f" % (self.name,
+			self.lastPressure, self.lastO2, (self.illTime + (clock.time() -
+			self.lightOn if self.lightOn is not None else 0))/3600.0,
+			self.pictures, self.skipped, self.errors,
+			self.degasControl.duty()))
+
+
+# This class runs the reactors until it is stopped.
+
+class Controller(object):
+
+	def __init__(self, configs):
+		self.gpio = devices.buildGPIO()
+		self.gpio.setmode(self.gpio.BCM)
+		self.bus = I2CBus()
+		self.catalog = Catalog()
+		self.reactors = [Reactor(config, self.gpio, self.catalog)
+			for config in configs]
+		self.captures = None
+
+	def report(self):
+		for reactor in self.reactors: print(reactor.status())
+		print("I2C: %d reads, %.1f ms average wait for the bus" %
+			(self.bus.transfers, 1000.0*self.bus.waited/max(1,self.bus.transfers)))
+		if self.captures is not None:
+			print("Captures: %d sets, %d delayed, %.1f s longest delay" %
+				(self.captures.sets, self.captures.delayed,
+					self.captures.maxDelay))
+
+	async def reporting(self, period):
+		while True:
+			await asyncio.sleep(period/clock.speed)
+			self.report()
+
+	async def run(self, report=3600):
+		loop = asyncio.get_running_loop()
+		stopping = asyncio.Event()
+		loop.add_signal_handler(signal.SIGINT, stopping.set)
+		loop.add_signal_handler(signal.SIGTERM, stopping.set)
+		loop.add_signal_handler(signal.SIGUSR1, self.report)
+		self.captures = CaptureScheduler(self.reactors)
+		start = clock.time()
+		tasks = [loop.create_task(self.reporting(report))]
+		for reactor in self.reactors:
+			reactor.start()
+			tasks.append(loop.create_task(reactor.sampling(self.bus)))
+			tasks.append(loop.create_task(reactor.picturing(self.captures,
+				start + self.captures.offset(reactor))))
+		await stopping.wait()
+		for task in tasks: task.cancel()
+		await asyncio.gather(*tasks, return_exceptions=True)
+		# pictures being taken are finished before the reactors stop
+		self.captures.close()
+		self.bus.close()
+		for reactor in self.reactors: reactor.stop()
+		self.gpio.cleanup()
+		self.catalog.close()
+		self.report()
+
+
+if __name__ == "__main__":
+	controller = Controller(load(sys.argv[1] if len(sys.argv) > 1 else
+		"reactors.json"))
+	asyncio.run(controller.run())
@@ -0,0 +1,154 @@
+# Jacqueline Lewis
+# protocol.py
+
+
+# This file runs experiment protocols. A protocol is a list of phases, each
+# with its own illumination, picture interval, picture lights, degassing
+# and quenching, and lasting a number of pictures or a number of minutes.
+# Before a run starts the protocol is compiled into a timeline: one sorted
+# list of every phase change and picture of the run, with their times from
+# the start. While the run goes on, the events that are due are found by a
+# binary search of the timeline, so nothing is worked out on the fly.
+
+# Protocol files are JSON, with times in minutes:
+#	{"version": 1, "name": "two day",
+#	 "phases": [
+#		{"name": "dark", "light": false, "duration": 60},
+#		{"name": "light", "light": true, "interval": 10, "count": 144,
+#		 "lights": "ABF", "degas": true},
+#		{"name": "quench", "light": false, "interval": 5, "duration": 120,
+#		 "quench": true}]}
+# A phase lasts "count" pictures or "duration" minutes (pictures every
+# "interval" minutes within it). Settings that are left out stay as they
+# were.
+
+
+import bisect
+import json
+
+VERSION = 1
+LETTERS = "ABCDEF"
+
+# event kinds
+PHASE = 0
+PICTURES = 1
+END = 2
+
+
+# This function checks a protocol and returns its phases with times in
+# seconds.
+
+def phases(protocol):
+	if protocol.get("version") != VERSION:
+		raise ValueError("Unsupported protocol version %r" %
+			protocol.get("version"))
+	checked = []
+	for i,phase in enumerate(protocol["phases"]):
+		name = phase.get("name", "phase %d" % (i+1))
+		interval = phase.get("interval")
+		if interval is not None:
+			if interval <= 0: raise ValueError(name + ": interval must be > 0")
+			interval = float(interval)*60
+		if "count" in phase:
+			if interval is None: raise ValueError(name + ": count needs interval")
+			count = int(phase["count"])
+			duration = count*interval
+		elif "duration" in phase:
+			duration = float(phase["duration"])*60
+			count = 0 if interval is None else int(duration//interval)
+		else: raise ValueError(name + ": needs a count or a duration")
+		lights = phase.get("lights")
+		if lights is not None:
+			lights = [letter for letter in LETTERS if letter in lights]
+		checked.append({"name":name, "interval":interval, "count":count,
+			"duration":duration, "light":phase.get("light"), "lights":lights,
+			"degas":phase.get("degas"), "quench":phase.get("quench")})
+	return checked
+
+
+# This function reads a protocol file.
+
+def load(path):
+	with open(path) as f:
+		protocol = json.load(f)
+	phases(protocol)
+	return protocol
+
+
+# This function makes a protocol from the rows of the cycle table: times
+# are picture intervals in seconds and cycles the number of pictures, with
+# empty rows (0) skipped.
+
+def fromTable(times, cycles, name="cycle table"):
+	rows = [{"name":"cycle %d" % (i+1), "interval":times[i]/60.0,
+		"count":cycles[i]} for i in range(len(times))
+		if times[i] != 0 and cycles[i] != 0]
+	return {"version":VERSION, "name":name, "phases":rows}
+
+
+# This class is a compiled protocol. events are (time, kind, phase) in time
+# order; times are seconds from the start of the run.
+
+class Timeline(object):
+
+	def __init__(self, protocol):
+		self.protocol = protocol
+		self.name = protocol.get("name", "protocol")
+		self.phases = phases(protocol)
+		events = []
+		start = 0.0
+		for phase in self.phases:
+			events.append((start, PHASE, phase))
+			for k in range(1, phase["count"]+1):
+				events.append((start+k*phase["interval"], PICTURES, phase))
+			start += phase["duration"]
+		events.append((start, END, None))
+		# events at the same time stay in the order of their phases
+		events.sort(key=lambda event: event[0])
+		self.events = events
+		self.times = [event[0] for event in events]
+		self.phaseIndexes = [i for i,event in enumerate(events)
+			if event[1] == PHASE]
+		self.pictureTimes = [event[0] for event in events
+			if event[1] == PICTURES]
+		self.duration = start
+
+	def __len__(self):
+		return len(self.events)
+
+	# This function returns the number of events due by elapsed seconds.
+	def indexAt(self, elapsed):
+		return bisect.bisect_right(self.times, elapsed)
+
+	# This function returns the time of event i, or None after the end.
+	def timeOf(self, i):
+		if i >= len(self.events): return None
+		return self.times[i]
+
+	# This function returns the time of the first pictures after elapsed
+	# seconds, or None if there are no more.
+	def nextPictures(self, elapsed):
+		i = bisect.bisect_right(self.pictureTimes, elapsed)
+		if i >= len(self.pictureTimes): return None
+		return self.pictureTimes[i]
+
+	# This function returns the phase in force at elapsed seconds.
+	def phaseAt(self, elapsed):
+		i = bisect.bisect_right(self.phaseIndexes, self.indexAt(elapsed)-1)
+		if i == 0: return None
+		return self.events[self.phaseIndexes[i-1]][2]
+
+	# This function returns the number of pictures the protocol takes, if
+	# selected picture lights are chosen when it starts.
+	def pictureCount(self, selected=len(LETTERS)):
+		count = 0
+		for time,kind,phase in self.events:
+			if kind == PHASE and phase["lights"] is not None:
+				selected = len(phase["lights"])
+			elif kind == PICTURES: count += selected
+		return count
+
+	def describe(self, selected=len(LETTERS)):
+		hours,minutes = divmod(int(round(self.duration/60.0)), 60)
+		return "%s: %d phases, %d h %02d min, %d pictures" % (self.name,
+			len(self.phases), hours, minutes, self.pictureCount(selected))
@@ -0,0 +1,166 @@
+# Jacqueline Lewis
+# quench.py
+
+
+# This file predicts when the oxygen will reach each quenching percentage,
+# so the gas can be stopped when the oxygen is at the percentage instead of
+# after the block average of the readings has passed it. The oxygen read
+# over the last minute or so is fitted with a straight line and with an
+# exponential decay (a straight line through the logarithm of the oxygen),
+# and whichever fits better gives the time the percentage will be crossed.
+# The gas is stopped a little ahead of the crossing (the lead), and the
+# lead is adjusted after each point by how far its photo missed the
+# percentage, so the photos land on their percentages.
+
+# Each quenching point is logged to quench.csv in the picture folder, with
+# the oxygen it was predicted to stop at and the oxygen it was pictured at.
+
+
+import collections
+import csv
+import math
+import os
+
+LINEAR = "linear"
+EXPONENTIAL = "exponential"
+COLUMNS = ["time","target","model","slope","lead","stopO2","pictureO2",
+	"error"]
+
+
+# This function returns the least squares line through points as
+# (intercept, slope, sum of squared residuals), or None.
+
+def fitLine(xs, ys):
+	n = len(xs)
+	if n < 2: return None
+	mx,my = float(sum(xs))/n,float(sum(ys))/n
+	sxx = sum((x-mx)**2 for x in xs)
+	if sxx == 0: return None
+	slope = sum((x-mx)*(y-my) for x,y in zip(xs,ys))/sxx
+	intercept = my - slope*mx
+	residual = sum((y-intercept-slope*x)**2 for x,y in zip(xs,ys))
+	return intercept,slope,residual
+
+
+# This class predicts oxygen crossings from the raw oxygen samples.
+
+class QuenchPredictor(object):
+
+	# window: seconds of samples that are fitted
+	# minSpan: seconds of samples needed before predicting
+	# gain: fraction of each point's error taken off the lead
+	# maxLead: the most seconds the gas is stopped ahead of a crossing
+	def __init__(self, window=60.0, minSpan=10.0, gain=0.5, maxLead=60.0):
+		self.window = window
+		self.minSpan = minSpan
+		self.gain = gain
+		self.maxLead = maxLead
+		self.samples = collections.deque() # (time, oxygen)
+		self.lead = 0.0
+		self.model = None # (model, time, intercept, slope) of the last fit
+		self.changed = True
+		self.stop = None # (time, target, model, slope, oxygen) at the last stop
+
+	def add(self, t, O2):
+		self.samples.append((t,O2))
+		while self.samples and self.samples[0][0] < t - self.window:
+			self.samples.popleft()
+		self.changed = True
+
+	# This function forgets the samples, as the oxygen stops falling while
+	# the gas is held.
+	def reset(self):
+		self.samples.clear()
+		self.model = None
+		self.changed = True
+
+	# This function fits the samples and returns (model, time, intercept,
+	# slope), where time is the time the fit is measured from, or None if
+	# there are too few samples or the oxygen is not falling.
+	def fit(self):
+		if not self.changed: return self.model
+		self.changed = False
+		self.model = None
+		if (len(self.samples) < 3 or
+				self.samples[-1][0]-self.samples[0][0] < self.minSpan):
+			return None
+		t0 = self.samples[0][0]
+		ts = [t-t0 for t,O2 in self.samples]
+		ys = [O2 for t,O2 in self.samples]
+		line = fitLine(ts, ys)
+		if line is None or line[1] >= 0: return None
+		self.model = (LINEAR,t0,line[0],line[1])
+		# the exponential is only fitted while every reading is above 0
+		if min(ys) > 0:
+			curve = fitLine(ts, [math.log(y) for y in ys])
+			if curve is not None and curve[1] < 0:
+				residual = sum((y-math.exp(curve[0]+curve[1]*t))**2
+					for t,y in zip(ts,ys))
+				if residual < line[2]:
+					self.model = (EXPONENTIAL,t0,curve[0],curve[1])
+		return self.model
+
+	# This function returns the fitted oxygen at time t, or None.
+	def predict(self, t):
+		model = self.fit()
+		if model is None: return None
+		kind,t0,intercept,slope = model
+		if kind == LINEAR: return intercept + slope*(t-t0)
+		return math.exp(intercept + slope*(t-t0))
+
+	# This function returns the time the oxygen will cross target, or None
+	# if it can't be predicted.
+	def crossing(self, target):
+		model = self.fit()
+		if model is None: return None
+		kind,t0,intercept,slope = model
+		if kind == LINEAR: return t0 + (target-intercept)/slope
+		if target <= 0: return None # a decay never reaches 0
+		return t0 + (math.log(target)-intercept)/slope
+
+	# This function returns the time the gas should be stopped for target.
+	def stopTime(self, target):
+		crossing = self.crossing(target)
+		if crossing is None: return None
+		return crossing - self.lead
+
+	# This function returns the oxygen per second of the last fit at time t.
+	def slope(self, t):
+		model = self.fit()
+		if model is None: return None
+		if model[0] == LINEAR: return model[3]
+		return model[3]*self.predict(t)
+
+	# This function notes that the gas was stopped for target at time t,
+	# when the oxygen read O2.
+	def stopped(self, t, target, O2):
+		model = self.fit()
+		if model is not None: O2 = round(self.predict(t),3)
+		self.stop = (t,target,model and model[0],self.slope(t),O2)
+		self.reset()
+
+	# This function notes the oxygen of the picture of the last stop, adjusts
+	# the lead by the error and returns the row logged for the point. An
+	# error above the target means the gas was stopped too soon.
+	def pictured(self, t, O2):
+		if self.stop is None: return None
+		stopTime,target,model,slope,stopO2 = self.stop
+		self.stop = None
+		error = O2 - target
+		row = [round(t,2),target,model,slope and round(slope,5),
+			round(self.lead,2),stopO2,O2,round(error,3)]
+		if slope:
+			lead = self.lead - self.gain*error/abs(slope)
+			self.lead = min(max(lead, 0.0), self.maxLead)
+		return row
+
+
+# This function appends a quenching point to the log of a folder.
+
+def logPoint(folder, row):
+	path = os.path.join(folder, "quench.csv")
+	exists = os.path.isfile(path)
+	with open(path, "a") as f:
+		writer = csv.writer(f)
+		if not exists: writer.writerow(COLUMNS)
+		writer.writerow(row)
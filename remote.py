@@ -1,10 +1,19 @@
 
 import subprocess
+import math
 import os
+import signal
+import threading
 import time
-import pyexiv2
 import sys
 
+import devices
+from devices import clock
+
+POLICIES = ["catchup","skip"]
+
+camera = None # built by start()
+
 # These functions determine if a path is a folder or a file.
 
 def isValidFolder(folder):
@@ -31,19 +40,15 @@ def picture(illTime,address,foldName,letter,picName):
 
 	title = "Total Illumination: " + str(round(illTime/60.0,2)) + " minutes"
 	name = address+foldName[-1]+letter+picName
-	subprocess.check_call(["fswebcam","--title",title,"--font",'"sans:60"',name,"-r 2592x1944"])
-	metadata = pyexiv2.ImageMetadata(name)
-	metadata.read()
-	userdata = title
-	metadata['Exif.Image.XPComment']=pyexiv2.utils.string_to_undefined(userdata.encode('utf-16'))
-	metadata.write()
+	camera.capture(name,title,"","",title)
 
-# This function takes a single picture of the testing system
+# This function takes a single picture of the testing system, named by the
+# time t of its slot so pictures caught up together don't share a name.
 
-def takeAPic(folder, illTime):
+def takeAPic(folder, illTime, t):
 
     # develops a name for the picture
-    date = time.localtime(time.time())
+    date = time.localtime(t)
     picName = time.strftime(":y%ym%md%dH%HM%MS%S.jpg",date)
     address = folder + "/"
 
@@ -52,21 +57,100 @@ def takeAPic(folder, illTime):
 
     picture(illTime,address,foldName,"",picName)
     
-def start(picTime=1):
+# This class keeps how late each picture started after its slot (latency)
+# and how long the camera took, as running totals so the daemon can run for
+# days. Jitter is the standard deviation of the latency.
+
+class Timing(object):
+
+	def __init__(self):
+		self.count = 0
+		self.total = 0.0
+		self.squares = 0.0
+		self.worst = 0.0
+		self.captureTotal = 0.0
+		self.skipped = 0
+		self.failed = 0
+
+	def add(self, latency, duration):
+		self.count += 1
+		self.total += latency
+		self.squares += latency*latency
+		self.worst = max(self.worst, latency)
+		self.captureTotal += duration
+
+	def report(self):
+		if self.count == 0: return "No pictures taken"
+		mean = self.total/self.count
+		jitter = math.sqrt(max(0.0, self.squares/self.count-mean*mean))
+		return ("%d pictures, latency %.1f ms mean / %.1f ms worst, jitter "
+			"%.1f ms, capture %.2f s mean, %d slots skipped, %d failed" % (
+				self.count, mean*1000, self.worst*1000, jitter*1000,
+				self.captureTotal/self.count, self.skipped, self.failed))
+
+# This function sleeps until a monotonic deadline, returning early (True)
+# if stop is set.
+
+def sleepUntil(deadline, stop):
+	remaining = deadline - clock.monotonic()
+	if remaining <= 0: return stop.is_set()
+	return stop.wait(remaining/clock.speed)
+
+# This function takes a picture every picTime minutes until it receives
+# SIGINT or SIGTERM (SIGUSR1 prints the timing so far). Slots are fixed
+# multiples of picTime after the start, so the interval does not drift.
+# Slots missed while the camera was busy (or the pi was suspended) are
+# either all taken at once ("catchup") or dropped ("skip").
+
+def start(picTime=1, policy="skip"):
+	global camera
+	if policy not in POLICIES:
+		raise ValueError("Unknown policy %r: use %s" % (policy,
+			" or ".join(POLICIES)))
 	print("Starting")
 	folder = "pictures"
-	startTime = time.time()
-	lastPic = time.time()
 	picTime = float(picTime) * 60.0
+	# picture names are to the second
+	if picTime < 1:
+		raise ValueError("Pictures must be at least a second apart")
 	if not isValidFolder(folder):
 		makeFolder(folder)
-	while(True):
-		curr = time.time()
-		if curr - lastPic >= picTime:
-			lastPic = curr
+	camera = devices.buildCamera()
+	stop = threading.Event()
+	timing = Timing()
+	def stopping(signum, frame):
+		stop.set()
+	signal.signal(signal.SIGINT, stopping)
+	signal.signal(signal.SIGTERM, stopping)
+	if hasattr(signal, "SIGUSR1"):
+		signal.signal(signal.SIGUSR1, lambda signum, frame: print(timing.report()))
+	startTime = clock.monotonic()
+	startClock = clock.time()
+	slot = 1
+	try:
+		while not sleepUntil(startTime + slot*picTime, stop):
+			now = clock.monotonic()
+			missed = int((now-startTime)//picTime) - slot
+			if missed > 0 and policy == "skip":
+				timing.skipped += missed
+				slot += missed
+			deadline = startTime + slot*picTime
 			print("Picture taking")
-			takeAPic(folder, curr - startTime)
-
-if len(sys.argv) > 1:
-	start(sys.argv[1])
-else: start()
+			try:
+				takeAPic(folder, now - startTime, startClock + slot*picTime)
+				timing.add(now - deadline, clock.monotonic() - now)
+			except Exception as error:
+				timing.failed += 1
+				print("Picture failed: %s" % error)
+			slot += 1
+	finally:
+		print(timing.report())
+		camera.close()
+		camera = None
+
+if __name__ == "__main__":
+	try:
+		if len(sys.argv) > 2: start(sys.argv[1], sys.argv[2])
+		elif len(sys.argv) > 1: start(sys.argv[1])
+		else: start()
+	except ValueError as e: sys.exit(str(e))
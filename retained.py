@@ -0,0 +1,78 @@
+# Jacqueline Lewis
+# retained.py
+
+
+# This file keeps the items of a Tkinter canvas between frames. Instead of
+# deleting everything and drawing the screen again, each frame names the
+# items it wants with a key; an item is created the first time its key is
+# drawn and afterwards only changed with coords/itemconfig when its
+# position or options differ from the last frame. Items that are not drawn
+# in a frame (e.g. the other mode's screen) are hidden until drawn again.
+
+
+import time
+
+
+class RetainedCanvas(object):
+
+	def __init__(self, canvas):
+		self.canvas = canvas
+		self.items = {} # key -> [item id, coords, options, visible]
+		self.drawn = set()
+		# frame cost counters
+		self.frames = 0
+		self.ops = 0 # canvas calls in the last frame
+		self.totalOps = 0
+		self.frameCost = 0.0 # average seconds per frame
+		self.frameStart = None
+
+	def beginFrame(self):
+		self.drawn = set()
+		self.ops = 0
+		self.frameStart = time.time()
+
+	def endFrame(self):
+		# hides the items that were not drawn this frame
+		for key,item in self.items.items():
+			if item[3] and key not in self.drawn:
+				self.canvas.itemconfig(item[0],state="hidden")
+				item[3] = False
+				self.ops += 1
+		cost = time.time()-self.frameStart
+		self.frames += 1
+		self.totalOps += self.ops
+		self.frameCost += (cost-self.frameCost)/min(self.frames,100)
+
+	# This function creates or updates the item for key.
+	def draw(self, kind, key, coords, options):
+		self.drawn.add(key)
+		if key not in self.items:
+			create = getattr(self.canvas,"create_"+kind)
+			self.items[key] = [create(*coords,**options),coords,options,True]
+			self.ops += 1
+			return
+		item = self.items[key]
+		if item[1] != coords:
+			self.canvas.coords(item[0],*coords)
+			item[1] = coords
+			self.ops += 1
+		changed = dict((k,v) for k,v in options.items() if item[2].get(k) != v)
+		if not item[3]:
+			changed["state"] = "normal"
+			item[3] = True
+		if changed:
+			self.canvas.itemconfig(item[0],**changed)
+			item[2] = options
+			self.ops += 1
+
+	def rectangle(self, key, x0, y0, x1, y1, **options):
+		self.draw("rectangle", key, (x0,y0,x1,y1), options)
+
+	def text(self, key, x, y, **options):
+		self.draw("text", key, (x,y), options)
+
+	# This function describes the measured cost of drawing a frame.
+	def stats(self):
+		if self.frames == 0: return "No frames drawn"
+		return ("%d frames, %.2f ms per frame, %.1f canvas calls per frame" %
+			(self.frames,self.frameCost*1000,self.totalOps/float(self.frames)))
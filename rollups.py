@@ -0,0 +1,126 @@
+# Jacqueline Lewis
+# rollups.py
+
+
+# This file keeps downsampled copies of the sensor log so that a whole
+# multi-day run can be plotted without reading every raw sample. Each tier
+# stores one bucket per interval (by default 1 second, 1 minute and 15
+# minutes) with the min/mean/max pressure and oxygen of the samples in it.
+# Buckets are built as samples arrive: the finest tier is fed the samples
+# and each coarser tier is fed the finished buckets of the tier below.
+
+# The tiers of sensors.log are saved next to it as sensors.1s.log,
+# sensors.60s.log and sensors.900s.log, in the format of tslog.py.
+
+
+import math
+import struct
+import threading
+
+import tslog
+from tslog import TimeSeriesLog, LogReader
+
+# bucket start, sample count, pressure min/mean/max, oxygen min/mean/max
+BUCKET = struct.Struct("<dI6d")
+BUCKET_DTYPE = [("time","<f8"),("count","<u4"),("Pmin","<f8"),
+	("Pmean","<f8"),("Pmax","<f8"),("O2min","<f8"),("O2mean","<f8"),
+	("O2max","<f8")]
+WIDTHS = (1,60,900)
+
+
+# This function returns the file name of a tier of a log.
+
+def tierPath(path, width):
+	if path.endswith(".log"): path = path[:-4]
+	return "%s.%ds.log" % (path, width)
+
+
+# This class is a bucket being filled.
+
+class Bucket(object):
+
+	def __init__(self, start):
+		self.start = start
+		self.count = 0
+		self.P = [float("inf"),0.0,float("-inf")] # min, sum, max
+		self.O2 = [float("inf"),0.0,float("-inf")]
+
+	def add(self, count, Pmin, Pmean, Pmax, O2min, O2mean, O2max):
+		self.count += count
+		self.P = [min(self.P[0],Pmin),self.P[1]+Pmean*count,max(self.P[2],Pmax)]
+		self.O2 = [min(self.O2[0],O2min),self.O2[1]+O2mean*count,
+			max(self.O2[2],O2max)]
+
+	def fields(self):
+		return (self.start,self.count,self.P[0],self.P[1]/self.count,self.P[2],
+			self.O2[0],self.O2[1]/self.count,self.O2[2])
+
+
+# This class keeps the tiers of one sensor log up to date.
+
+class Rollups(object):
+
+	def __init__(self, path, widths=WIDTHS):
+		self.widths = sorted(widths)
+		self.logs = [TimeSeriesLog(tierPath(path,w), BUCKET) for w in self.widths]
+		self.buckets = [None]*len(self.widths)
+		self.lock = threading.Lock()
+
+	# This function adds a (time, pressure, oxygen) sample.
+	def sample(self, sample):
+		t,P,O2 = sample
+		with self.lock:
+			self.add(0, t, (1,P,P,P,O2,O2,O2))
+
+	# This function adds values to the bucket of tier i that holds t, and
+	# passes a finished bucket on to the next tier.
+	def add(self, i, t, values):
+		start = math.floor(t/self.widths[i])*self.widths[i]
+		bucket = self.buckets[i]
+		if bucket is not None and bucket.start != start:
+			self.finish(i)
+			bucket = None
+		if bucket is None:
+			bucket = self.buckets[i] = Bucket(start)
+		bucket.add(*values)
+
+	def finish(self, i):
+		fields = self.buckets[i].fields()
+		self.buckets[i] = None
+		self.logs[i].append(*fields)
+		if i+1 < len(self.widths): self.add(i+1, fields[0], fields[1:])
+
+	def flush(self):
+		for log in self.logs: log.flush()
+
+	# This function saves the buckets still being filled and closes the tiers.
+	def close(self):
+		with self.lock:
+			for i in range(len(self.widths)):
+				if self.buckets[i] is not None: self.finish(i)
+			for log in self.logs: log.close()
+
+
+# This function reads the sensor readings of a log between start and end at
+# a resolution (seconds between points). It uses the coarsest tier whose
+# buckets are no wider than the resolution, or the raw samples if there is
+# none, and returns a NumPy array with the fields of BUCKET_DTYPE (raw
+# samples have the same min, mean and max).
+
+def query(path, start, end, resolution, widths=WIDTHS):
+	import numpy as np
+	fitting = [w for w in widths if w <= resolution]
+	if fitting:
+		reader = LogReader(tierPath(path,max(fitting)), BUCKET, BUCKET_DTYPE)
+		try: return reader.array(start, end)
+		finally: reader.close()
+	reader = LogReader(path)
+	try: raw = reader.array(start, end)
+	finally: reader.close()
+	raw = raw[raw["kind"] == tslog.SAMPLE]
+	points = np.zeros(len(raw), np.dtype(BUCKET_DTYPE))
+	points["time"] = raw["time"]
+	points["count"] = 1
+	for name in ["Pmin","Pmean","Pmax"]: points[name] = raw["value1"]
+	for name in ["O2min","O2mean","O2max"]: points[name] = raw["value2"]
+	return points
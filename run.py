@@ -18,12 +18,20 @@
 #       >>> sudo apt-get update
 #		>>> sudo apt-get install fswebcam
 #		check that camera works: from command line, input fswebcam "image.jpg"
-#       pyexiv2:
-#       >>> sudo apt-get install python-pyexiv2
 #       adc:
 #       >>> sudo pip install Adafruit_ADS1x15
+#       numpy:
+#       >>> sudo apt-get install python3-numpy
+#       camera session (falls back to fswebcam without it):
+#       >>> sudo apt-get install python3-opencv python3-pil
 # 5. (Optional) to run from startup, edit /etc/rc.local (before the exit command)
 #		python /home/pi/<path to file>/run.py &
+# 6. (Optional) to run without a pi, use the simulated devices in devices.py:
+#		>>> PIE_BACKEND=sim python run.py
+# 7. (Optional) to run without a screen, run the reactor headless and attach
+#	the user interface to it when it is wanted (see control.py):
+#		>>> python run.py --headless		(--resume carries on a crashed run)
+#		>>> python run.py --attach
 
 ##################################
 
@@ -34,7 +42,7 @@
 # This file defines the user interface and operation of a photoreactor,
 # designed for use in the Bernhard Lab. The companion file 
 # calibrate_adc.py can be used to calibrate the sensors to provide 
-# accurate readings.
+# accurate readings; its profile is loaded at startup.
 
 # Features:
 # - runs photoreaction with/without illumination
@@ -48,19 +56,54 @@
 #	oxygen percentage change
 # - metadata can be updated through an external file 
 # - degases the system
+# - runs headless, controlled over a local socket, with the user interface
+#	attaching to it when it is wanted
 
 
-import RPi.GPIO as GPIO
+import signal
 import string
-import time
+import sys
 import os
 import subprocess
-from Tkinter import *
-import Tkinter, Tkconstants, tkFileDialog
-import pyexiv2
+try:
+	from Tkinter import *
+	import tkFileDialog, tkMessageBox
+except ImportError: # python 3
+	try:
+		from tkinter import *
+		import tkinter.filedialog as tkFileDialog
+		import tkinter.messagebox as tkMessageBox
+	except ImportError: pass # only run.py --headless works without Tk
 # from picamera import PiCamera
 
-import Adafruit_ADS1x15 as ads1x15
+# the ADC, relay board and camera are chosen in devices.py
+import devices
+from devices import clock
+import calibrate_adc
+from sampler import Sampler
+import sensors
+from capture import CaptureWorker, captions, pictureName
+from retained import RetainedCanvas
+from scheduler import Scheduler
+from stats import StreamStats
+import tslog
+from tslog import TimeSeriesLog
+from rollups import Rollups
+from degas import DegasController
+from textbuffer import TextBuffer
+from journal import Journal
+import quench
+from quench import QuenchPredictor
+import protocol
+from protocol import Timeline
+from thumbs import ThumbnailPool
+from analysis import Analyzer
+from webserver import WebServer
+from catalog import Catalog
+from archive import Archiver
+import control
+from control import ControlServer, ControlClient
+GPIO = devices.ObservedGPIO(devices.buildGPIO())
 
 # file reading/writing from 15-112: 
 # http://www.kosbie.net/cmu/spring-16/15-112/notes/
@@ -87,8 +130,7 @@ def initRun(data):
 	data.edit = [False,False,[False]*8,[False]*8,False] # run and cycle edits
 	data.error = ""
 	data.pipe = [False,False,[False]*8,[False]*8,False] # run and cycle edits
-	data.time = 0
-	data.lastPic = time.time()
+	data.lastPic = clock.time()
 	data.folder = "test"
 	makeFolder("test") # makes the test folder if it does not exist
 	data.running = False
@@ -98,13 +140,30 @@ def initRun(data):
 	data.illTime = 0
 	data.noLight = False
 	data.selected = [True]*6
+	# timed events
+	data.scheduler = Scheduler()
+	data.displayDelay = 0.5 # seconds between sensor/clock refreshes
+	data.journalDelay = 10 # seconds between journal syncs
+	data.picEvent = None
+	data.blinkEvent = None
+	data.quenchEvent = None
+	data.zeroEvent = None
+	data.stopEvent = None
 
 def initQuenching(data):
 	# for the quenching mode
+	data.scheduler.cancel(data.quenchEvent)
+	data.scheduler.cancel(data.zeroEvent)
+	data.scheduler.cancel(data.stopEvent)
+	data.quenchEvent = None
+	data.zeroEvent = None
+	data.stopEvent = None
+	# predicts when the oxygen reaches the next percentage
+	data.predictor = QuenchPredictor()
 	data.quenching = False
 	data.hanging = False
 	data.start = 0
-	data.nextO2 = range(20,10,-2)+range(10,0,-1)+[.5,.1,0]
+	data.nextO2 = list(range(20,10,-2))+list(range(10,0,-1))+[.5,.1,0]
 	data.count0 = None
 	data.taken = False
 
@@ -112,17 +171,46 @@ def initADC(data):
 	# for the adc setup
 	# bulbasaur: ADS1115
 	# ivysaur: ADS1015
-	data.adc = ads1x15.ADS1115()
+	data.adc = devices.buildADC("ADS1115")
 	# bulbasaur: (0.07777,0.001289),(21500,1300)
 	# ivysaur: (1,0.030511),(1300,1300)
-	data.cal = (0.07777,0.001289) # for each ndew adc/pi/sensor, calibrate.py
-	data.zero = (21500,1300) # read value, desired value
+	# the profile saved by calibrate_adc.py for this pi and adc is used, and
+	# the bulbasaur values if there is none
+	# cal: pressure, oxygen; zero: read value, desired value
+	data.cal,data.zero = calibrate_adc.calibration(((0.07777,0.001289),
+		(21500,1300)), "ADS1115")
+	# the channels are read round-robin in continuous mode ("continuous") or
+	# one conversion at a time ("single"); rdyPin is the BCM pin wired to
+	# the ADC's ALERT/RDY output, or None to pace reads by the data rate
+	data.adcMode = "continuous"
+	data.rdyPin = None
+	# (channel, gain, data rate) of pressure and oxygen; the ADS1015 rates
+	# are 128-3300, the ADS1115 rates 8-860
+	data.channels = [(3,1,860),(0,1,860)]
 	data.pressure = "----"
-	data.O2vals = []
+	# running statistics of each sensor, updated every sample
+	data.O2stats = StreamStats(window=15)
+	data.Pstats = StreamStats(window=5)
 	data.lastO2 = 0
 	data.lastPressure = 0
 	data.pZero = 1523
 	data.degas = False
+	# the sensors are read on their own thread
+	data.sampleRate = 10 # samples per second
+	data.sampler = Sampler(lambda: getReading(data), data.sampleRate)
+	data.sampler.listeners.append(lambda sample: logSample(data, sample))
+	# the degas valve is controlled from every sample, on the sampler thread;
+	# the gas is held off while waiting for a quenching photo
+	data.degasControl = DegasController(lambda: gasOn(data),
+		lambda: gasOff(data), lambda: data.degas and not data.hanging,
+		data.pZero, band=(5.0,5.0), dwell=2.0)
+	data.sampler.listeners.append(data.degasControl.sample)
+	data.lastSample = 0 # number of samples already read by readData
+
+def initScanner(data):
+	# connects to the ADC channels, after the pins are set up
+	data.scanner = devices.buildScanner(data.adc, data.channels, data.adcMode,
+		gpio=GPIO, rdyPin=data.rdyPin)
 
 def initPins(data):
 	# Initializes Raspberry Pi to communicate with relay board
@@ -139,13 +227,21 @@ def initPins(data):
 	for pin in data.pins:
 		GPIO.output(pin, data.off)
 	GPIO.output(data.gasPin, data.off)
+	data.relays = {} # last logged state of each pin
+	GPIO.listeners.append(lambda pins,value: logOutput(data, pins, value))
 
 def initCycle(data):
 	# Initializes cycles
 	data.times = [[""]*8, [0]*8] # editing and non-editing
 	data.cycles = [[""]*8, [0]*8] # editing and non-editing
-	data.cycling = False
+	data.cycling = False # a protocol is being run
 	data.edited = False
+	data.protocol = None # compiled protocol, from a file or the table
+	data.protocolFile = None
+	data.protocolStart = None
+	data.protocolIndex = 0 # events of the protocol already done
+	data.protocolEvent = None
+	data.preview = (None,"")
 
 def initMeta():
 	# sets the blank metadata
@@ -161,22 +257,57 @@ def initMeta():
 
 def init(data):
 	# Initialization of user interface
+	data.client = None # the headless reactor the interface is attached to
 	initRun(data)
 	initADC(data)
 	initQuenching(data)
 
 	# Metadata editing
-	data.index = (0,0)
-	data.mEdit = initMeta()
+	data.mEdit = TextBuffer(initMeta())
 	data.metadata = initMeta()
-
-	# camera init
-	# data.camera = PiCamera()
-	# data.camera.annotate_text_size = 64
-	# data.camera.resolution = (2592, 1944)
+	data.metaTop = 0 # first line shown in the metadata box
+	data.metaView = (None,None) # what was drawn in the metadata box
+
+	# thumbnails and previews are made, and the vial colours measured, by
+	# process pools, which are started before any other thread
+	data.thumbs = ThumbnailPool()
+	data.analyzer = Analyzer()
+	# the latest pictures and readings are served over HTTP
+	data.web = WebServer(lambda: data.picFolder, lambda: webReadings(data))
+	data.web.start()
+	data.web.ready.wait()
+	# the reactor runs without the web pages, but the user is told
+	if data.web.error is not None:
+		data.error = "Web server failed: " + str(data.web.error)
+	# every picture is added to the catalog as it is saved
+	data.catalog = Catalog()
+
+	# camera init, the camera stays open for the whole run
+	data.camera = devices.buildCamera()
 
 	initCycle(data)
+	data.log = None
+	data.rollups = None
+	openLog(data)
+	data.thumbs.generateMissing(data.picFolder)
 	initPins(data)
+	initScanner(data)
+	data.sampler.start()
+	data.scheduler.after(0, lambda: displayDue(data))
+	data.scheduler.after(60, lambda: logFlushDue(data))
+	# the state of the run is journaled so it can be resumed after a crash
+	data.journal = Journal("run.journal")
+	data.resumable = data.journal.compact()
+	data.scheduler.after(data.journalDelay, lambda: journalDue(data))
+
+	# pictures are taken on their own thread
+	data.capture = CaptureWorker()
+	data.capture.start()
+
+	# finished runs and old pictures are moved into archive shards
+	data.archiver = Archiver(".", data.catalog.folders, lambda: data.picFolder,
+		data.capture.busy)
+	data.archiver.start()
 
 
 ####################################
@@ -235,11 +366,13 @@ def press(data, index):
 	if index == 3: 
 		# starts/stops the main testing system
 		data.running = not data.running
+		data.log.log(clock.time(), tslog.RUN, value1=int(data.running))
 		if data.running:
-			data.time = 0
+			data.resumable = None # a new run replaces the interrupted one
 			data.illTime = 0
-			data.lastPic = time.time()
-			data.startTime = time.time()
+			data.lastPic = clock.time()
+			data.startTime = clock.time()
+			data.lightOn = clock.time()
 			if not data.noLight:
 				for i in range(len(data.lightPins)):
 					GPIO.output(data.lightPins[i], data.on)
@@ -247,16 +380,22 @@ def press(data, index):
 			for i in range(len(data.picPins)):
 				GPIO.output(data.picPins[i], data.off)
 				data.lights[i+2] = False
+			if data.protocol is not None: startCycle(data)
+			else: schedulePics(data)
 		# turns everything off
 		else:
 			data.illTime = 0
+			stopCycle(data)
+			schedulePics(data)
 			for i in range(len(data.pins)):
 				GPIO.output(data.pins[i], data.off)
 				data.lights[i] = False
 	# can't take pictures during run
 	if index == 4 and not data.running: takePics(data)
 	if index == 5 and not data.running and not data.lights[0]: takeAPic(data)
-	if index == 10: data.mode = "setCycle"
+	if index == 10: 
+		data.mode = "setCycle"
+		data.edited = False
 	if index == 11: # quenching button
 		data.quenching = not data.quenching
 		if not data.quenching: initQuenching(data) # resets data
@@ -275,10 +414,10 @@ def gasOff(data):
 
 # This function allows the user to choose a file from a pop-up browser.
 
-def fileExplorer():
+def fileExplorer(filetypes=(("TEXT","*.txt"),("all files","*.*"))):
     location = os.getcwd() # chooses a start folder for the browser
     name = tkFileDialog.askopenfilename(initialdir = location,
-        title = "Select file",filetypes = (("TEXT","*.txt"),("all files","*.*")))
+        title = "Select file",filetypes = filetypes)
     if name == (): name = "" # prevents type error
     return name
 
@@ -290,7 +429,7 @@ def convToMeta(file):
 		return None
 	else:
 		contents = readFile(file)
-		return contents
+		return contents.replace("\r\n","\n").replace("\r","\n")
 
 
 # This function reacts to mouse clicks and reacts if a button is pressed.
@@ -308,13 +447,13 @@ def runMousePressed(event, data):
 		# checkbox clicks
 		if ((left+bwidth-1.25*margin < event.x < left+bwidth-margin/4) and
 			(top+margin/4 < event.y < top+margin*1.25)):
-			data.selected[index-3] = not data.selected[index-3]
+			command(data, "select", light=index-3)
 		elif event.y > top and event.y < top+bheight and 3 <= index <= 8: 
-			pressLight(data, index-1)
+			command(data, "light", light=index-1)
 	# right column clicks
 	if event.x > right and event.x < (right+bwidth):
 		if event.y > top and event.y < top+bheight and 3 <= index <= 8: 
-			press(data, index-3)
+			button(data, index-3)
 	# edit metedata block
 	if event.x > left and event.x < (right+bwidth):
 		if event.y > bheight and event.y < (bheight*4+margin*2):
@@ -324,25 +463,26 @@ def runMousePressed(event, data):
 				idx = int((event.y-bheight)//((bheight*3+margin*2)//12))
 				if event.x > center+column: idx += 26
 				elif event.x > center-column: idx += 13
-				lines = data.metadata.split("\n")
-				if len(lines) <= idx: idx = len(lines)-1
-				data.index = (idx,len(lines[idx]))
+				idx = min(idx+data.metaTop,data.mEdit.lineCount()-1)
+				data.mEdit.setCursor(idx,len(data.mEdit.line(idx)))
 	# metadata button
 	if event.x > center-bwidth//2 and event.x < center+bwidth//2:
 		if event.y > 10 and event.y < bheight-10:
 			if not data.edit[0] and not data.edit[1] and not data.edit[4]:
 				contents = convToMeta(fileExplorer())
-				if contents != None: data.metadata,data.mEdit = contents,contents
+				if contents != None and command(data, "metadata",
+						metadata=contents):
+					data.metaTop = 0
 	# far right clicks
 	if event.x > right+bwidth+margin and event.x < right+bwidth*5/4+margin:
 		if event.y > bheight+3*(margin+bheight) and event.y < 2*bheight+3*(margin+bheight):
-			press(data, 12)
+			button(data, 12)
 		if event.y > bheight+4*(margin+bheight) and event.y < 2*bheight+4*(margin+bheight):
-			press(data, 10)
+			button(data, 10)
 		if event.y > bheight+6*(margin+bheight) and event.y < 2*bheight+6*(margin+bheight):
-			press(data, 11)
+			button(data, 11)
 		if event.y > bheight+8*(margin+bheight) and event.y < 2*bheight+8*(margin+bheight):
-			press(data, 13)
+			button(data, 13)
 
 
 # These functions determine if a path is a valid folder or file.
@@ -366,86 +506,29 @@ def makeFolder(foldName):
 # This function backspaces out the character before the cursor in the metadata.
 
 def removeChar(data):
-    # determines which line of the multiline metadata is being edited
-    lines = data.mEdit.split("\n")
-    idx1,idx2 = data.index
-    line = lines[idx1]
-    # ensures no array access errors, removes elem from end of string
-    if idx2 >= len(line) and len(line) > 0: 
-        line = line[:-1]
-        data.index = (idx1,idx2-1)
-        lines[idx1] = line
-    # removes element from middle of string
-    elif idx2 > 0: 
-        line = line[:idx2-1]+line[idx2:]
-        data.index = (idx1,idx2-1)
-        lines[idx1] = line
-    # deletes newline separation between line before and current
-    elif idx1 != 0: 
-        data.index = (idx1-1,len(data.mEdit.split("\n")[idx1-1]))
-        newLine = lines[idx1-1]+lines[idx1]
-        # joins the two lines into one
-        if idx1+1 < len(lines):
-            lines = lines[:idx1-1]+[newLine]+lines[idx1+1:]
-        else: lines = lines[:idx1-1]+[newLine]
-    return "\n".join(lines)
+    data.mEdit.backspace()
 
 
 # This function adds a character to the metadata.
 
 def addChar(data,event):
-    # determines which line is being edited
-    lines = data.mEdit.split("\n")
-    idx1,idx2 = data.index
-    line = lines[idx1]
-    # ensures no array access errors
-    if idx2 >= len(line): line = line + event.char
-    elif idx2 >= 0: line = line[:idx2]+event.char+line[idx2:]
-    # ensures all newline removing gets all carriage returns
-    lines[idx1] = line.replace("\r","\n")
-    # adding a newline changes the line number
-    if event.keysym == "Return": data.index = (idx1+1,0)
-    else: data.index = (data.index[0],data.index[1]+1)
-    return "\n".join(lines)
+    data.mEdit.insert(event.char)
 
 
 # This function moves the cursor horizontally in metadata editing mode.
 
 def horiz(data,direction):
-    lines = data.mEdit.split("\n")
-    if direction == "Left":
-        # moves cursor left with wraparound, if possible
-        if data.index[1] != 0: data.index = (data.index[0],data.index[1]-1)
-        elif data.index[0] != 0: 
-            index = data.index[0]-1
-            data.index = (index,len(lines[index]))
-    elif direction == "Right":
-        # moves cursor right with wraparound, if possible
-        if data.index[1] != len(lines[data.index[0]]):
-            data.index = (data.index[0],data.index[1]+1)
-        elif data.index[0] < len(lines)-1: 
-            index = data.index[0]+1
-            data.index = (index,0)
+    # moves cursor with wraparound, if possible
+    if direction == "Left": data.mEdit.left()
+    elif direction == "Right": data.mEdit.right()
 
 
 # This function moves the cursor vertically in metadata editing mode.
 
 def vert(data,direction):
-    lines = data.mEdit.split("\n")
-    if direction == "Up":
-        # moves cursor up, if possible
-        if data.index[0] != 0:
-            idx = data.index[0]-1
-            lineLength = len(lines[idx])
-            if data.index[1] > lineLength: data.index = (idx,lineLength)
-            else: data.index = (idx,data.index[1])
-    elif direction == "Down":
-        # moves cursor down, if possible
-        if data.index[0] < len(lines)-1:
-            idx = data.index[0]+1
-            lineLength = len(lines[idx])
-            if data.index[1] > lineLength: data.index = (idx,lineLength)
-            else: data.index = (idx,data.index[1])
+    # moves cursor, if possible
+    if direction == "Up": data.mEdit.up()
+    elif direction == "Down": data.mEdit.down()
 
 
 # This function ends the editing operation for metadata and folder.
@@ -453,8 +536,8 @@ def vert(data,direction):
 def finishEditing(data,textType):
     # the index is reset and the overall variable is set as the edited
     if textType == "metadata":
-        data.metadata = data.mEdit
-        data.index = (0,0)
+        command(data, "metadata", metadata=data.mEdit.text())
+        data.mEdit.setCursor(0,0)
         index = 4
     # the editing operation is over
     data.edit[index] = False
@@ -468,13 +551,10 @@ def runKeyPressed(event, data):
 	# If the picture time is being edited, only valid times can be entered
 	if data.edit[0]:
 		if event.keysym == "Return": 
-			# time constraints of picture interval
-			if float(data.picTime) >= 0.05 and float(data.picTime) <= 100.0:  
+			# only valid picture times end the edit
+			if command(data, "picTime", picTime=data.picTime):
 				data.edit[0] = False
 				data.pipe[0] = False
-				data.newPicTime = int(float(data.picTime)*60)
-				data.cycling = False
-			else: data.error = "Must enter valid picture time"
 		# ensures valid keystrokes
 		elif event.keysym in map(str,range(10)): 
 			data.error = ""
@@ -487,10 +567,9 @@ def runKeyPressed(event, data):
 	# if the folder name is being edited only valid folder names can be entered
 	if data.edit[1]:
 		if event.keysym == "Return":
-			makeFolder(data.folder)
+			command(data, "folder", folder=data.folder)
 			data.edit[1] = False
 			data.pipe[1] = False
-			data.picFolder = data.folder
 		elif event.keysym == "BackSpace": data.folder = data.folder[:-1]
 		else:
 			data.error = ""
@@ -499,12 +578,12 @@ def runKeyPressed(event, data):
 	# editing metadata
 	if data.edit[4]:
 		if event.keysym == "Escape": finishEditing(data,"metadata")
-		elif event.keysym == "BackSpace": data.mEdit = removeChar(data)
+		elif event.keysym == "BackSpace": removeChar(data)
 		elif event.keysym == "Left" or event.keysym == "Right": 
 			horiz(data,event.keysym)
 		elif event.keysym == "Up" or event.keysym == "Down":
 			vert(data,event.keysym)
-		else: data.mEdit = addChar(data,event)
+		else: addChar(data,event)
 
 
 # This function returns a list with no empty string elements.
@@ -513,125 +592,409 @@ def clearFluff(lst):
     return [x for x in lst if x != ""]
 
 
-# This function takes the picture and writes data onto it.
-
-def picture(data,address,foldName,letter,picName):
+# This function opens the sensor log in the picture folder. Every sensor
+# sample, relay change, picture and run start/end is saved to it, and the
+# samples are also kept downsampled for plotting long runs.
+
+def openLog(data):
+	path = data.picFolder + "/sensors.log"
+	# the log of the folder is kept open, not opened a second time
+	if data.log is not None and data.log.path == path: return
+	# the old logs are closed first; samples logged meanwhile are dropped
+	if data.log is not None: data.log.close()
+	if data.rollups is not None: data.rollups.close()
+	data.log = TimeSeriesLog(path)
+	data.rollups = Rollups(path)
+
+def logSample(data, sample):
+	data.log.log(sample[0], tslog.SAMPLE, value1=sample[1], value2=sample[2])
+	data.rollups.sample(sample)
+
+# only changes of state are logged, since the gas is turned off repeatedly
+def logOutput(data, pins, value):
+	for pin in pins:
+		if data.relays.get(pin) == value: continue
+		data.relays[pin] = value
+		if pin == data.gasPin: kind = tslog.GAS
+		else: kind = tslog.RELAY
+		data.log.log(clock.time(), kind, code=pin, value1=int(value == data.on))
+
+def logFlushDue(data):
+	data.log.flush()
+	data.rollups.flush()
+	data.scheduler.after(60, lambda: logFlushDue(data))
+
+
+# This function returns the state of the run that is journaled.
+
+def runState(data):
+	return {"running":data.running, "folder":data.picFolder,
+		"picTime":data.picTime, "newPicTime":data.newPicTime,
+		"illTime":data.illTime, "startTime":getattr(data,"startTime",None),
+		"lastPic":data.lastPic, "lightOn":getattr(data,"lightOn",None),
+		"noLight":data.noLight, "degas":data.degas, "lights":list(data.lights),
+		"selected":list(data.selected), "metadata":data.metadata,
+		"times":list(data.times[1]), "cycles":list(data.cycles[1]),
+		"cycling":data.cycling, "protocol":(None if data.protocol is None
+			else data.protocol.protocol), "protocolStart":data.protocolStart,
+		"protocolIndex":data.protocolIndex, "quenching":data.quenching,
+		"hanging":data.hanging, "start":data.start, "nextO2":list(data.nextO2),
+		"count0":data.count0, "taken":data.taken,
+		"quenchLead":data.predictor.lead}
+
+# This function returns the state of the reactor sent over the control
+# socket: the journaled state, the readings and anything an attached user
+# interface shows.
+
+def clientState(data):
+	state = runState(data)
+	state.update({"lastPressure":data.lastPressure, "lastO2":data.lastO2,
+		"error":data.error, "protocolFile":data.protocolFile, "resumable":None})
+	if not data.running and data.resumable and data.resumable.get("running"):
+		state["resumable"] = dict((key,data.resumable[key]) for key in
+			("running","folder","illTime"))
+	return state
+
+# The journal is synced now and then, with the time the program was last
+# known to be running.
+def journalDue(data):
+	data.journal.record({"alive":clock.time()})
+	data.journal.sync()
+	data.scheduler.after(data.journalDelay, lambda: journalDue(data))
+
+
+# This function asks whether to carry on with a run that was interrupted.
+
+def offerResume(data):
+	state = data.resumable
+	if not state or not state.get("running"): return
+	hours = round(state["illTime"]/3600.0,2)
+	if tkMessageBox.askyesno("Resume run", "A run in " + state["folder"] + 
+			" stopped after " + str(hours) + " hours of illumination. "
+			"Resume it?"):
+		command(data, "resume")
+	data.resumable = None
+
+
+# This function carries on with an interrupted run from the journaled state.
+# The lights were on until the program was last known to be running, which
+# is added to the illumination time. Pending quenching waits are scheduled
+# again for the time they were due.
+
+def resumeRun(data, state):
+	now = clock.time()
+	# the log of the folder is usually open already, and is kept
+	if state["folder"] != data.picFolder:
+		data.folder = data.picFolder = state["folder"]
+		makeFolder(data.picFolder)
+		openLog(data)
+	data.picTime,data.newPicTime = state["picTime"],state["newPicTime"]
+	data.noLight,data.degas = state["noLight"],state["degas"]
+	data.selected = state["selected"]
+	data.metadata = state["metadata"]
+	data.mEdit = TextBuffer(data.metadata)
+	data.times[1],data.cycles[1] = state["times"],state["cycles"]
+	if state["protocol"] is not None: data.protocol = Timeline(state["protocol"])
+	data.cycling = state["cycling"]
+	data.protocolStart = state["protocolStart"]
+	data.protocolIndex = state["protocolIndex"]
+	data.quenching,data.hanging = state["quenching"],state["hanging"]
+	data.start,data.nextO2 = state["start"],state["nextO2"]
+	data.count0,data.taken = state["count0"],state["taken"]
+	data.predictor.lead = state.get("quenchLead",0.0)
+	data.illTime = state["illTime"]
+	alive = state.get("alive",state["lightOn"])
+	if not data.noLight and alive > state["lightOn"]:
+		data.illTime += alive - state["lightOn"]
+	data.startTime,data.lastPic = state["startTime"],state["lastPic"]
+	data.lightOn = now
+	if data.hanging and data.nextO2 != []:
+		data.quenchEvent = data.scheduler.after(
+			data.start+data.nextO2[0]*60-now, lambda: quenchDue(data))
+	if data.count0 != None and not data.taken:
+		data.zeroEvent = data.scheduler.after(data.count0+300-now,
+			lambda: zeroDue(data))
+	data.running = True
+	data.log.log(now, tslog.RUN, value1=1)
+	if not data.noLight:
+		for i in range(len(data.lightPins)):
+			GPIO.output(data.lightPins[i], data.on)
+			data.lights[i] = True
+	# the protocol catches up with the phases it missed
+	if data.cycling: protocolDue(data)
+	schedulePics(data)
+
+
+# This function describes the latest sensor readings for a picture. It only
+# reads values that readData replaces whole, so it is safe to call from the
+# capture thread.
+
+def sensorText(data):
+	return captions(data.illTime, data.lastPressure, data.lastO2)[1:]
+
+
+# This function takes the picture and writes data onto it. It runs on the
+# capture thread.
+
+def picture(data,name,letter):
 
 	# creates writing on the picture and metadata to convey information
-	title = ("Total Illumination: " + 
-		str(round(data.illTime/60.0,2)) + " minutes")
-	pressure,oxygen = readData(data)
-	name = address+foldName[-1]+letter+picName
-	# time.sleep(1)
-	# data.camera.annotate_text = title + "\n" + pressure + "\n" + oxygen
-	# data.camera.capture(name)
-	subprocess.check_call(["fswebcam","--title",title,"--subtitle",pressure,
-		"--info",oxygen,"--font",'"sans:60"',name,"-r 2592x1944"])
-	metadata = pyexiv2.ImageMetadata(name)
-	metadata.read()
+	title,pressure,oxygen = captions(data.illTime, data.lastPressure,
+		data.lastO2)
 	userdata = "\n".join(clearFluff(data.metadata.split("\n")))
 	userdata = (pressure).join(userdata.split("Pressure:"))
 	userdata = (oxygen).join(userdata.split("Oxygen:"))
 	userdata = (title).join(userdata.split("Illumination Time:"))
-	metadata['Exif.Image.XPComment'] = (
-		pyexiv2.utils.string_to_undefined(userdata.encode('utf-16')))
-	metadata.write()
+	data.camera.capture(name,title,pressure,oxygen,userdata)
+	data.catalog.add(name,clock.time(),letter,data.illTime,data.lastPressure,
+		data.lastO2,userdata)
+	return name
+
+
+# These functions build the steps of a capture job. Each picture is named
+# when it is taken, not when it is queued.
+
+def pictureStep(data, letter):
+	folder = data.picFolder
+	def step():
+		name = picture(data,pictureName(folder,letter,clock.time()),letter)
+		data.log.log(clock.time(), tslog.CAPTURE, 
+			code=ord(letter) if letter else 0, value1=data.illTime)
+		return name
+	return step
+
+def lightStep(pins, value):
+	return lambda: GPIO.output(pins, value)
+
+# The time the lights came back on is added to back, as the job's callback
+# runs on the user interface thread some time later.
+def lightsBackStep(data, back):
+	# the run may have been ended while the pictures were taken
+	def step():
+		if data.running and not data.noLight:
+			GPIO.output(data.lightPins, data.on)
+			back.append(clock.time())
+	return step
+
+
+# This function reacts to a finished capture job on the UI thread.
+
+# back holds the time the capture thread turned the lights back on, if it
+# did.
 
+def picsTaken(data, results, error, back=()):
+	if error is not None: data.error = "Picture failed: " + str(error)
+	publish(data, results)
+	if back and data.running and not data.noLight:
+		for i in range(len(data.lightPins)):
+			data.lights[i] = True
+		data.lightOn = back[0]
 
-# This function takes a single picture of the testing system.
 
-def takeAPic(data):
+# This function hands new pictures to the thumbnail and analysis pools and
+# the web server.
 
-    # develops a name for the picture
-    date = time.localtime(time.time())
-    picName = time.strftime(":y%ym%md%dH%HM%MS%S.jpg",date)
-    address = data.picFolder + "/"
+def publish(data, names):
+	data.thumbs.submit(names)
+	data.analyzer.submit(names)
+	for name in names: data.web.published(name)
+
+
+# This function returns the readings shown by the web server. It runs on the
+# server thread.
+
+def webReadings(data):
+	return {"time":clock.time(), "pressure":int(data.lastPressure),
+		"oxygen":data.lastO2, "running":data.running,
+		"illumination":round(data.illTime/60.0,2), "folder":data.picFolder}
+
+
+# This function takes a single picture of the testing system. The picture
+# is queued on the capture thread; callback(results, error) is called when
+# it has been taken. Returns False if the capture queue is full.
+
+def takeAPic(data, callback=None):
 
-    # ensures that any subfolders aren't re-called
-    foldName = data.picFolder.split("/")    
     alphabet = ["A","B","C","D","E","F"]
+    steps = []
 
     # takes a picture and names it for the light that is on
     for i in range(len(data.lights)):
         if data.lights[i] and i != 0 and i != 1:
-            letter = alphabet[i-2]
-            # take picture
-            picture(data,address,foldName,letter,picName)
+            steps.append(pictureStep(data, alphabet[i-2]))
     # no light on has no differentiating letter in pic name
     if data.lights == [False]*8: 
-        picture(data,address,foldName,"",picName)
+        steps.append(pictureStep(data, ""))
+    if callback is None: callback = lambda results,error: picsTaken(data,
+        results,error)
+    if not data.capture.submit(steps, callback):
+        data.error = "Camera busy, picture skipped"
+        return False
+    return True
 
 
 # This function takes 6 picures of the testing system, one for each
-# different picture light available.
+# different picture light available. The pictures are queued on the capture
+# thread; if lightsBack is set the illumination lights come back on when
+# they are done. Returns False if the capture queue is full.
 
-def takePics(data):
+def takePics(data, lightsBack=False):
 
 	# makes sure all lights are off initially
-	for i in range(len(data.pins)):
-		GPIO.output(data.pins[i], data.off)
-		data.lights[i] = False
-
-	# ensures that any subfolders aren't re-called
-	foldName = data.picFolder.split("/") 
+	steps = [lightStep(data.pins, data.off)]
 	alphabet = ["A","B","C","D","E","F"]
 	for i in range(len(data.picPins)):
 		if data.selected[i]:
-			# develops a name for the picture
-			date = time.localtime(time.time())
-			picName = time.strftime(":y%ym%md%dH%HM%MS%S.jpg",date)
-			address = data.picFolder + "/"
-			letter = alphabet[i]
-			# turn pic lights on
-			GPIO.output(data.picPins[i], data.on)
-			# take picture
-			picture(data,address,foldName,letter,picName)
-			# turn pic lights off
-			GPIO.output(data.picPins[i], data.off)
-
-
-# This function maintains the timing of the system.
-
-def runTimerFired(data):
-
-	# checks if the amount of time between pictures that was set has passed
-	if data.running and ((time.time() - data.lastPic) >= data.newPicTime):
-		if not data.noLight: data.illTime += data.newPicTime
-		takePics(data)
-		# turn lights on
-		data.lastPic = time.time()
-		if not data.noLight:
-			for i in range(len(data.lightPins)):
-				GPIO.output(data.lightPins[i], data.on)
-				data.lights[i] = True
-		if data.cycling: 
-			data.numCycles += 1
-			if data.numCycles >= data.cycles[1][data.cIndex]: nextCycle(data)
-	# flashes the cursor if in edit mode
-	if data.edit[0] and data.time % 5 == 0: data.pipe[0] = not data.pipe[0]
-	if data.edit[1] and data.time % 5 == 0: data.pipe[1] = not data.pipe[1]
-	if data.edit[4] and data.time % 5 == 0: data.pipe[4] = not data.pipe[4]
-	# takes a quenching photo at the proper time according to the pattern
-	if data.hanging and ((time.time()-data.start) > (data.nextO2[0]*60)): 
-		pressLight(data,7)
-		takeAPic(data)
+			# turn pic light on, take picture, turn pic light off
+			steps.append(lightStep(data.picPins[i], data.on))
+			steps.append(pictureStep(data, alphabet[i]))
+			steps.append(lightStep(data.picPins[i], data.off))
+	cleanup = [lightStep(data.picPins, data.off)]
+	back = []
+	if lightsBack: cleanup.append(lightsBackStep(data, back))
+	callback = lambda results,error: picsTaken(data,results,error,back)
+	if not data.capture.submit(steps, callback, cleanup):
+		data.error = "Camera busy, pictures skipped"
+		return False
+	for i in range(len(data.pins)):
+		data.lights[i] = False
+	return True
+
+
+# This function takes the pictures at the end of each picture interval. If
+# the last interval's pictures are still being taken, this interval is
+# skipped so the captures cannot pile up.
+
+def intervalPics(data):
+	now = clock.time()
+	# the next interval is counted from when this one was due, not from when
+	# it fired, so the intervals do not drift
+	due = data.lastPic + data.newPicTime
+	if now - due >= data.newPicTime: due = now
+	data.lastPic = due
+	if data.capture.busy():
+		data.error = "Pictures falling behind, interval skipped"
+		return False
+	if not data.noLight: data.illTime += now - data.lightOn
+	return takePics(data, True)
+
+
+# This function takes a quenching photo under the UV light.
+
+def quenchPic(data):
+	pressLight(data,7)
+	if not takeAPic(data, lambda results,error: quenchPicTaken(data,results)):
 		pressLight(data,7)
-		data.hanging = False
-		data.nextO2 = filter(lambda x: x < (data.lastO2), data.nextO2)
-	# stops gas during picture wait
-	if data.quenching and len(data.nextO2) < 5 and not data.taken:
-		if data.pressure[1] == 0 and data.count0 == None:
-			data.count0 = time.time()
-		# takes final 0 picture
-		elif data.pressure[1] <= 0.2 and data.count0 != None:
-			if time.time()-data.count0 > 300 and data.pressure[1] == 0:
-				pressLight(data,7)
-				takeAPic(data)
-				pressLight(data,7)
-				data.taken = True
-		else: data.count0 = None
-	# updates the timer for repetitive actions
-	data.time += 1
+
+def quenchPicTaken(data, results):
+	pressLight(data,7)
+	publish(data, results)
+
+
+####################################
+# timed events
+####################################
+
+# These functions are run by data.scheduler when they are due. Each one
+# schedules itself again if it repeats.
+
+
+# This function schedules the next pictures of a run, counted from the last
+# pictures. It is called again whenever the picture time changes.
+
+def schedulePics(data):
+	data.scheduler.cancel(data.picEvent)
+	data.picEvent = None
+	# a running protocol takes its own pictures
+	if data.running and not data.cycling:
+		wait = data.newPicTime - (clock.time()-data.lastPic)
+		data.picEvent = data.scheduler.after(wait, lambda: picturesDue(data))
+
+def picturesDue(data):
+	data.picEvent = None
+	intervalPics(data)
+	schedulePics(data)
+
+
+# This function flashes the cursor while anything is being edited.
+
+def blinkDue(data):
+	data.blinkEvent = None
+	editing = False
+	for i in [0,1,4]:
+		if data.edit[i]:
+			data.pipe[i] = not data.pipe[i]
+			editing = True
+	for col in [2,3]:
+		for i in range(8):
+			if data.edit[col][i]:
+				data.pipe[col][i] = not data.pipe[col][i]
+				editing = True
+	if editing: data.blinkEvent = data.scheduler.after(0.5,
+		lambda: blinkDue(data))
+
+def startBlink(data):
+	if data.blinkEvent == None:
+		data.blinkEvent = data.scheduler.after(0, lambda: blinkDue(data))
+
+
+# This function refreshes the sensor readings, which also keeps the clocks
+# on the screen current.
+
+def displayDue(data):
+	readData(data)
+	data.scheduler.after(data.displayDelay, lambda: displayDue(data))
+
+
+# This function takes a quenching photo once the gas has been stopped for
+# the wait of the current oxygen percentage.
+
+def quenchDue(data):
+	data.quenchEvent = None
+	quenchPic(data)
+	row = data.predictor.pictured(clock.time(), data.lastO2)
+	if row != None:
+		print("Quench point " + str(row[1]) + ": oxygen " + str(row[6]))
+		quench.logPoint(data.picFolder, row)
+	data.hanging = False
+	data.nextO2 = [x for x in data.nextO2[1:] if x < data.lastO2]
+
+
+# This function stops the gas at the next oxygen percentage and waits to
+# take its quenching photo.
+
+def stopGasDue(data):
+	data.stopEvent = None
+	if data.hanging or not data.quenching or data.nextO2 == []: return
+	data.start = clock.time()
+	print("Hanging")
+	data.predictor.stopped(data.start, data.nextO2[0], data.lastO2)
+	data.hanging = True
+	data.quenchEvent = data.scheduler.after(data.nextO2[0]*60,
+		lambda: quenchDue(data))
+
+
+# This function waits for the oxygen to read 0 for 5 minutes before taking
+# the final quenching photo.
+
+def zeroCheck(data):
+	if not data.quenching or len(data.nextO2) >= 5 or data.taken: return
+	if data.pressure[1] == 0 and data.count0 == None:
+		data.count0 = clock.time()
+		data.zeroEvent = data.scheduler.after(300, lambda: zeroDue(data))
+	elif data.pressure[1] <= 0.2 and data.count0 != None:
+		# the wait ended while the reading was not 0
+		if data.zeroEvent == None and data.pressure[1] == 0: zeroDue(data)
+	else: 
+		data.count0 = None
+		data.scheduler.cancel(data.zeroEvent)
+		data.zeroEvent = None
+
+def zeroDue(data):
+	data.zeroEvent = None
+	if data.pressure[1] == 0 and not data.taken:
+		quenchPic(data)
+		data.taken = True
 
 
 # Provides a user-readable description of a light's status
@@ -669,15 +1032,15 @@ def drawButtons(canvas, data):
 		top = bheight+(3+i)*margin+(3+i)*bheight
 		bottom = top+bheight
 		corner = right+bwidth+margin
-		canvas.create_rectangle(left,top,left+bwidth,bottom,fill="lightgray")
-		canvas.create_text(left+bwidth/2,top+bheight/2,text=text,
+		canvas.rectangle(("light",i),left,top,left+bwidth,bottom,fill="lightgray")
+		canvas.text(("lightText",i),left+bwidth/2,top+bheight/2,text=text,
 			font="Arial 20 bold")
-		canvas.create_rectangle(left+bwidth-1.25*margin,top+margin/4,
+		canvas.rectangle(("select",i),left+bwidth-1.25*margin,top+margin/4,
 			left+bwidth-margin/4,top+margin*1.25,fill=selected(data,i))
 		if (i == 1 or i == 2): color="lightblue"
 		else: color="lightgray"
-		canvas.create_rectangle(right,top,right+bwidth,bottom,fill=color)
-		if i != 2 and i != 4: canvas.create_rectangle(corner,top,
+		canvas.rectangle(("button",i),right,top,right+bwidth,bottom,fill=color)
+		if i != 2 and i != 4: canvas.rectangle(("corner",i),corner,top,
 			corner+bwidth/4,bottom,fill="lightgray")    
 		fill2=fill3="black"
 		font2 = font3 = "Arial 15 bold"
@@ -694,7 +1057,7 @@ def drawButtons(canvas, data):
 			text3 = "Set\nCycle"
 		if i == 2:
 			text2 = "Folder: " + data.folder + piping(data,data.pipe[1])
-			if data.cycling: text3 = "Cycle Set"
+			if data.protocol is not None: text3 = "Cycle Set"
 		if i == 3:
 			if data.running: text2,fill2 = "End run","red"  
 			else: text2,fill2 = "Start run","black"
@@ -713,9 +1076,9 @@ def drawButtons(canvas, data):
 			text3 = "No\nLight"
 			font3 = "Arial 12 bold"
 
-		canvas.create_text(right+bwidth/2,top+bheight/2,text=text2,font=font2,
+		canvas.text(("buttonText",i),right+bwidth/2,top+bheight/2,text=text2,font=font2,
 			fill=fill2)
-		canvas.create_text(corner+2+bwidth/8,top+bheight/2,text=text3,
+		canvas.text(("cornerText",i),corner+2+bwidth/8,top+bheight/2,text=text3,
 				font=font3,fill=fill3)
 
 
@@ -733,31 +1096,22 @@ def drawTimes(canvas, data):
 
     # draws the clocks when running
     if data.running:
-        tim = time.time()-data.startTime
+        tim = clock.time()-data.startTime
         # calculates time stamps
         m,s = divmod(tim,60)
         h,m = divmod(m,60)
         text = ("Time running: " + "%d:%02d:%02d") % (h,m,s)
-        tim = data.newPicTime - (time.time()-data.lastPic)
+        tim = nextPicTime(data) - clock.time()
         m,s = divmod(tim,60)
         h,m = divmod(m,60)
         text2 = ("Next pic in: " + "%d:%02d:%02d") % (h,m,s)
         # draws clock
-        canvas.create_text(right+bwidth/2,top+bheight/2,text=text,
+        canvas.text("runClock",right+bwidth/2,top+bheight/2,text=text,
         	font="Arial 15 bold")
-        canvas.create_rectangle(right,top,right+bwidth,bottom)
-        canvas.create_text(left+bwidth/2,top+bheight/2,text=text2,
+        canvas.rectangle("runClockBox",right,top,right+bwidth,bottom)
+        canvas.text("picClock",left+bwidth/2,top+bheight/2,text=text2,
         	font="Arial 15 bold")
-        canvas.create_rectangle(left,top,left+bwidth,bottom)
-
-
-# This function computes the average of a list and rounds it.
-
-def average(lst):
-	total = 0
-	for i in range(len(lst)):
-		total += lst[i]
-	return round(total/(len(lst)),2)
+        canvas.rectangle("picClockBox",left,top,left+bwidth,bottom)
 
 
 # This function translates raw pressure and oxygen data into legible 
@@ -768,32 +1122,44 @@ def average(lst):
 
 def readData(data):
 
-	# does not update to out-of-bounds values
-	if 1300 < data.pressure[0] < 1900:
-		data.lastPressure = data.pressure[0]
+	# takes in every sample read since the last call
+	samples,data.lastSample = data.sampler.since(data.lastSample)
+	for sample in samples:
+		data.pressure = sample[1:]
+		# does not update to out-of-bounds values
+		if sensors.pressureValid(data.pressure[0]):
+			data.Pstats.update(data.pressure[0])
+			data.lastPressure = data.Pstats.mean()
+		# computes oxygen values at valid pressures
+		if sensors.oxygenValid(data.pressure[0]):
+			if data.O2stats.update(data.pressure[1]):
+				data.lastO2 = round(data.O2stats.mean(),2)
+			# the crossings are predicted from every reading, not the
+			# averages, which lag behind
+			if data.quenching and not data.hanging:
+				data.predictor.add(sample[0], data.pressure[1])
 	text = "Pressure: " + str(int(data.lastPressure))
-	# computes oxygen values at valid pressures
-	if data.pressure[0] < 1800:
-		data.O2vals.append(data.pressure[1])
-		if len(data.O2vals) == 15:
-			data.lastO2 = average(data.O2vals)
-			data.O2vals = []
 	text2 = "Oxygen: " + str(data.lastO2)
-	if (not data.hanging) and data.degas:
-		if data.pressure[0] < data.pZero: 
-			gasOn(data)
-		else: gasOff(data)
-	else: gasOff(data)
-	# checks if the gas should stop during quench experiments
-	if (not data.hanging) and data.quenching:
+	# nothing has been read from the sensors yet
+	if data.pressure == "----": return text,text2
+	# checks if the gas should stop during quench experiments: the stop is
+	# scheduled for the predicted time once it is due before the next
+	# refresh, and without a prediction the averaged oxygen must pass the
+	# percentage
+	if (not data.hanging) and data.quenching and data.stopEvent == None:
 		if data.nextO2 != []:
-			if ((data.nextO2[0] > 1 and data.lastO2 <= (data.nextO2[0]-.7)) or
+			now = clock.time()
+			stop = data.predictor.stopTime(data.nextO2[0])
+			if stop != None:
+				if stop-now <= data.displayDelay:
+					data.stopEvent = data.scheduler.after(stop-now,
+						lambda: stopGasDue(data))
+			elif ((data.nextO2[0] > 1 and data.lastO2 <= (data.nextO2[0]-.7)) or
 					(1 >= data.nextO2[0] > .1 and data.lastO2 <= 
-						(data.nextO2[0]-.3)) or (data.nextO2 <= .1 and 
+						(data.nextO2[0]-.3)) or (data.nextO2[0] <= .1 and 
 							data.lastO2 <= (data.nextO2[0]-.08))):
-				data.start = time.time()
-				print("Hanging")
-				data.hanging = True
+				stopGasDue(data)
+	zeroCheck(data)
 	return text,text2
 
 
@@ -801,85 +1167,91 @@ def readData(data):
 # pressure and oxygen readings.
 
 def getReading(data):
-	raw = (data.adc.read_adc_difference(3),data.adc.read_adc_difference(0))
+	raw = data.scanner.read()
 	return ((raw[0]-data.zero[0])*data.cal[0]+data.zero[1]),raw[1]*data.cal[1]
 
-# This function connects to the adc and prints the pressure output.
+# This function prints the pressure and oxygen output read by the sampler.
 
 def drawSensors(canvas, data):
 
 	# sizes to place pressure display below all buttons
 	margin,center,bheight,bwidth,left,right = sizeSpecs(data)
 
-	if data.time % 5 == 0: 
-		# read from adc
-		data.pressure = getReading(data)
-	# displays pressure and oxygen values
-	text,text2 = readData(data)
-	canvas.create_text(left+bwidth/2,data.height-bheight/4,text=text,
+	# displays pressure and oxygen values, which displayDue keeps current
+	text,text2 = sensorText(data)
+	canvas.text("pressure",left+bwidth/2,data.height-bheight/4,text=text,
 		font="Arial 20 bold")
-	canvas.create_text(right+bwidth/2,data.height-bheight/4,text=text2,
+	canvas.text("oxygen",right+bwidth/2,data.height-bheight/4,text=text2,
 		font="Arial 20 bold")
 
 
+# This function returns the text of the three columns of the metadata box,
+# with the cursor in it. Only the lines that fit in the box are used: the
+# box scrolls a column at a time to keep the cursor in view. The text is
+# only rebuilt when the metadata, cursor or scroll changes.
+
+def metaColumns(data, pipe, rows=13):
+	row,column = data.mEdit.cursor()
+	if row < data.metaTop: data.metaTop = row-row%rows
+	elif row >= data.metaTop+3*rows: data.metaTop = (row//rows-2)*rows
+	# the buffer is part of the key, as an imported or resumed text is a new
+	# buffer whose version starts again
+	key = (data.mEdit,data.mEdit.version,row,column,pipe,data.metaTop)
+	if data.metaView[0] == key: return data.metaView[1]
+	columns = []
+	for i in range(3):
+		start = data.metaTop+i*rows
+		lines = [data.mEdit.line(j) for j in
+			range(start,min(start+rows,data.mEdit.lineCount()))]
+		if start <= row < start+rows:
+			line = lines[row-start]
+			lines[row-start] = line[:column]+pipe+line[column:]
+		columns.append("\n".join(lines))
+	data.metaView = (key,columns)
+	return columns
+
+
 # This function displays the metadata in the top box.
 
 def drawMeta(canvas, data):
 	# initializes size and editing data
 	margin,center,bheight,bwidth,left,right = sizeSpecs(data)
-	text = data.mEdit
-	text1 = ""
-	text2 = ""
 	pipe = ""
 	# adds the blinking cursor to the correct space in the header
 	if data.edit[4]: 
-		canvas.create_text(center,.5*bheight,text="Press escape to end edit",
+		canvas.text("metaHelp",center,.5*bheight,text="Press escape to end edit",
 			font="Arial 20 bold")
 		if data.pipe[4]: pipe = "|"
 		else: pipe = " "
 	else:
 		# if not editing, the button appears
-		canvas.create_rectangle(center-bwidth//2,10,center+bwidth//2,
+		canvas.rectangle("metaButton",center-bwidth//2,10,center+bwidth//2,
 			bheight-10,fill="lightgray")
-		canvas.create_text(center,.5*bheight,text="Import Metadata",
+		canvas.text("metaButtonText",center,.5*bheight,text="Import Metadata",
 			font="Arial 15 bold")
-	lines = text.split("\n")
-	if len(lines) == 0: text = pipe
 	# writes lines appropriately
-	else:
-		line = lines[data.index[0]]
-		if data.index[1] < len(line):
-		    line = line[:data.index[1]]+pipe+line[data.index[1]:]
-		else: line = line+pipe
-		lines[data.index[0]] = line
-		if len(lines) > 26:
-			text = "\n".join(lines[:13])
-			text1 = "\n".join(lines[13:26])
-			text2 = "\n".join(lines[26:])
-		elif len(lines) > 13:
-			text = "\n".join(lines[:13])
-			text1 = "\n".join(lines[13:])
-		else: text = "\n".join(lines)
+	text,text1,text2 = metaColumns(data, pipe)
 	# draws all text 
-	canvas.create_rectangle(left,bheight,right+bwidth,bheight*4+margin*2)
-	canvas.create_text(left+5,bheight,text=text,font="Arial 10 bold",
+	canvas.rectangle("metaBox",left,bheight,right+bwidth,bheight*4+margin*2)
+	canvas.text("meta0",left+5,bheight,text=text,font="Arial 10 bold",
 		anchor="nw")
-	canvas.create_text(center+5-(2*margin+2*bwidth)//6,bheight,text=text1,
+	canvas.text("meta1",center+5-(2*margin+2*bwidth)//6,bheight,text=text1,
 		font="Arial 10 bold",anchor="nw")
-	canvas.create_text(center+5+(2*margin+2*bwidth)//6,bheight,text=text2,
+	canvas.text("meta2",center+5+(2*margin+2*bwidth)//6,bheight,text=text2,
 		font="Arial 10 bold",anchor="nw")
 
 
-# This function draws the UI every frame.
+# This function draws the UI every frame. canvas is a RetainedCanvas, so
+# each item is only changed when what it shows has changed.
 
 def runRedrawAll(canvas, data):
     
-    canvas.create_rectangle(0,0,data.width+5,data.height+5,fill="lightblue")
+    canvas.rectangle("runBackground",0,0,data.width+5,data.height+5,fill="lightblue")
     drawButtons(canvas, data)
     drawTimes(canvas, data)
     drawSensors(canvas,data)
     drawMeta(canvas,data)
-    canvas.create_text(data.width/2,20,text=data.error,font="Arial 20 bold",
+    canvas.text("runError",data.width/2,20,text=data.error,font="Arial 20 bold",
     	fill="red")
 
 
@@ -935,6 +1307,11 @@ def setCycleMousePressed(event, data):
 	index = int(event.y//bheight)
 	off = True
 
+	# protocol file button
+	if 10 < event.x < left-10 and bheight*1.1 < event.y < bheight*1.9:
+		loadProtocol(data)
+		return
+
 	# checks that the click is within the table
 	if index >= 2 and index < 8:
 		# left column
@@ -954,28 +1331,131 @@ def setCycleMousePressed(event, data):
 			else: data.edit[3][index] = False
 
 
-# This function initiates the cycle stage.
+# This function starts the protocol, when the run starts or when a protocol
+# is set during a run.
 
 def startCycle(data):
+	data.scheduler.cancel(data.protocolEvent)
+	data.protocolStart = clock.time()
+	data.protocolIndex = 0
+	data.cycling = True
+	schedulePics(data)
+	protocolDue(data)
+
+def stopCycle(data):
+	data.scheduler.cancel(data.protocolEvent)
+	data.protocolEvent = None
+	data.cycling = False
+
+
+# This function carries out the events of the protocol that are due, found
+# by a binary search of its timeline, and waits for the next one. If
+# several pictures are due at once (after a resume) they are taken once.
+
+def protocolDue(data):
+	data.protocolEvent = None
+	if not data.running or not data.cycling: return
+	now = clock.time()
+	due = data.protocol.indexAt(now-data.protocolStart)
+	events = data.protocol.events[data.protocolIndex:due]
+	data.protocolIndex = due
+	last = max([i for i,event in enumerate(events) 
+		if event[1] == protocol.PICTURES] or [-1])
+	for i,(t,kind,phase) in enumerate(events):
+		if kind == protocol.PHASE: applyPhase(data, phase)
+		elif kind == protocol.PICTURES and i == last: protocolPics(data)
+		elif kind == protocol.END: endCycle(data)
+	upcoming = data.protocol.timeOf(due)
+	if data.cycling and upcoming is not None:
+		data.protocolEvent = data.scheduler.after(
+			data.protocolStart+upcoming-clock.time(), lambda: protocolDue(data))
+
+# This function switches to the settings of a phase; settings the phase
+# leaves out stay as they are.
+
+def applyPhase(data, phase):
+	if phase["interval"] is not None: data.newPicTime = phase["interval"]
+	if phase["lights"] is not None: 
+		data.selected = [letter in phase["lights"] for letter in protocol.LETTERS]
+	if phase["degas"] is not None: data.degas = phase["degas"]
+	if phase["quench"] is not None and phase["quench"] != data.quenching:
+		if phase["quench"]: data.quenching = True
+		else: initQuenching(data)
+	if phase["light"] is not None and phase["light"] == data.noLight:
+		setIllumination(data, phase["light"])
+
+# This function turns the illumination lights on or off during a run,
+# keeping the illumination time.
+
+def setIllumination(data, on):
+	now = clock.time()
+	if on:
+		data.lightOn = now
+		value = data.on
+	else:
+		# the lights are off while pictures are taken
+		if not data.noLight and data.lights[0]: 
+			data.illTime += now - data.lightOn
+		value = data.off
+	data.noLight = not on
+	for i in range(len(data.lightPins)):
+		GPIO.output(data.lightPins[i], value)
+		data.lights[i] = on
+
+# This function takes the pictures of the protocol.
+
+def protocolPics(data):
+	now = clock.time()
+	data.lastPic = now
+	if data.capture.busy():
+		data.error = "Pictures falling behind, interval skipped"
+		return False
+	if not data.noLight: data.illTime += now - data.lightOn
+	return takePics(data, True)
+
+# At the end of the protocol, pictures go on at the last interval.
+
+def endCycle(data):
+	data.cycling = False
+	schedulePics(data)
+
+
+# This function returns when the next pictures will be taken.
+
+def nextPicTime(data):
+	if data.cycling:
+		upcoming = data.protocol.nextPictures(clock.time()-data.protocolStart)
+		if upcoming is not None: return data.protocolStart+upcoming
+	return data.lastPic + data.newPicTime
 
-	data.cIndex = 1
-	nextCycle(data)
 
+# This function returns the preview of the protocol that would be run: its
+# phases, length and number of pictures.
 
-# This function transitions between phases of the cycle.
+def protocolPreview(data):
+	if data.protocolFile is not None and not data.edited: 
+		return data.protocol.describe(sum(data.selected))
+	# the table is only compiled again when it changes
+	key = (tuple(data.times[1]),tuple(data.cycles[1]),sum(data.selected))
+	if data.preview[0] != key:
+		timeline = Timeline(protocol.fromTable(data.times[1][2:],
+			data.cycles[1][2:]))
+		data.preview = (key,timeline.describe(sum(data.selected)))
+	return data.preview[1]
 
-def nextCycle(data):
 
-	data.cIndex += 1
-	# stops the cycle at the end
-	if data.cIndex > 7:
-		data.cycling = False
+# This function loads a protocol file chosen by the user.
+
+def loadProtocol(data):
+	name = fileExplorer((("Protocol","*.json"),("all files","*.*")))
+	if name == "": return
+	try: loaded = protocol.load(name)
+	except (IOError, ValueError, KeyError, TypeError) as e:
+		data.error = "Invalid protocol: " + str(e)
 		return
-	data.numCycles = 0
-	# checks that the cycle moves to a non-empty state
-	if data.times[1][data.cIndex] != 0 and data.cycles[1][data.cIndex] != 0:
-		data.newPicTime = data.times[1][data.cIndex]
-	else: nextCycle(data)
+	data.error = ""
+	if command(data, "protocol", protocol=loaded, file=name):
+		data.edited = False
 
 
 # This function responds to keystrokes by the user.
@@ -998,34 +1478,10 @@ def setCycleKeyPressed(event, data):
 		# if no errors were generated, exits edit
 		if data.error == "": 
 			data.mode = "run"
-			if data.edited and data.times[0] != [""]*8:
-				data.cycling = True
-				startCycle(data)
-
-
-# This function maintains the picture timing of the run function even during
-# the editing process of the cycle.
-
-def setCycleTimerFired(data):
-
-	# checks if the time between pictures has elapsed
-	if data.running:
-		if (time.time() - data.lastPic) >= data.newPicTime:
-			if not data.noLight: data.illTime += data.newPicTime
-			takePics(data)
-			# turn lights on
-			data.lastPic = time.time()
-			if not data.noLight:
-				for i in range(len(data.lightPins)):
-					GPIO.output(data.lightPins[i], data.on)
-					data.lights[i] = True
-	# causes the editing cursor to oscillate
-	for i in range(8):
-		if data.edit[2][i]:
-			if data.time % 5 == 0: data.pipe[2][i] = not data.pipe[2][i]
-		if data.edit[3][i]:
-			if data.time % 5 == 0: data.pipe[3][i] = not data.pipe[3][i]
-	data.time += 1
+			# an emptied table clears the protocol
+			if data.edited:
+				command(data, "cycle", times=data.times[1],
+					cycles=data.cycles[1])
 
 
 # This function draws the setCycle table, including the values entered.
@@ -1038,30 +1494,226 @@ def drawTable(canvas, data):
 	bwidth = data.width/3
 	left = center-bwidth
 	# draws the grid and text
-	canvas.create_text(center,bheight/2,text="Press escape to return to the run screen",font="Arial 20 bold")
+	canvas.text("cycleHelp",center,bheight/2,text="Press escape to return to the run screen",font="Arial 20 bold")
 	for i in range(7):
-		canvas.create_rectangle(left, (i+1)*bheight, center, (i+2)*bheight,fill="white")
-		canvas.create_rectangle(center, (i+1)*bheight, center+bwidth, (i+2)*bheight,fill="white")
+		canvas.rectangle(("timeCell",i),left, (i+1)*bheight, center, (i+2)*bheight,fill="white")
+		canvas.rectangle(("cycleCell",i),center, (i+1)*bheight, center+bwidth, (i+2)*bheight,fill="white")
 		text1 = data.times[0][i+1]
 		text2 = data.cycles[0][i+1]
 		# adds an editing cursor if that cell is being edited
 		if data.edit[2][i+1]: text1 += piping(data,data.pipe[2][i+1])
 		if data.edit[3][i+1]: text2 += piping(data,data.pipe[3][i+1])
-		canvas.create_text(left+bwidth/2,(i+1.5)*bheight,text=text1,font="Arial 20 bold")
-		canvas.create_text(center+bwidth/2,(i+1.5)*bheight,text=text2,font="Arial 20 bold")
+		canvas.text(("timeText",i),left+bwidth/2,(i+1.5)*bheight,text=text1,font="Arial 20 bold")
+		canvas.text(("cycleText",i),center+bwidth/2,(i+1.5)*bheight,text=text2,font="Arial 20 bold")
 		if i == 0: 
-			canvas.create_text(left+bwidth/2,1.5*bheight,text="Time", font="Arial 20 bold")
-			canvas.create_text(center+bwidth/2,1.5*bheight,text="Number of Cycles",font="Arial 20 bold")
-	canvas.create_text(data.width/2,data.height-bheight/2,text=data.error,font="Arial 20 bold",fill="red")
+			canvas.text("timeHeader",left+bwidth/2,1.5*bheight,text="Time", font="Arial 20 bold")
+			canvas.text("cycleHeader",center+bwidth/2,1.5*bheight,text="Number of Cycles",font="Arial 20 bold")
+	canvas.rectangle("protocolButton",10,bheight*1.1,left-10,bheight*1.9,
+		fill="lightgray")
+	canvas.text("protocolButtonText",left/2,bheight*1.5,text="Load\nProtocol",
+		font="Arial 12 bold")
+	canvas.text("protocolPreview",data.width/2,bheight*8.25,
+		text=protocolPreview(data),font="Arial 15 bold")
+	canvas.text("cycleError",data.width/2,data.height-bheight/3,text=data.error,font="Arial 20 bold",fill="red")
 
 
 # This function redraws the canvas every clock cycle.
 
 def setCycleRedrawAll(canvas, data):
-	canvas.create_rectangle(0,0,data.width+5,data.height+5,fill="lightgreen")
+	canvas.rectangle("cycleBackground",0,0,data.width+5,data.height+5,fill="lightgreen")
 	drawTable(canvas, data)
 
 
+####################################
+# commands
+####################################
+
+# These functions change the reactor for the user interface or, when it
+# runs headless, for requests on the control socket (see control.py). Each
+# is given the request as a dict and raises ValueError if it can't be
+# carried out.
+
+
+# Buttons 1, 2 and 10 only change what the user interface shows; the rest
+# change the reactor.
+
+def button(data, index):
+	if index in (1,2,10): press(data, index)
+	else: command(data, "press", index=index)
+
+def pressCommand(data, request):
+	index = int(request["index"])
+	if index not in (0,3,4,5,11,12,13): 
+		raise ValueError("No button " + str(index))
+	press(data, index)
+
+def lightCommand(data, request):
+	light = int(request["light"])
+	if not 0 <= light < len(data.pins): 
+		raise ValueError("No light " + str(light))
+	pressLight(data, light)
+
+# This function chooses whether a picture light is used, or switches it
+# if the request does not say.
+def selectCommand(data, request):
+	light = int(request["light"])
+	if not 0 <= light < len(data.selected): 
+		raise ValueError("No picture light " + str(light))
+	data.selected[light] = bool(request.get("selected",
+		not data.selected[light]))
+
+def picTimeCommand(data, request):
+	picTime = str(request["picTime"])
+	try: minutes = float(picTime)
+	except ValueError: minutes = 0
+	# time constraints of picture interval
+	if not 0.05 <= minutes <= 100.0:
+		raise ValueError("Must enter valid picture time")
+	data.picTime = picTime
+	data.newPicTime = int(minutes*60)
+	# a set picture time replaces the protocol
+	stopCycle(data)
+	data.protocol = None
+	data.protocolFile = None
+	schedulePics(data)
+
+def folderCommand(data, request):
+	folder = str(request["folder"])
+	if folder == "": raise ValueError("Must enter a folder")
+	makeFolder(folder)
+	data.folder = data.picFolder = folder
+	openLog(data)
+	data.thumbs.generateMissing(data.picFolder)
+
+def metadataCommand(data, request):
+	data.metadata = str(request["metadata"])
+	if data.mEdit.text() != data.metadata: 
+		data.mEdit = TextBuffer(data.metadata)
+
+# This function compiles the cycle table, given as picture times in
+# seconds and numbers of pictures, into the protocol. An empty table
+# clears the protocol.
+def cycleCommand(data, request):
+	times = [int(t) for t in request["times"]]
+	cycles = [int(c) for c in request["cycles"]]
+	if len(times) != 8 or len(cycles) != 8:
+		raise ValueError("The cycle table has 8 rows")
+	data.times[1],data.cycles[1] = times,cycles
+	data.protocolFile = None
+	if not any(times[i] and cycles[i] for i in range(2,8)):
+		stopCycle(data)
+		data.protocol = None
+		schedulePics(data)
+		return
+	data.protocol = Timeline(protocol.fromTable(times[2:], cycles[2:]))
+	if data.running: startCycle(data)
+
+def protocolCommand(data, request):
+	try: timeline = Timeline(request["protocol"])
+	except (ValueError, KeyError, TypeError, AttributeError) as e:
+		raise ValueError("Invalid protocol: " + str(e))
+	data.protocol = timeline
+	data.protocolFile = request.get("file")
+	if data.running: startCycle(data)
+
+def resumeCommand(data, request):
+	state = data.resumable
+	if data.running or not state or not state.get("running"):
+		raise ValueError("No run to resume")
+	data.resumable = None
+	resumeRun(data, state)
+
+COMMANDS = {"press":pressCommand, "light":lightCommand,
+	"select":selectCommand, "picTime":picTimeCommand, "folder":folderCommand,
+	"metadata":metadataCommand, "cycle":cycleCommand,
+	"protocol":protocolCommand, "resume":resumeCommand}
+
+def runCommand(data, request):
+	if request.get("command") not in COMMANDS: 
+		raise ValueError("Unknown command " + repr(request.get("command")))
+	COMMANDS[request["command"]](data, request)
+
+
+# This function gives a command from the user interface, to the reactor in
+# this process or to the headless one it is attached to. Returns whether
+# it was carried out; if not, the reason is shown as the error.
+
+def command(data, name, **request):
+	request["command"] = name
+	try:
+		if data.client is None: runCommand(data, request)
+		else: mirror(data, data.client.command(request))
+	except (IOError, ValueError) as e:
+		data.error = str(e)
+		return False
+	return True
+
+
+####################################
+# attached user interface
+####################################
+
+# When the user interface is attached to a headless reactor, data holds a
+# copy of the reactor's state, refreshed from the control socket, and the
+# interface only keeps what is being edited.
+
+def initClient(data, client):
+	data.client = client
+	initRun(data)
+	initQuenching(data)
+	initCycle(data)
+	data.mEdit = TextBuffer(initMeta())
+	data.metadata = initMeta()
+	data.metaTop = 0
+	data.metaView = (None,None)
+	data.lastPressure = 0
+	data.lastO2 = 0
+	data.startTime = data.lightOn = None
+	data.resumable = None
+	data.serverError = "" # the last error shown by the reactor
+	data.reachable = True
+	stateDue(data)
+
+# These settings are copied as they are.
+MIRRORED = ["running","newPicTime","illTime","startTime","lastPic","lightOn",
+	"noLight","degas","lights","selected","cycling","protocolStart",
+	"protocolIndex","quenching","hanging","lastPressure","lastO2",
+	"protocolFile","resumable"]
+
+def mirror(data, state):
+	for key in MIRRORED: setattr(data, key, state[key])
+	# what the user is editing is left alone
+	if not data.edit[0]: data.picTime = state["picTime"]
+	if not data.edit[1]: data.folder = state["folder"]
+	data.picFolder = state["folder"]
+	if not data.edit[4] and state["metadata"] != data.metadata:
+		data.metadata = state["metadata"]
+		data.mEdit = TextBuffer(data.metadata)
+	if data.mode != "setCycle":
+		data.times[1],data.cycles[1] = state["times"],state["cycles"]
+		data.times[0] = ["" if t == 0 else "%g" % (t/60.0) 
+			for t in state["times"]]
+		data.cycles[0] = ["" if c == 0 else str(c) for c in state["cycles"]]
+	if state["protocol"] is None: data.protocol = None
+	elif data.protocol is None or data.protocol.protocol != state["protocol"]:
+		data.protocol = Timeline(state["protocol"])
+	if state["error"] != data.serverError:
+		data.serverError = data.error = state["error"]
+
+def stateDue(data):
+	try: mirror(data, data.client.state())
+	except (IOError, ValueError) as e:
+		data.error = "Reactor not reachable: " + str(e)
+		data.reachable = False
+	else:
+		if not data.reachable: data.error = data.serverError
+		data.reachable = True
+	data.scheduler.after(data.displayDelay, lambda: stateDue(data))
+
+def clientTimerFired(data):
+	data.scheduler.runDue()
+
+
 ####################################
 # mode dispatcher
 ####################################
@@ -1069,14 +1721,20 @@ def setCycleRedrawAll(canvas, data):
 def mousePressed(event, data):
     if (data.mode == "run"): runMousePressed(event, data)
     if (data.mode == "setCycle"): setCycleMousePressed(event, data)
+    startBlink(data)
 
 def keyPressed(event, data):
     if (data.mode == "run"): runKeyPressed(event, data)
     if (data.mode == "setCycle"): setCycleKeyPressed(event, data)
+    startBlink(data)
+
+# Timed events run in either mode, so pictures keep being taken while the
+# cycle is edited.
 
 def timerFired(data):
-	if (data.mode == "run"): runTimerFired(data)
-	if (data.mode == "setCycle"): setCycleTimerFired(data)
+	data.capture.finish() # reacts to any pictures that have been taken
+	data.scheduler.runDue()
+	data.journal.record(runState(data))
 
 def redrawAll(canvas, data):
     if (data.mode == "run"): runRedrawAll(canvas, data)
@@ -1088,44 +1746,115 @@ def redrawAll(canvas, data):
 #		notes-animations-examples.html#modeDemo
 ####################################
 
-def runUI(width=300, height=300):
+# This function stops the devices, threads and pools and saves the run.
+
+def shutdown(data):
+	print("Degas: " + data.degasControl.stats())
+	data.sampler.stop()
+	data.sampler.join()
+	data.scanner.stop()
+	data.archiver.stop()
+	data.capture.stop()
+	data.capture.join()
+	data.camera.close()
+	data.thumbs.close(False)
+	data.analyzer.close()
+	data.web.stop()
+	data.catalog.close()
+	data.log.close()
+	data.rollups.close()
+	data.journal.record(runState(data))
+	data.journal.close()
+	GPIO.cleanup()
+
+
+# This function runs the reactor without a screen, driven over the control
+# socket, until it is interrupted or terminated. Between timed events it
+# waits for requests instead of drawing. If resume is set, a run that was
+# interrupted is carried on.
+
+def runHeadless(resume=False, path=control.SOCKET):
+	class Struct(object): pass
+	data = Struct()
+	data.width = data.height = 800
+	init(data)
+	data.control = ControlServer(lambda: clientState(data),
+		lambda request: runCommand(data, request), path)
+	data.control.start()
+	data.control.ready.wait()
+	if data.control.error is not None: print("Control socket failed: " +
+		str(data.control.error))
+	if resume and data.resumable and data.resumable.get("running"):
+		resumeCommand(data, {})
+	stopping = []
+	signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+	try:
+		while not stopping:
+			timerFired(data)
+			data.control.serve(data.scheduler.wait())
+	except KeyboardInterrupt: pass
+	data.control.stop()
+	shutdown(data)
+
+
+# The user interface runs the reactor itself, or is attached to a headless
+# reactor through the control socket at attach.
+
+def runUI(width=300, height=300, attach=None):
     def redrawAllWrapper(canvas, data):
-        canvas.delete(ALL)
-        redrawAll(canvas, data)
+        # items are kept between frames and only changed when they differ
+        data.view.beginFrame()
+        redrawAll(data.view, data)
+        data.view.endFrame()
         canvas.update()    
 
     def mousePressedWrapper(event, canvas, data):
         mousePressed(event, data)
-        redrawAllWrapper(canvas, data)
+        wakeUp(canvas, data)
 
     def keyPressedWrapper(event, canvas, data):
         keyPressed(event, data)
-        redrawAllWrapper(canvas, data)
+        wakeUp(canvas, data)
 
     def timerFiredWrapper(canvas, data):
-        timerFired(data)
+        if attach is None: timerFired(data)
+        else: clientTimerFired(data)
         redrawAllWrapper(canvas, data)
-        # pause, then call timerFired again
-        canvas.after(data.timerDelay, timerFiredWrapper, canvas, data)
+        # sleeps until the next scheduled event
+        wait = int(data.scheduler.wait()*1000)
+        data.afterId = canvas.after(wait, timerFiredWrapper, canvas, data)
+
+    def wakeUp(canvas, data):
+        # an input may have scheduled an event sooner than the current sleep
+        canvas.after_cancel(data.afterId)
+        timerFiredWrapper(canvas, data)
     # Set up data and call init
     class Struct(object): pass
     data = Struct()
     data.width = width
     data.height = height
-    data.timerDelay = 100 # milliseconds
-    init(data)
+    if attach is None: init(data)
+    else: initClient(data, ControlClient(attach))
     # create the root and the canvas
     root = Tk()
     canvas = Canvas(root, width=data.width, height=data.height)
     canvas.pack()
+    data.view = RetainedCanvas(canvas)
     # set up events
     root.bind("<Button-1>", lambda event:
                             mousePressedWrapper(event, canvas, data))
     root.bind("<Key>", lambda event:
                             keyPressedWrapper(event, canvas, data))
+    offerResume(data)
     timerFiredWrapper(canvas, data)
     # and launch the app
     root.mainloop()  # blocks until window is closed
-    GPIO.cleanup()
-
-runUI(800, 800)
+    print("Frame cost: " + data.view.stats())
+    # an attached interface leaves the reactor running
+    if attach is None: shutdown(data)
+    else: data.client.close()
+
+if __name__ == "__main__":
+	if "--headless" in sys.argv: runHeadless("--resume" in sys.argv)
+	elif "--attach" in sys.argv: runUI(800, 800, control.SOCKET)
+	else: runUI(800, 800)
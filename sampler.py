@@ -0,0 +1,98 @@
+# Jacqueline Lewis
+# sampler.py
+
+
+# This file reads the pressure and oxygen sensors on their own thread, so
+# that the sample rate does not depend on the frame rate of the user
+# interface and a slow I2C read never stalls it. Samples are kept in a
+# fixed-size ring buffer that the user interface reads without locking.
+
+
+import threading
+
+from devices import clock
+
+
+# This class is a fixed-size ring buffer for a single writer. The writer
+# fills a slot before it advances the count, so a reader that sees the
+# count also sees the sample; readers check the count again afterwards to
+# detect that the writer has lapped them.
+
+class RingBuffer(object):
+
+	def __init__(self, size):
+		self.size = size
+		self.slots = [None]*size
+		self.count = 0 # total number of samples ever written
+
+	def append(self, item):
+		self.slots[self.count % self.size] = item
+		self.count += 1
+
+	# This function returns the newest sample, or None if there is none.
+	def latest(self):
+		count = self.count
+		if count == 0: return None
+		return self.slots[(count-1) % self.size]
+
+	# This function returns the samples written after sample number start
+	# (oldest first) and the count to pass in next time.
+	def since(self, start):
+		while True:
+			count = self.count
+			start = max(start, count-self.size+1, 0)
+			items = [self.slots[i % self.size] for i in range(start,count)]
+			# the writer may have overwritten the oldest slots while copying
+			if self.count-start < self.size: return items,count
+			start = self.count-self.size+1
+
+	# This function returns the newest n samples, oldest first.
+	def window(self, n):
+		return self.since(self.count-n)[0]
+
+
+# This class samples the sensors at a fixed rate. read is a function that
+# returns a (pressure, oxygen) reading; each sample is stored in the buffer
+# as (time, pressure, oxygen) and passed to every listener.
+
+class Sampler(threading.Thread):
+
+	def __init__(self, read, rate=10.0, size=4096):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.read = read
+		self.period = 1.0/rate
+		self.buffer = RingBuffer(size)
+		self.listeners = []
+		self.errors = 0
+		self.running = threading.Event()
+
+	def latest(self):
+		return self.buffer.latest()
+
+	def since(self, start):
+		return self.buffer.since(start)
+
+	def window(self, n):
+		return self.buffer.window(n)
+
+	def run(self):
+		self.running.set()
+		deadline = clock.monotonic()
+		while self.running.is_set():
+			try: pressure,O2 = self.read()
+			except IOError:
+				# a failed I2C read is skipped rather than ending sampling
+				self.errors += 1
+			else:
+				sample = (clock.time(),pressure,O2)
+				self.buffer.append(sample)
+				for listener in self.listeners: listener(sample)
+			# sleeps to the next deadline so the rate does not drift
+			deadline += self.period
+			now = clock.monotonic()
+			if deadline < now: deadline = now
+			clock.sleep(deadline-now)
+
+	def stop(self):
+		self.running.clear()
@@ -0,0 +1,73 @@
+# Jacqueline Lewis
+# scheduler.py
+
+
+# This file keeps the timed events of a photoreactor (pictures, cycle
+# changes, quenching photos, the cursor blink) in a priority queue ordered
+# by deadline on the monotonic clock. The user interface sleeps until the
+# earliest deadline instead of checking every timer on a fixed tick, so each
+# event fires on time rather than at the next tick.
+
+
+import heapq
+import itertools
+
+from devices import clock
+
+
+# This class is a single scheduled event; cancelling it leaves it in the
+# queue but stops it from running.
+
+class Event(object):
+
+	def __init__(self, deadline, callback):
+		self.deadline = deadline
+		self.callback = callback
+		self.cancelled = False
+
+
+class Scheduler(object):
+
+	def __init__(self, maxWait=1.0):
+		self.queue = [] # heap of (deadline, order, event)
+		self.order = itertools.count() # keeps equal deadlines in order
+		self.maxWait = maxWait
+
+	# This function schedules callback() at a monotonic deadline.
+	def at(self, deadline, callback):
+		event = Event(deadline, callback)
+		heapq.heappush(self.queue, (deadline, next(self.order), event))
+		return event
+
+	# This function schedules callback() in delay seconds.
+	def after(self, delay, callback):
+		return self.at(clock.monotonic()+max(0,delay), callback)
+
+	def cancel(self, event):
+		if event is not None: event.cancelled = True
+
+	# This function returns the deadline of the next event, or None.
+	def nextDeadline(self):
+		while self.queue and self.queue[0][2].cancelled:
+			heapq.heappop(self.queue)
+		if not self.queue: return None
+		return self.queue[0][0]
+
+	# This function runs every event that is due and returns how many ran.
+	# Events scheduled by a callback for a time already past also run.
+	def runDue(self):
+		ran = 0
+		while True:
+			deadline = self.nextDeadline()
+			if deadline is None or deadline > clock.monotonic(): return ran
+			event = heapq.heappop(self.queue)[2]
+			event.callback()
+			ran += 1
+
+	# This function returns how many real seconds to sleep before the next
+	# event, at most maxWait.
+	def wait(self):
+		deadline = self.nextDeadline()
+		if deadline is None: return self.maxWait
+		wait = (deadline-clock.monotonic())/clock.speed
+		return min(self.maxWait, max(0, wait))
@@ -0,0 +1,19 @@
+# Jacqueline Lewis
+# sensors.py
+
+
+# This file says which sensor readings can be trusted. A pressure outside
+# the range of the sensor is a bad read, and the oxygen sensor only reads
+# true below the oxygen pressure. run.py, multireactor.py and the degas
+# controller all check readings here.
+
+
+PRESSURE_RANGE = (1300,1900) # pressures read outside this are out of bounds
+OXYGEN_PRESSURE = 1800 # the oxygen is only read below this pressure
+
+
+def pressureValid(pressure):
+	return PRESSURE_RANGE[0] < pressure < PRESSURE_RANGE[1]
+
+def oxygenValid(pressure):
+	return pressure < OXYGEN_PRESSURE
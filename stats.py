@@ -0,0 +1,83 @@
+# Jacqueline Lewis
+# stats.py
+
+
+# This file keeps running statistics of a sensor. Every sample updates a
+# rolling mean over a window and an exponentially weighted moving average
+# (EWMA) in constant time, and the rolling median is taken from the same
+# NumPy ring buffer when it is asked for. Samples that are far outside the
+# recent spread of the signal are rejected as noise.
+
+
+import math
+
+import numpy as np
+
+
+class StreamStats(object):
+
+	# window: number of samples in the rolling mean/median
+	# alpha: weight of a new sample in the EWMA
+	# reject: samples more than this many standard deviations from the EWMA
+	#	are rejected (None keeps every sample)
+	# streak: this many rejections in a row are taken as a real change in
+	#	the signal, and accepted
+	def __init__(self, window=15, alpha=0.2, reject=4.0, streak=3):
+		self.window = window
+		self.values = np.zeros(window)
+		self.count = 0 # samples accepted
+		self.total = 0.0 # sum of the samples in the window
+		self.alpha = alpha
+		self.average = None
+		self.variance = 0.0
+		self.reject = reject
+		self.streak = streak
+		self.rejected = 0
+		self.inARow = 0
+
+	def isOutlier(self, x):
+		if self.reject is None or self.count < self.window: return False
+		if self.inARow >= self.streak: return False
+		spread = math.sqrt(self.variance)
+		return spread > 0 and abs(x-self.average) > self.reject*spread
+
+	# This function adds a sample and returns False if it was rejected.
+	def update(self, x):
+		if self.isOutlier(x):
+			self.rejected += 1
+			self.inARow += 1
+			return False
+		self.inARow = 0
+		i = self.count % self.window
+		if self.count >= self.window: self.total -= self.values[i]
+		self.values[i] = x
+		self.total += x
+		self.count += 1
+		# recomputes the sum now and then so rounding errors cannot build up
+		if self.count % (self.window*64) == 0: self.total = self.values.sum()
+		if self.average is None: self.average = x
+		else:
+			diff = x-self.average
+			self.average += self.alpha*diff
+			self.variance = (1-self.alpha)*(self.variance+self.alpha*diff*diff)
+		return True
+
+	def size(self):
+		return min(self.count, self.window)
+
+	# These functions return None until a sample has been accepted.
+
+	def mean(self):
+		if self.count == 0: return None
+		return self.total/self.size()
+
+	def ewma(self):
+		return self.average
+
+	def median(self):
+		if self.count == 0: return None
+		return float(np.median(self.values[:self.size()]))
+
+	def std(self):
+		if self.count == 0: return None
+		return float(self.values[:self.size()].std())
@@ -0,0 +1,14 @@
+# Jacqueline Lewis
+# tests/conftest.py
+
+
+# The tests import the modules from the folder above, with the simulated
+# devices so they run without a pi.
+
+import os
+import sys
+
+os.environ.setdefault("PIE_BACKEND", "sim")
+# the web server of a reactor started by a test listens on any free port
+os.environ.setdefault("PIE_HTTP_PORT", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
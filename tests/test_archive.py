@@ -0,0 +1,50 @@
+# Jacqueline Lewis
+# tests/test_archive.py
+
+
+import io
+import os
+
+from PIL import Image
+
+import archive
+import catalog
+import exif
+
+
+NAMES = ["runA:y24m01d01H10M00S00.jpg", "runA:y24m01d01H10M10S00.jpg"]
+
+def makeRun(folder):
+	os.makedirs(folder)
+	jpeg = io.BytesIO()
+	Image.new("RGB", (16,16), (60,90,230)).save(jpeg, "JPEG")
+	for i,name in enumerate(NAMES):
+		exif.saveJpeg(os.path.join(folder, name), jpeg.getvalue(),
+			"Total Illumination: %d\nPressure: 1800\nOxygen: 5" % (10*i))
+
+
+# Only the folders of known runs are archived.
+
+def testOnlyKnownRunsAreArchived(tmp_path):
+	run,other = str(tmp_path / "run"),str(tmp_path / "other")
+	makeRun(run)
+	makeRun(other)
+	archiver = archive.Archiver(str(tmp_path), lambda: ["run"])
+	archiver.archiveAll()
+	assert archiver.archived == 2
+	assert archive.listPictures(run) == NAMES
+	assert not [n for n in os.listdir(run) if n.endswith(".jpg")]
+	assert sorted(n for n in os.listdir(other) if n.endswith(".jpg")) == NAMES
+
+# Archived pictures are still found by the catalog.
+
+def testCatalogReadsArchivedPictures(tmp_path):
+	run = str(tmp_path / "run")
+	makeRun(run)
+	archive.Archiver().pack(run, NAMES[:1], False)
+	pictures = catalog.Catalog(str(tmp_path / "catalog.db"))
+	assert pictures.rebuild([run], workers=1) == 2
+	rows = pictures.select(folder=run)
+	assert [os.path.basename(row[0]) for row in rows] == NAMES
+	assert [row[3] for row in rows] == [0, 600]
+	assert pictures.folders() == [run]
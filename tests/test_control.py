@@ -0,0 +1,47 @@
+# Jacqueline Lewis
+# tests/test_control.py
+
+
+import subprocess
+import threading
+
+from control import ControlServer, ControlClient
+
+
+def failing(request):
+	if request["command"] == "bad": raise ValueError("Must enter a folder")
+	raise subprocess.CalledProcessError(1, ["mkdir","x"])
+
+# The requests are served on the test's thread, as on the reactor's.
+
+def ask(server, client, request):
+	answer = []
+	def send():
+		try: answer.append(client.command(request))
+		except Exception as e: answer.append(e)
+	thread = threading.Thread(target=send)
+	thread.start()
+	while thread.is_alive(): server.serve(0.1)
+	return answer[0]
+
+
+# A command that fails is answered 500 with its error, and the connection
+# is kept.
+
+def testFailingCommandIsAnswered(tmp_path):
+	path = str(tmp_path / "pie.sock")
+	server = ControlServer(lambda: {"running":False}, failing, path)
+	server.start()
+	server.ready.wait()
+	client = ControlClient(path)
+	try:
+		refused = ask(server, client, {"command":"bad"})
+		assert isinstance(refused, ValueError)
+		assert str(refused) == "Must enter a folder"
+		failed = ask(server, client, {"command":"folder"})
+		assert isinstance(failed, ValueError)
+		assert str(failed).startswith("CalledProcessError:")
+		assert server.served == 2
+	finally:
+		client.close()
+		server.stop()
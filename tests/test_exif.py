@@ -0,0 +1,41 @@
+# Jacqueline Lewis
+# tests/test_exif.py
+
+
+import io
+
+from PIL import Image
+
+import exif
+
+
+def picture():
+	jpeg = io.BytesIO()
+	Image.new("RGB", (16,16), (60,90,230)).save(jpeg, "JPEG")
+	return jpeg.getvalue()
+
+def roundTrip(tmp_path, comment):
+	name = str(tmp_path / "picture.jpg")
+	exif.saveJpeg(name, picture(), comment)
+	Image.open(name).load() # still a readable JPEG
+	return exif.readComment(name)
+
+
+# Comments of 4 bytes or less are stored inside their IFD entry.
+
+def testEmptyComment(tmp_path):
+	assert roundTrip(tmp_path, "") == ""
+
+def testOneLetterComment(tmp_path):
+	assert roundTrip(tmp_path, "x") == "x"
+
+def testLongComment(tmp_path):
+	comment = "Solvent: water\nPressure: 1800\nO2: 4.2 %"
+	assert roundTrip(tmp_path, comment) == comment
+
+def testExifIsReplaced(tmp_path):
+	name = str(tmp_path / "picture.jpg")
+	jpeg = exif.insertExif(picture(), exif.exifBlock("first"))
+	exif.saveJpeg(name, jpeg, "second")
+	assert exif.readComment(name) == "second"
+	assert open(name, "rb").read().count(b"Exif\x00\x00") == 1
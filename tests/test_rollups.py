@@ -0,0 +1,27 @@
+# Jacqueline Lewis
+# tests/test_rollups.py
+
+
+import rollups
+from rollups import Rollups
+
+
+def fill(tiers, start, count):
+	for i in range(count):
+		tiers.sample((start+i*0.5, 1500.0+i%7, 20.9))
+
+
+# The tiers are closed before the log of the folder is opened again, and
+# carry on where they were.
+
+def testReopenedTiersKeepAppending(tmp_path):
+	path = str(tmp_path / "sensors.log")
+	first = Rollups(path)
+	fill(first, 0, 600)
+	first.close()
+	second = Rollups(path)
+	fill(second, 300, 2400)
+	second.close()
+	points = rollups.query(path, 0, 2000, 1)
+	assert len(points) == 1500
+	assert points["count"].sum() == 3000
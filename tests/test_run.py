@@ -0,0 +1,88 @@
+# Jacqueline Lewis
+# tests/test_run.py
+
+
+import time
+
+import run
+from devices import clock
+from textbuffer import TextBuffer
+from tslog import LogReader
+
+
+class Data(object): pass
+
+def metaData():
+	data = Data()
+	data.metadata = run.initMeta()
+	data.mEdit = TextBuffer(data.metadata)
+	data.metaTop = 0
+	data.metaView = (None,None)
+	return data
+
+
+# An imported file replaces the buffer, whose version starts again, so the
+# metadata box must not keep showing the old text.
+
+def testImportedMetadataIsDrawn():
+	data = metaData()
+	columns = run.metaColumns(data, "")
+	assert columns[0].split("\n")[:2] == ["Illumination Time:","Pressure:"]
+	run.metadataCommand(data, {"metadata":"Solvent: water\nCatalyst: none"})
+	columns = run.metaColumns(data, "")
+	assert columns[0] == "Solvent: water\nCatalyst: none"
+	assert columns[1] == columns[2] == ""
+
+def testEditedMetadataIsDrawn():
+	data = metaData()
+	run.metaColumns(data, "|")
+	data.mEdit.insert("x")
+	assert run.metaColumns(data, "|")[0].split("\n")[0] == "x|Illumination Time:"
+
+
+def startedReactor(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	data = Data()
+	data.width = data.height = 800
+	run.init(data)
+	state = run.runState(data)
+	state.update({"running":True, "startTime":clock.time(),
+		"lightOn":clock.time()})
+	data.resumable = state
+	return data
+
+
+# The illumination is counted from when the capture thread turned the lights
+# back on, not from when the interface got around to the finished job.
+
+def testLightsBackTimeIsTheCaptureThreads(tmp_path, monkeypatch):
+	data = startedReactor(tmp_path, monkeypatch)
+	try:
+		run.resumeCommand(data, {})
+		assert run.takePics(data, True)
+		while data.capture.done.empty(): time.sleep(0.05)
+		back = clock.time()
+		time.sleep(0.5)
+		data.capture.finish()
+		assert data.lights[0] and data.lightOn <= back
+	finally:
+		run.shutdown(data)
+
+
+# Resuming into the folder that is already open keeps its log, and the
+# sampler keeps logging to it.
+
+def testResumeKeepsSampling(tmp_path, monkeypatch):
+	data = startedReactor(tmp_path, monkeypatch)
+	try:
+		log = data.log
+		run.resumeCommand(data, {})
+		assert data.running and data.log is log
+		count = data.log.count
+		time.sleep(1.0)
+		assert data.log.count > count
+	finally:
+		run.shutdown(data)
+	reader = LogReader(str(tmp_path / "test" / "sensors.log"))
+	assert len(reader) > count
+	reader.close()
@@ -0,0 +1,36 @@
+# Jacqueline Lewis
+# tests/test_tslog.py
+
+
+import tslog
+from tslog import TimeSeriesLog, LogReader
+
+
+def fill(log, start, count):
+	for i in range(count):
+		log.log(start+i, tslog.SAMPLE, value1=1500.0, value2=20.9)
+
+
+# Reopening a log and closing the old handle used to cut the file short
+# under the new handle's map, so its next record crashed the process.
+
+def testReopenedLogKeepsAppending(tmp_path):
+	path = str(tmp_path / "sensors.log")
+	first = TimeSeriesLog(path)
+	fill(first, 0, 1000)
+	second = TimeSeriesLog(path)
+	first.close()
+	fill(second, 1000, 1000)
+	second.close()
+	reader = LogReader(path)
+	assert len(reader) == 2000
+	assert reader.array(0, 3000)["time"][-1] == 1999
+	reader.close()
+
+def testLastCloseTrimsTheFile(tmp_path):
+	path = str(tmp_path / "sensors.log")
+	log = TimeSeriesLog(path)
+	fill(log, 0, 10)
+	log.close()
+	assert (tmp_path / "sensors.log").stat().st_size == (tslog.HEADER.size +
+		10*tslog.RECORD.size)
@@ -0,0 +1,96 @@
+# Jacqueline Lewis
+# textbuffer.py
+
+
+# This file holds the text being edited in the metadata panel. The text is
+# kept as a list of lines, and the line with the cursor is a gap buffer:
+# the characters before the cursor on one stack and the characters after it
+# on another (reversed), so typing, backspacing and moving along the line
+# only push or pop a character. Moving to another line puts the line back
+# in the list, which costs the length of that line, not of the text, so an
+# imported file of any size edits as fast as the blank metadata.
+
+
+class TextBuffer(object):
+
+	def __init__(self, text=""):
+		self.lines = text.split("\n")
+		self.row = 0
+		self.before = [] # characters before the cursor
+		self.after = list(reversed(self.lines[0])) # after it, last first
+		self.version = 0 # changes whenever the text changes
+
+	# This function returns the whole text.
+	def text(self):
+		self.store()
+		return "\n".join(self.lines)
+
+	def lineCount(self):
+		return len(self.lines)
+
+	def line(self, i):
+		if i == self.row:
+			return "".join(self.before) + "".join(reversed(self.after))
+		return self.lines[i]
+
+	# This function returns the cursor as (line, column).
+	def cursor(self):
+		return self.row,len(self.before)
+
+	# These functions move the gap buffer to another line.
+	def store(self):
+		self.lines[self.row] = self.line(self.row)
+
+	def load(self, row, column):
+		self.store()
+		self.row = row
+		line = self.lines[row]
+		column = min(column, len(line))
+		self.before = list(line[:column])
+		self.after = list(reversed(line[column:]))
+
+	def setCursor(self, row, column):
+		self.load(min(max(row, 0), len(self.lines)-1), max(column, 0))
+
+	# This function types a character at the cursor; a return (or a pasted
+	# carriage return) splits the line.
+	def insert(self, char):
+		if char == "": return
+		self.version += 1
+		if char in "\r\n":
+			self.store()
+			line = self.lines[self.row]
+			column = len(self.before)
+			self.lines[self.row:self.row+1] = [line[:column],line[column:]]
+			self.row += 1
+			self.before = []
+		else: self.before.append(char)
+
+	# This function removes the character before the cursor, joining the line
+	# to the one above if the cursor is at its start.
+	def backspace(self):
+		if self.before:
+			self.before.pop()
+		elif self.row > 0:
+			above = self.lines[self.row-1]
+			del self.lines[self.row]
+			self.row -= 1
+			self.before = list(above)
+		else: return
+		self.version += 1
+
+	# These functions move the cursor. Left and right wrap around to the
+	# next line; up and down keep the column if the line is long enough.
+	def left(self):
+		if self.before: self.after.append(self.before.pop())
+		elif self.row > 0: self.load(self.row-1, len(self.lines[self.row-1]))
+
+	def right(self):
+		if self.after: self.before.append(self.after.pop())
+		elif self.row < len(self.lines)-1: self.load(self.row+1, 0)
+
+	def up(self):
+		if self.row > 0: self.load(self.row-1, len(self.before))
+
+	def down(self):
+		if self.row < len(self.lines)-1: self.load(self.row+1, len(self.before))
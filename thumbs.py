@@ -0,0 +1,121 @@
+# Jacqueline Lewis
+# thumbs.py
+
+
+# This file makes small copies of the pictures of a run, so they can be
+# browsed over the pi's WiFi without sending full 2592x1944 JPEGs. Each
+# picture gets a thumbnail in the .thumbs folder and a preview in the
+# .previews folder next to it, under the same name. They are made by a pool
+# of low priority processes, away from the capture thread and the user
+# interface. The JPEG decoder is asked for a reduced size (draft mode), so
+# the picture is scaled while it is decoded and the full size image is never
+# held in memory.
+
+# Usage (makes the missing thumbnails and previews of a folder):
+#	>>> python thumbs.py pictures/run1
+
+
+import concurrent.futures
+import os
+import sys
+
+THUMB = (320,240)
+PREVIEW = (1024,768)
+THUMBS = ".thumbs"
+PREVIEWS = ".previews"
+
+
+# These functions return the thumbnail and preview names of a picture.
+
+def thumbPath(path):
+	folder,name = os.path.split(path)
+	return os.path.join(folder, THUMBS, name)
+
+def previewPath(path):
+	folder,name = os.path.split(path)
+	return os.path.join(folder, PREVIEWS, name)
+
+def save(image, path):
+	folder = os.path.dirname(path)
+	if folder and not os.path.isdir(folder): os.makedirs(folder, exist_ok=True)
+	image.save(path + ".tmp", "JPEG", quality=80)
+	os.rename(path + ".tmp", path)
+
+
+# This function makes the preview and thumbnail of a picture. It runs in a
+# pool process. The preview is decoded at the smallest DCT scale that is
+# still at least PREVIEW, and the thumbnail is scaled from the preview.
+
+def makeThumbs(path):
+	from PIL import Image
+	image = Image.open(path)
+	image.draft("RGB", PREVIEW)
+	image = image.convert("RGB")
+	image.thumbnail(PREVIEW)
+	save(image, previewPath(path))
+	image.thumbnail(THUMB)
+	save(image, thumbPath(path))
+	return path
+
+
+# This function returns the pictures of a folder that have no thumbnail or
+# preview yet.
+
+def missing(folder):
+	paths = []
+	for name in sorted(os.listdir(folder)):
+		path = os.path.join(folder, name)
+		if not name.lower().endswith(".jpg") or not os.path.isfile(path):
+			continue
+		if not (os.path.isfile(thumbPath(path)) and
+				os.path.isfile(previewPath(path))):
+			paths.append(path)
+	return paths
+
+
+def lowPriority():
+	if hasattr(os, "nice"): os.nice(10)
+
+
+# This class hands pictures to the pool. The pool's processes are started
+# when it is made, so it should be made before any other thread starts.
+
+class ThumbnailPool(object):
+
+	def __init__(self, workers=None):
+		if workers is None: workers = max(1, min(2, (os.cpu_count() or 1)-1))
+		self.pool = concurrent.futures.ProcessPoolExecutor(workers,
+			initializer=lowPriority)
+		self.pool.submit(int).result()
+		self.made = 0
+		self.errors = 0
+
+	# This function queues pictures and returns their futures.
+	def submit(self, paths):
+		futures = []
+		for path in paths:
+			future = self.pool.submit(makeThumbs, path)
+			future.add_done_callback(self.done)
+			futures.append(future)
+		return futures
+
+	def done(self, future):
+		if future.cancelled() or future.exception() is not None:
+			self.errors += 1
+		else: self.made += 1
+
+	# This function queues every picture of a folder that is missing its
+	# thumbnail or preview.
+	def generateMissing(self, folder):
+		return self.submit(missing(folder))
+
+	def close(self, wait=True):
+		self.pool.shutdown(wait)
+
+
+if __name__ == "__main__":
+	pool = ThumbnailPool(os.cpu_count())
+	futures = pool.generateMissing(sys.argv[1] if len(sys.argv) > 1 else ".")
+	concurrent.futures.wait(futures)
+	pool.close()
+	print("%d made, %d failed" % (pool.made, pool.errors))
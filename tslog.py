@@ -0,0 +1,197 @@
+# Jacqueline Lewis
+# tslog.py
+
+
+# This file saves every sensor sample and event of a run to a binary log.
+# Records have a fixed width and are appended in time order through a
+# memory-mapped file, so writing one costs a copy into memory, and reading
+# any time range of a multi-day run is a binary search plus a slice instead
+# of parsing the whole file.
+
+# File layout:
+#	header: magic, version, record size, record count (HEADER)
+#	records: RECORD, one after another
+
+# Record kinds and their values:
+#	SAMPLE	value1 = pressure, value2 = oxygen
+#	RELAY	code = pin, value1 = 1 on / 0 off
+#	GAS	value1 = 1 valve open / 0 closed
+#	CAPTURE	code = light letter (0 for none), value1 = illumination time
+#	RUN	value1 = 1 run started / 0 run ended
+
+
+import mmap
+import os
+import struct
+import threading
+
+MAGIC = b"PIELOG"
+VERSION = 1
+HEADER = struct.Struct("<6sHHQ")
+RECORD = struct.Struct("<dBBHdd") # time, kind, flags, code, value1, value2
+DTYPE = [("time","<f8"),("kind","u1"),("flags","u1"),("code","<u2"),
+	("value1","<f8"),("value2","<f8")] # the same record for NumPy
+
+SAMPLE = 1
+RELAY = 2
+GAS = 3
+CAPTURE = 4
+RUN = 5
+
+_handles = {} # real path: logs open on it in this process
+_handlesLock = threading.Lock()
+
+
+# This class appends records to a log. The file is grown in chunks and
+# mapped into memory; the record count in the header is updated after each
+# record is written, so a reader never sees half a record. Records from
+# different threads may arrive a little out of order, so a record is never
+# given a time before the record written ahead of it. The unused end of the
+# last chunk is cut off when the last log open on the file is closed.
+
+class TimeSeriesLog(object):
+
+	def __init__(self, path, record=RECORD, chunk=1 << 20):
+		self.path = path
+		self.record = record
+		self.chunk = chunk - chunk % record.size
+		self.lock = threading.Lock()
+		exists = os.path.isfile(path) and os.path.getsize(path) > 0
+		self.file = open(path, "r+b" if exists else "w+b")
+		self.realPath = os.path.realpath(path)
+		with _handlesLock:
+			_handles[self.realPath] = _handles.get(self.realPath, 0) + 1
+		if exists:
+			self.count = readHeader(self.file, record)
+		else:
+			self.count = 0
+			self.file.write(HEADER.pack(MAGIC, VERSION, record.size, 0))
+			self.file.flush()
+		self.map = None
+		self.mapSize = 0
+		self.remap(HEADER.size + (self.count+1)*record.size)
+		self.lastTime = 0.0
+		if self.count > 0: self.lastTime = struct.unpack_from("<d", self.map,
+			HEADER.size + (self.count-1)*record.size)[0]
+
+	# This function makes sure the file and map are at least size bytes.
+	def remap(self, size):
+		if size <= self.mapSize: return
+		size = HEADER.size + ((size-HEADER.size)//self.chunk+1)*self.chunk
+		if self.map is not None: self.map.close()
+		if os.path.getsize(self.path) < size:
+			self.file.truncate(size)
+		self.map = mmap.mmap(self.file.fileno(), size)
+		self.mapSize = size
+
+	# This function appends one record made of the record's fields.
+	def append(self, *fields):
+		with self.lock:
+			if self.map is None: return # the log has been closed
+			if fields[0] < self.lastTime: fields = (self.lastTime,)+fields[1:]
+			self.lastTime = fields[0]
+			offset = HEADER.size + self.count*self.record.size
+			self.remap(offset + self.record.size)
+			self.record.pack_into(self.map, offset, *fields)
+			self.count += 1
+			HEADER.pack_into(self.map, 0, MAGIC, VERSION, self.record.size,
+				self.count)
+
+	# This function appends an event to a log of RECORDs.
+	def log(self, t, kind, code=0, value1=0.0, value2=0.0, flags=0):
+		self.append(t, kind, flags, code, value1, value2)
+
+	def flush(self):
+		with self.lock:
+			if self.map is not None: self.map.flush()
+
+	def close(self):
+		with self.lock:
+			if self.map is None: return
+			self.map.flush()
+			self.map.close()
+			self.map = None
+			with _handlesLock:
+				_handles[self.realPath] -= 1
+				# a file still mapped by another log keeps its last chunk
+				if _handles[self.realPath] == 0:
+					del _handles[self.realPath]
+					self.file.truncate(HEADER.size + self.count*self.record.size)
+			self.file.close()
+
+
+# This function checks the header of a log and returns its record count.
+
+def readHeader(f, record):
+	f.seek(0)
+	magic,version,size,count = HEADER.unpack(f.read(HEADER.size))
+	if magic != MAGIC: raise ValueError("Not a photoreactor log")
+	if version != VERSION or size != record.size:
+		raise ValueError("Unsupported log version %d" % version)
+	return count
+
+
+# This class reads a log, which may still be being written. Records are
+# read straight from the map; the first field of every record must be its
+# time, in increasing order.
+
+class LogReader(object):
+
+	def __init__(self, path, record=RECORD, dtype=DTYPE):
+		self.path = path
+		self.record = record
+		self.dtype = dtype
+		self.file = open(path, "rb")
+		self.map = None
+		self.count = 0
+		self.refresh()
+
+	# This function picks up records written since the log was opened.
+	def refresh(self):
+		count = readHeader(self.file, self.record)
+		size = min(os.path.getsize(self.path),
+			HEADER.size + count*self.record.size)
+		if self.map is not None: self.map.close()
+		self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+		self.count = (size-HEADER.size)//self.record.size
+
+	def __len__(self):
+		return self.count
+
+	def __getitem__(self, i):
+		if i < 0: i += self.count
+		if not 0 <= i < self.count: raise IndexError(i)
+		return self.record.unpack_from(self.map, HEADER.size + i*self.record.size)
+
+	def time(self, i):
+		return struct.unpack_from("<d", self.map, HEADER.size + i*self.record.size)[0]
+
+	# This function returns the index of the first record at or after t.
+	def find(self, t):
+		low,high = 0,self.count
+		while low < high:
+			mid = (low+high)//2
+			if self.time(mid) < t: low = mid+1
+			else: high = mid
+		return low
+
+	# This function returns the records from start up to (not including)
+	# end, optionally only those of one kind.
+	def range(self, start, end, kind=None):
+		first,last = self.find(start),self.find(end)
+		records = [self[i] for i in range(first,last)]
+		if kind is not None: records = [r for r in records if r[1] == kind]
+		return records
+
+	# This function returns the records from start to end as a NumPy array
+	# with named fields (DTYPE for a log of RECORDs).
+	def array(self, start=None, end=None):
+		import numpy as np
+		first = 0 if start is None else self.find(start)
+		last = self.count if end is None else self.find(end)
+		return np.frombuffer(self.map, np.dtype(self.dtype), last-first,
+			HEADER.size + first*self.record.size).copy()
+
+	def close(self):
+		self.map.close()
+		self.file.close()
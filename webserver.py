@@ -0,0 +1,290 @@
+# Jacqueline Lewis
+# webserver.py
+
+
+# This file serves the photoreactor over HTTP, instead of copying pictures
+# to /var/www/html by hand. It runs an asyncio server on its own thread, so
+# viewers never hold up the user interface, the sensors or the camera. The
+# number of requests handled at once is bounded, pictures are sent straight
+# from the file to the socket (sendfile), and every response has an ETag so
+# a browser that already has it gets a 304 instead of the whole picture.
+# It listens on PIE_HTTP_HOST and PIE_HTTP_PORT (0.0.0.0 and 8080 unless
+# they are set).
+
+# Pages:
+#	/					latest picture under each light, with the readings
+#	/readings			current pressure and oxygen (JSON)
+#	/latest/A.jpg		latest picture under light A (A-F, or "dark");
+#						?size=thumb or ?size=preview for a small copy
+#	/files/				pictures in the picture folder (JSON)
+#	/files/<name>		a picture, thumbnail (.thumbs/<name>) or preview
+#						(.previews/<name>) in the picture folder, or an
+#						archived picture of it
+
+
+import asyncio
+import email.utils
+import hashlib
+import json
+import os
+import re
+import threading
+import urllib.parse
+
+import archive
+import thumbs
+
+HOST = os.environ.get("PIE_HTTP_HOST", "0.0.0.0")
+PORT = int(os.environ.get("PIE_HTTP_PORT", "8080"))
+LETTERS = ["A","B","C","D","E","F","dark"]
+# picture names end in <letter>:y<year>m<month>...
+PICTURE = re.compile(r"([A-F]?):y\d\dm\d\dd\d\dH\d\dM\d\dS\d\d\.jpg$")
+TYPES = {".jpg":"image/jpeg", ".json":"application/json",
+	".html":"text/html; charset=utf-8"}
+
+class HTTPError(Exception):
+
+	def __init__(self, status, reason):
+		Exception.__init__(self, reason)
+		self.status = status
+		self.reason = reason
+
+
+# This function returns the light letter of a picture name ("dark" for a
+# picture without a light), or None if it is not a picture.
+
+def pictureLetter(name):
+	match = PICTURE.search(name)
+	if match is None: return None
+	return match.group(1) or "dark"
+
+def fileTag(stat, offset=0):
+	return '"%x-%x-%x"' % (stat.st_mtime_ns, stat.st_size, offset)
+
+def bodyTag(body):
+	return '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+
+
+# This class is the server. folder() returns the picture folder and
+# readings() the current sensor readings as a dict; both are called from
+# the server thread, so they should only read values that are replaced
+# whole.
+
+class WebServer(threading.Thread):
+
+	def __init__(self, folder, readings, host=HOST, port=PORT,
+			maxRequests=4, idle=15.0):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.folder = folder
+		self.readings = readings
+		self.host = host
+		self.port = port
+		self.maxRequests = maxRequests
+		self.idle = idle
+		self.latest = {} # (folder, letter): picture path
+		self.loop = None
+		self.stopping = None
+		self.ready = threading.Event()
+		self.served = 0
+		self.notModified = 0
+		self.error = None
+
+	# This function is told about each new picture, from any thread.
+	def published(self, path):
+		letter = pictureLetter(path)
+		if letter is not None:
+			self.latest[(os.path.dirname(path), letter)] = path
+
+	def run(self):
+		try: asyncio.run(self.serve())
+		except Exception as e:
+			self.error = e
+			self.ready.set()
+
+	async def serve(self):
+		self.loop = asyncio.get_running_loop()
+		self.stopping = asyncio.Event()
+		self.slots = asyncio.Semaphore(self.maxRequests)
+		server = await asyncio.start_server(self.connection, self.host,
+			self.port)
+		self.ready.set()
+		async with server:
+			await self.stopping.wait()
+
+	def stop(self):
+		if self.loop is not None and self.stopping is not None:
+			self.loop.call_soon_threadsafe(self.stopping.set)
+
+	# This function answers the requests of one connection until it is
+	# closed or idle. Connections wait for one of the request slots.
+	async def connection(self, reader, writer):
+		try:
+			while True:
+				try: head = await asyncio.wait_for(
+					reader.readuntil(b"\r\n\r\n"), self.idle)
+				except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+						asyncio.LimitOverrunError, ConnectionError):
+					return
+				lines = head.decode("latin-1").split("\r\n")
+				parts = lines[0].split(" ")
+				headers = {}
+				for line in lines[1:]:
+					if ":" in line:
+						key,value = line.split(":",1)
+						headers[key.strip().lower()] = value.strip()
+				keepAlive = (len(parts) == 3 and parts[2] == "HTTP/1.1" and
+					headers.get("connection","").lower() != "close")
+				async with self.slots:
+					try:
+						if len(parts) != 3: raise HTTPError(400, "Bad Request")
+						if parts[0] not in ("GET","HEAD"):
+							raise HTTPError(405, "Method Not Allowed")
+						await self.request(writer, parts[0], parts[1], headers,
+							keepAlive)
+					except HTTPError as e:
+						await self.respond(writer, e.status, e.reason,
+							(e.reason + "\n").encode(), ".txt", None, keepAlive)
+				self.served += 1
+				if not keepAlive: return
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+	async def request(self, writer, method, target, headers, keepAlive):
+		url = urllib.parse.urlsplit(target)
+		path = urllib.parse.unquote(url.path)
+		query = urllib.parse.parse_qs(url.query)
+		folder = self.folder()
+		if path == "/":
+			body = self.index(folder).encode("utf-8")
+		elif path == "/readings":
+			body = json.dumps(self.readings()).encode()
+		elif path == "/files/":
+			body = json.dumps(self.listing(folder)).encode()
+		elif path.startswith("/latest/") and path.endswith(".jpg"):
+			picture = self.latestPicture(folder, path[len("/latest/"):-4])
+			size = query.get("size",[""])[0]
+			if size == "thumb": picture = thumbs.thumbPath(picture)
+			elif size == "preview": picture = thumbs.previewPath(picture)
+			return await self.sendFile(writer, method, picture, headers,
+				keepAlive)
+		elif path.startswith("/files/"):
+			return await self.sendFile(writer, method,
+				self.folderFile(folder, path[len("/files/"):]), headers, keepAlive)
+		else: raise HTTPError(404, "Not Found")
+		kind = ".html" if path == "/" else ".json"
+		tag = bodyTag(body)
+		if headers.get("if-none-match") == tag:
+			self.notModified += 1
+			return await self.respond(writer, 304, "Not Modified", b"", kind, tag,
+				keepAlive)
+		if method == "HEAD":
+			return await self.respond(writer, 200, "OK", b"", kind, tag,
+				keepAlive, len(body))
+		await self.respond(writer, 200, "OK", body, kind, tag, keepAlive)
+
+	async def respond(self, writer, status, reason, body, kind, tag,
+			keepAlive, length=None):
+		lines = ["HTTP/1.1 %d %s" % (status, reason),
+			"Date: " + email.utils.formatdate(usegmt=True),
+			"Content-Type: " + TYPES.get(kind, "text/plain; charset=utf-8"),
+			"Content-Length: %d" % (len(body) if length is None else length),
+			"Cache-Control: no-cache",
+			"Connection: " + ("keep-alive" if keepAlive else "close")]
+		if tag is not None: lines.append("ETag: " + tag)
+		writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+		await writer.drain()
+
+	# This function sends a file without copying it through Python. An
+	# archived picture is sent straight from its shard.
+	async def sendFile(self, writer, method, path, headers, keepAlive):
+		offset,size = 0,None
+		try:
+			f = open(path, "rb")
+		except (OSError, TypeError):
+			found = path and archive.locate(path)
+			if not found: raise HTTPError(404, "Not Found")
+			f = open(found[0], "rb")
+			offset,size = found[1:]
+		with f:
+			stat = os.fstat(f.fileno())
+			if size is None: size = stat.st_size
+			tag = fileTag(stat, offset)
+			if headers.get("if-none-match") == tag:
+				self.notModified += 1
+				return await self.respond(writer, 304, "Not Modified", b"", ".jpg",
+					tag, keepAlive)
+			await self.respond(writer, 200, "OK", b"", os.path.splitext(path)[1],
+				tag, keepAlive, size)
+			if method == "GET":
+				await self.loop.sendfile(writer.transport, f, offset, size)
+
+	# This function returns a file in the picture folder, only allowing
+	# pictures and their thumbnails and previews.
+	def folderFile(self, folder, name):
+		parts = name.split("/")
+		if len(parts) == 2 and parts[0] in (thumbs.THUMBS, thumbs.PREVIEWS):
+			name = parts[1]
+		elif len(parts) != 1: raise HTTPError(404, "Not Found")
+		if name in ("", ".", "..") or not name.lower().endswith(".jpg"):
+			raise HTTPError(404, "Not Found")
+		return os.path.join(folder, *parts)
+
+	def latestPicture(self, folder, letter):
+		if letter not in LETTERS: raise HTTPError(404, "Not Found")
+		if (folder, letter) not in self.latest: self.scan(folder)
+		if self.latest[(folder, letter)] is None:
+			raise HTTPError(404, "Not Found")
+		return self.latest[(folder, letter)]
+
+	# This function finds the latest pictures of a folder that was not
+	# photographed while the server was running. Picture names sort by time
+	# within a letter.
+	def scan(self, folder):
+		latest = {}
+		for entry in self.entries(folder):
+			letter = pictureLetter(entry.name)
+			if letter is not None and entry.name > latest.get(letter, ""):
+				latest[letter] = entry.name
+		for letter,name in latest.items():
+			self.latest.setdefault((folder, letter), os.path.join(folder, name))
+		for letter in LETTERS:
+			self.latest.setdefault((folder, letter), None)
+
+	def entries(self, folder):
+		try: return [e for e in os.scandir(folder) if e.is_file() and
+			e.name.lower().endswith(".jpg")]
+		except OSError: return []
+
+	def listing(self, folder):
+		files = []
+		for entry in self.entries(folder):
+			stat = entry.stat()
+			files.append({"name":entry.name, "size":stat.st_size,
+				"time":stat.st_mtime, "light":pictureLetter(entry.name)})
+		for name,entry in archive.readIndex(folder).items():
+			files.append({"name":name, "size":entry["size"], "time":entry["time"],
+				"light":pictureLetter(name), "archived":True})
+		files.sort(key=lambda f: f["name"])
+		return {"folder":folder, "files":files}
+
+	def index(self, folder):
+		readings = self.readings()
+		cells = []
+		if (folder, LETTERS[0]) not in self.latest: self.scan(folder)
+		for letter in LETTERS:
+			if self.latest.get((folder, letter)) is not None:
+				cells.append('<p style="float: left; width: 32%%; margin-right: '
+					'1%%; text-align: center;"><a href="/latest/%s.jpg"><img src='
+					'"/latest/%s.jpg?size=preview" style="width:100%%;"></a>%s</p>'
+					% (letter, letter, "Light " + letter if len(letter) == 1
+						else "Dark"))
+		rows = "".join("<li>%s: %s</li>" % (key, value)
+			for key,value in sorted(readings.items()))
+		return ('<!DOCTYPE html><html><head><title>PiView</title>'
+			'<meta http-equiv="refresh" content="60"></head><body>'
+			'<h1>PiView</h1><ul>%s</ul>%s<p style="clear: both;">'
+			'<a href="/files/">All pictures</a></p></body></html>'
+			% (rows, "".join(cells)))